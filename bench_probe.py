@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# bench_probe.py
+# Benchmark đường nóng của probe, không cần Jetson/DeepStream:
+#   homography: per-object (1 lần transform_points/xe) vs batched (1 lần/frame) vs bảng tra (LUT)
+#   replay    : phát lại recording .sfmr (MetaRecorder hoặc synth) qua SpeedProbe + fakeds,
+#               báo percentile latency mỗi batch và throughput (frame/s)
+#   synth     : tạo recording tổng hợp (N xe/frame, N nguồn) rồi chạy như replay;
+#               --drop 0.2: xe chạy đều trên mặt đường (biết tốc độ thật), bỏ ngẫu nhiên 20% frame
+#               trước mux, so sai số tốc độ trip với bản không drop
+# So sánh với baseline: --json out.json lưu kết quả; --baseline old.json -> exit 1 nếu p50/p99 chậm hơn
+# quá --tolerance.
+#   python3 bench_probe.py synth --vehicles 10,30,60 --frames 3000
+#   python3 bench_probe.py replay logs/cam1.sfmr --baseline bench_base.json
+#   python3 bench_probe.py --timebase frame synth --drop 0.2      # cách tính cũ: sai khi drop
+#   python3 bench_probe.py --speed-log parquet synth --vehicles 60 # overhead của log từng phép đo
+import argparse, json, os, sys, tempfile, time
+import numpy as np
+import cv2
+
+from speedflow.homography import load_points, load_view_transformer
+from speedflow.zones import load_zones
+from speedflow.speed_log import FORMATS
+from speedflow.settings import HOMO_YML, MUX_WIDTH, MUX_HEIGHT, SPEED_ESTIMATOR, SPEED_TIMEBASE
+
+
+def _random_footpoints(n, rng, w=1280, h=720):
+    # list of python float như khi đọc rect_params từ meta
+    return np.stack([rng.uniform(0, w, n), rng.uniform(0, h, n)], axis=1).tolist()
+
+
+def bench_per_object(vt, pts, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = []
+        for cx, by in pts:
+            w = vt.transform_points(np.array([[cx, by]], dtype=np.float32))
+            out.append(float(w[0][1]))
+    return (time.perf_counter() - t0) / repeat
+
+
+def bench_batched(vt, pts, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        footpoints = [(cx, by) for cx, by in pts]
+        w = vt.transform_points(np.asarray(footpoints, dtype=np.float32))
+        out = [float(w[i, 1]) for i in range(len(footpoints))]
+    return (time.perf_counter() - t0) / repeat
+
+
+def run_homography(args):
+    vt = load_view_transformer(args.homo, MUX_WIDTH, MUX_HEIGHT, lut=False)
+    lut_nn = load_view_transformer(args.homo, MUX_WIDTH, MUX_HEIGHT, lut=True, bilinear=False)
+    lut_bl = load_view_transformer(args.homo, MUX_WIDTH, MUX_HEIGHT, lut=True, bilinear=True)
+    rng = np.random.default_rng(0)
+
+    # sai số bảng tra so với tính trực tiếp (mét), trên điểm ngẫu nhiên trong vùng đường (SOURCE);
+    # trên đường chân trời homography phân kỳ nên không so ở đó
+    source, _ = load_points(args.homo)
+    probe_pts = np.asarray(_random_footpoints(20000, rng, MUX_WIDTH, MUX_HEIGHT), dtype=np.float32)
+    poly = source.reshape(-1, 1, 2)
+    probe_pts = probe_pts[[cv2.pointPolygonTest(poly, (float(x), float(y)), False) >= 0 for x, y in probe_pts]]
+    ref = vt.transform_points(probe_pts)
+    for name, t in (("nearest", lut_nn), ("bilinear", lut_bl)):
+        err = np.abs(t.transform_points(probe_pts) - ref).max(axis=1)
+        print(f"[LUT] {name}: max err {err.max():.4f} m, p99 {np.percentile(err, 99):.4f} m")
+
+    print(f"{'objects':>8} {'per-object us':>14} {'batched us':>11} {'lut nn us':>10} {'lut bl us':>10}")
+    for n in [int(x) for x in args.counts.split(",") if x.strip()]:
+        pts = _random_footpoints(n, rng)
+        t_obj = bench_per_object(vt, pts, args.repeat)
+        t_bat = bench_batched(vt, pts, args.repeat)
+        t_nn = bench_batched(lut_nn, pts, args.repeat)
+        t_bl = bench_batched(lut_bl, pts, args.repeat)
+        print(f"{n:>8} {t_obj * 1e6:>14.1f} {t_bat * 1e6:>11.1f} {t_nn * 1e6:>10.1f} {t_bl * 1e6:>10.1f}")
+    return {}
+
+
+# -------------------- replay (SpeedProbe + fakeds) --------------------
+def _make_probe(args, n_sources, stages=False):
+    from speedflow.probes import SpeedProbe
+    from speedflow.speed_core import SourceConfig
+    source, _ = load_points(args.homo)
+    vt = load_view_transformer(args.homo, MUX_WIDTH, MUX_HEIGHT, lut=args.lut != "off",
+                               bilinear=args.lut == "bilinear")
+    zones = load_zones(args.homo, source)
+    sources = [SourceConfig(i, f"cam{i}", vt, source, zones=zones) for i in range(n_sources)]
+    # stages: bật StageStats nhưng không chụp định kỳ (đọc 1 lần sau khi chạy xong)
+    probe = SpeedProbe(sources=sources, save_snapshots=args.snapshots,
+                       stats_interval_s=1e9 if stages else 0, speed_estimator=args.estimator,
+                       speed_timebase=args.timebase, speed_log=args.speed_log, edge_db=args.edge_db)
+    # publisher rỗng: vẫn đi qua nhánh cooldown/crop/encode như khi chạy thật
+    probe.set_publisher(lambda payload: None)
+    return probe
+
+
+def _summary(res) -> dict:
+    lat = res["latency_s"]
+    busy = float(lat.sum())
+    return {
+        "batches": res["batches"],
+        "frames": res["frames"],
+        "objects": res["objects"],
+        "p50_ms": float(np.percentile(lat, 50) * 1e3) if len(lat) else 0.0,
+        "p90_ms": float(np.percentile(lat, 90) * 1e3) if len(lat) else 0.0,
+        "p99_ms": float(np.percentile(lat, 99) * 1e3) if len(lat) else 0.0,
+        "max_ms": float(lat.max() * 1e3) if len(lat) else 0.0,
+        "mean_ms": float(lat.mean() * 1e3) if len(lat) else 0.0,
+        "fps": res["frames"] / busy if busy > 0 else 0.0,      # throughput của riêng probe
+    }
+
+
+def _print_row(name, r):
+    print(f"{name:>14} {r['frames']:>7} {r['objects'] / max(r['frames'], 1):>8.1f} "
+          f"{r['p50_ms']:>8.3f} {r['p90_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['max_ms']:>8.3f} {r['fps']:>10.0f}")
+
+
+def _bench_recording(args, name, path, trips=None):
+    """trips: dict nhận (camera_id, track_id) -> median_kmh của các trip (None = không thu)."""
+    from speedflow.metarec import open_recording
+    from speedflow.replay import replay
+    recs = open_recording(path)
+    n_sources = int(recs["source_id"].max()) + 1 if len(recs) else 1
+    if args.warmup:
+        # probe riêng cho warmup: lần đo chính bắt đầu với trạng thái track trống
+        probe = _make_probe(args, n_sources)
+        replay(recs, probe, limit=args.warmup)
+        probe.close()
+    probe = _make_probe(args, n_sources, stages=args.stages)
+    if trips is not None:
+        probe.add_trip_sink(lambda rec: trips.__setitem__((rec.camera_id, rec.track_id), rec.median_kmh))
+    try:
+        r = _summary(replay(recs, probe, limit=args.limit))
+    finally:
+        probe.close()
+    _print_row(name, r)
+    if probe.stats is not None:
+        from speedflow.stage_stats import format_snapshot
+        snap = probe.stats.snapshot()
+        print(" " * 15 + format_snapshot(snap))
+        r["stages"] = snap["stages"]
+    return r
+
+
+_HEADER_ROW = f"{'case':>14} {'frames':>7} {'obj/frm':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'probe fps':>10}"
+
+
+def run_replay(args):
+    print(_HEADER_ROW)
+    return {os.path.basename(args.recording): _bench_recording(args, os.path.basename(args.recording)[:14],
+                                                                 args.recording)}
+
+
+def _trip_speeds(args, path) -> dict:
+    """Chạy recording (không đo, không in) -> (camera_id, track_id) -> median_kmh."""
+    from speedflow.metarec import open_recording
+    from speedflow.replay import replay
+    recs = open_recording(path)
+    probe = _make_probe(args, int(recs["source_id"].max()) + 1 if len(recs) else 1)
+    trips = {}
+    probe.add_trip_sink(lambda rec: trips.__setitem__((rec.camera_id, rec.track_id), rec.median_kmh))
+    try:
+        replay(recs, probe, limit=args.limit)
+    finally:
+        probe.close()
+    return trips
+
+
+def speed_error(trips: dict, ref: dict) -> dict:
+    """Sai lệch tương đối median_kmh của từng trip so với ref[(camera_id, track_id)] (km/h)."""
+    err = np.array([abs(v - ref[k]) / ref[k] for k, v in trips.items()
+                    if v is not None and ref.get(k)], dtype=np.float64)
+    return {
+        "trips": int(len(err)),
+        "p50_pct": float(np.percentile(err, 50) * 100) if len(err) else 0.0,
+        "p90_pct": float(np.percentile(err, 90) * 100) if len(err) else 0.0,
+        "max_pct": float(err.max() * 100) if len(err) else 0.0,
+    }
+
+
+def run_synth(args):
+    from speedflow.metarec import synth_recording
+    print(_HEADER_ROW)
+    out = {}
+    with tempfile.TemporaryDirectory() as d:
+        for n in [int(x) for x in args.vehicles.split(",") if x.strip()]:
+            name = f"v{n}x{args.sources}"
+            if args.drop <= 0:
+                path = synth_recording(os.path.join(d, name + ".sfmr"), frames=args.frames, vehicles=n,
+                                       sources=args.sources)
+                out[name] = _bench_recording(args, name, path)
+                continue
+            traffic = _world_traffic(args, n)
+            truth = lambda trips: {k: traffic[int(k[0][3:])].kmh(k[1]) for k in trips}
+            ref_path = synth_recording(os.path.join(d, name + "_ref.sfmr"), frames=args.frames, traffic=traffic)
+            ref = _trip_speeds(args, ref_path)
+            path = synth_recording(os.path.join(d, name + ".sfmr"), frames=args.frames, traffic=traffic,
+                                   drop=args.drop)
+            trips = {}
+            r = out[name] = _bench_recording(args, name, path, trips)
+            e0 = speed_error(ref, truth(ref))
+            e = r["speed_err"] = speed_error(trips, truth(trips))
+            print(" " * 15 + f"speed |err| vs true ({args.estimator}/{args.timebase}): "
+                  f"no drop p50 {e0['p50_pct']:.1f}% p90 {e0['p90_pct']:.1f}% | "
+                  f"{args.drop * 100:.0f}% dropped p50 {e['p50_pct']:.1f}% p90 {e['p90_pct']:.1f}% "
+                  f"max {e['max_pct']:.1f}% ({e['trips']} trips)")
+    return out
+
+
+def _world_traffic(args, n):
+    """Mỗi nguồn N xe chạy đều trên vùng TARGET của --homo (camera_id cam<i> = nguồn i)."""
+    from speedflow.metarec import WorldTraffic
+    _, target = load_points(args.homo)
+    vt = load_view_transformer(args.homo, MUX_WIDTH, MUX_HEIGHT)
+    return [WorldTraffic(vt.to_pixel, float(target[:, 0].max()), float(target[:, 1].max()), n, seed=s)
+            for s in range(args.sources)]
+
+
+def check_baseline(results: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path, "r") as f:
+        base = json.load(f)
+    ok = True
+    for case, r in results.items():
+        b = base.get(case)
+        if not b:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if b[key] > 0 and r[key] > b[key] * (1.0 + tolerance):
+                print(f"[REGRESSION] {case} {key}: {r[key]:.3f} ms > baseline {b[key]:.3f} ms "
+                      f"(+{(r[key] / b[key] - 1) * 100:.0f}%)")
+                ok = False
+    if ok:
+        print(f"[OK] within {tolerance * 100:.0f}% of {baseline_path}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hot path của SpeedProbe (không cần DeepStream)")
+    parser.add_argument("--homo", default=str(HOMO_YML), help="YAML SOURCE/TARGET")
+    parser.add_argument("--lut", default="off", choices=("off", "nearest", "bilinear"),
+                        help="replay/synth: homography tính trực tiếp (mặc định) hay qua bảng tra")
+    parser.add_argument("--estimator", default=SPEED_ESTIMATOR, choices=("kalman", "window"),
+                        help="replay/synth: cách ước lượng tốc độ (speed_core)")
+    parser.add_argument("--timebase", default=SPEED_TIMEBASE, choices=("pts", "frame"),
+                        help="replay/synth: thời gian giữa các mẫu theo PTS hay số frame")
+    parser.add_argument("--speed-log", default="off", choices=FORMATS,
+                        help="replay/synth: bật log từng phép đo (đo overhead của speed_log.py)")
+    parser.add_argument("--edge-db", default=None, metavar="PATH",
+                        help="replay/synth: ghi overspeed/trip vào SQLite (đo overhead của edge_db.py)")
+    sub = parser.add_subparsers(dest="cmd")
+
+    p = sub.add_parser("homography", help="per-object vs batched transform_points")
+    p.add_argument("--counts", default="1,5,10,20,30,45,60,90", help="số xe mỗi frame")
+    p.add_argument("--repeat", type=int, default=2000, help="số frame mỗi phép đo")
+    # không có subcommand = homography với tham số mặc định, giữ các cờ chung (--homo, ...)
+    parser.set_defaults(cmd="homography", counts=p.get_default("counts"), repeat=p.get_default("repeat"))
+
+    for name, hlp in (("replay", "phát lại recording .sfmr"), ("synth", "recording tổng hợp")):
+        p = sub.add_parser(name, help=hlp)
+        if name == "replay":
+            p.add_argument("recording", help="file .sfmr (run_webrtc.py/run_multi.py --record-meta)")
+        else:
+            p.add_argument("--vehicles", default="5,20,60", help="số xe mỗi frame (mỗi nguồn)")
+            p.add_argument("--frames", type=int, default=3000, help="số frame mỗi nguồn")
+            p.add_argument("--sources", type=int, default=1, help="số nguồn trong 1 batch")
+            p.add_argument("--drop", type=float, default=0.0,
+                           help="tỉ lệ frame bị bỏ ngẫu nhiên trước mux (so tốc độ với bản không drop)")
+        p.add_argument("--limit", type=int, default=None, help="chỉ chạy N batch đầu")
+        p.add_argument("--warmup", type=int, default=50, help="số batch chạy trước (không đo)")
+        p.add_argument("--snapshots", action="store_true", help="bật ghi ảnh overspeed xuống đĩa")
+        p.add_argument("--stages", action="store_true", help="đo thêm thời gian từng stage (StageStats)")
+        p.add_argument("--json", default=None, help="lưu kết quả ra file JSON (làm baseline)")
+        p.add_argument("--baseline", default=None, help="JSON baseline để so sánh")
+        p.add_argument("--tolerance", type=float, default=0.2, help="cho phép chậm hơn baseline (tỉ lệ)")
+
+    args = parser.parse_args()
+    results = {"homography": run_homography, "replay": run_replay, "synth": run_synth}[args.cmd](args)
+
+    if getattr(args, "json", None):
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if getattr(args, "baseline", None) and not check_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# edge_query.py
+# Truy vấn kho sự kiện SQLite trên edge (speedflow/edge_db.py, ghi bởi SpeedProbe), mở read-only
+# nên chạy được song song với pipeline. Thời gian theo giờ máy (localtime).
+#   python3 edge_query.py count --camera cam2 --day yesterday --from 07:00 --to 09:00 --min-kmh 80
+#   python3 edge_query.py hourly --camera cam2 --day 2026-10-16
+#   python3 edge_query.py top --since "2026-10-16 06:00" --limit 20
+#   python3 edge_query.py track 1000042 --camera cam2
+#   python3 edge_query.py cameras
+#   python3 edge_query.py prune --days 14          # xoá tay (pipeline tự xoá theo EDGE_DB_RETENTION_DAYS)
+import argparse, sys, time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from speedflow.settings import EDGE_DB_PATH
+from speedflow.edge_db import (SPEED_COLUMNS, connect, prune, count_vehicles, count_alerts,
+                               hourly, top_speeds, track_events, cameras)
+
+
+def _fmt_ts(ts):
+    return "-" if ts is None else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def _parse_day(s: str) -> datetime:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if s == "today":
+        return today
+    if s == "yesterday":
+        return today - timedelta(days=1)
+    return datetime.strptime(s, "%Y-%m-%d")
+
+
+def _parse_hhmm(s: str) -> timedelta:
+    h, _, m = s.partition(":")
+    return timedelta(hours=int(h), minutes=int(m or 0))
+
+
+def time_range(args):
+    """--day [+ --from/--to] hoặc --since/--until (ISO, giờ máy) -> (t0, t1) epoch, None = không giới hạn."""
+    t0 = t1 = None
+    if args.day:
+        day = _parse_day(args.day)
+        t0 = (day + _parse_hhmm(args.time_from or "00:00")).timestamp()
+        t1 = (day + _parse_hhmm(args.time_to or "24:00")).timestamp()
+    elif args.time_from or args.time_to:
+        raise SystemExit("--from/--to need --day")
+    if args.since:
+        t0 = datetime.fromisoformat(args.since).timestamp()
+    if args.until:
+        t1 = datetime.fromisoformat(args.until).timestamp()
+    return t0, t1
+
+
+def _range_text(t0, t1):
+    return f"[{_fmt_ts(t0) if t0 is not None else '...'} -> {_fmt_ts(t1) if t1 is not None else '...'})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Truy vấn sự kiện overspeed/trip lưu trên edge (SQLite)")
+    parser.add_argument("--db", default=str(EDGE_DB_PATH), help="file SQLite (EDGE_DB_PATH)")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--camera", default=None, help="camera_id (mặc định: mọi camera)")
+    common.add_argument("--day", default=None, help="today | yesterday | YYYY-MM-DD")
+    common.add_argument("--from", dest="time_from", default=None, metavar="HH:MM", help="giờ bắt đầu trong --day")
+    common.add_argument("--to", dest="time_to", default=None, metavar="HH:MM", help="giờ kết thúc (không gồm)")
+    common.add_argument("--since", default=None, help="'YYYY-MM-DD HH:MM[:SS]' (ghi đè --day)")
+    common.add_argument("--until", default=None, help="'YYYY-MM-DD HH:MM[:SS]' (không gồm)")
+    common.add_argument("--by", default="max", choices=tuple(SPEED_COLUMNS),
+                        help="tốc độ của trip dùng để so/sắp xếp")
+    sub = parser.add_subparsers(dest="cmd")
+
+    p = sub.add_parser("count", parents=[common], help="số xe (trip) và số cảnh báo overspeed")
+    p.add_argument("--min-kmh", type=float, default=None, help="chỉ đếm xe có tốc độ > N km/h")
+    p = sub.add_parser("hourly", parents=[common], help="số xe / km/h trung bình / lớn nhất theo giờ")
+    p.add_argument("--min-kmh", type=float, default=None, help="chỉ tính xe có tốc độ > N km/h")
+    p = sub.add_parser("top", parents=[common], help="các xe nhanh nhất")
+    p.add_argument("--limit", type=int, default=10)
+    p = sub.add_parser("track", help="trip + cảnh báo của 1 track_id")
+    p.add_argument("track_id", type=int)
+    p.add_argument("--camera", default=None)
+    sub.add_parser("cameras", help="số xe / khoảng thời gian có dữ liệu theo camera")
+    p = sub.add_parser("prune", help="xoá sự kiện cũ hơn N ngày")
+    p.add_argument("--days", type=float, required=True)
+    args = parser.parse_args()
+    if args.cmd is None:
+        parser.print_help()
+        return 2
+    if not Path(args.db).exists():
+        print(f"ERROR: {args.db} not found", file=sys.stderr)
+        return 1
+
+    if args.cmd == "prune":
+        conn = connect(args.db)
+        print(f"pruned {prune(conn, args.days * 86400.0)} rows older than {args.days:g} days")
+        conn.close()
+        return 0
+
+    conn = connect(args.db, readonly=True)
+    if args.cmd == "count":
+        t0, t1 = time_range(args)
+        n = count_vehicles(conn, t0, t1, args.camera, args.min_kmh, by=args.by)
+        alerts, alerted = count_alerts(conn, t0, t1, args.camera, args.min_kmh)
+        speed = f" {args.by}_kmh > {args.min_kmh:g}" if args.min_kmh is not None else ""
+        print(f"{args.camera or 'all cameras'} {_range_text(t0, t1)}{speed}")
+        print(f"  vehicles (trips): {n}")
+        print(f"  overspeed alerts: {alerts} ({alerted} vehicles)")
+    elif args.cmd == "hourly":
+        t0, t1 = time_range(args)
+        print(f"{'hour':<17} {'vehicles':>8} {'avg':>7} {'max':>7}   ({args.by}_kmh)")
+        for hour, n, avg, mx in hourly(conn, t0, t1, args.camera, args.min_kmh, by=args.by):
+            print(f"{hour:<17} {n:>8} {avg if avg is not None else '-':>7} {mx if mx is not None else '-':>7}")
+    elif args.cmd == "top":
+        t0, t1 = time_range(args)
+        for ts, cam, tid, cls, kmh, snap in top_speeds(conn, t0, t1, args.camera, args.limit, by=args.by):
+            print(f"{_fmt_ts(ts)}  {cam:<8} track={tid:<10} class={cls}  {kmh:6.1f} km/h  {snap or ''}")
+    elif args.cmd == "track":
+        trips, alerts = track_events(conn, args.track_id, args.camera)
+        for first, last, cam, zone, n, mean, med, mx, snap in trips:
+            print(f"trip  {_fmt_ts(first)} -> {_fmt_ts(last)}  {cam} zone={zone} samples={n} "
+                  f"mean={mean} median={med} max={mx} {snap or ''}")
+        for ts, cam, kmh, zone in alerts:
+            print(f"alert {_fmt_ts(ts)}  {cam} zone={zone} {kmh:.1f} km/h")
+        if not trips and not alerts:
+            print("no events")
+    elif args.cmd == "cameras":
+        print(f"{'camera':<10} {'vehicles':>8} {'alerts':>7}  {'first':<19}  {'last':<19}")
+        for cam, n, first, last, alerts in cameras(conn):
+            print(f"{cam:<10} {n:>8} {alerts:>7}  {_fmt_ts(first):<19}  {_fmt_ts(last):<19}")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
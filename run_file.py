@@ -9,9 +9,10 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 
 from speedflow.pipeline_file import build_file_pipeline  
-from speedflow.homography import load_points, ViewTransformer
+from speedflow.homography import load_points, load_view_transformer
 from speedflow.settings import HOMO_YML
 from speedflow.probes import SpeedProbe
+from speedflow.zones import load_zones
 
 
 def main():
@@ -61,9 +62,9 @@ def main():
             sink.set_property("location", out_path)
 
 
-    source_pts, target_pts = load_points(args.homo)
-    vt = ViewTransformer(source_pts, target_pts)
-    probe = SpeedProbe(vt, roi_source_points=source_pts)
+    source_pts, _ = load_points(args.homo)
+    vt = load_view_transformer(args.homo, 1920, 1080)   # = mux của build_file_pipeline
+    probe = SpeedProbe(vt, roi_source_points=source_pts, zones=load_zones(args.homo, source_pts))
     osd_sink_pad = nvdsosd.get_static_pad("sink")
     if not osd_sink_pad:
         print("ERROR: Unable to get sink pad of nvdsosd", file=sys.stderr)
@@ -101,6 +102,7 @@ def main():
         print("Interrupted by user.")
     finally:
         pipeline.set_state(Gst.State.NULL)
+        probe.close()
         try:
             probe.logger.close()
         except Exception:
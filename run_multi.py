@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# run_multi.py
+# 1 process cho N camera: N nguồn -> 1 nvstreammux (batch N) -> 1 nvinfer/TensorRT context.
+# Mỗi nguồn có file TXT riêng (HOMO_YML, VIDEO_FPS, CAMERA_ID), trạng thái tốc độ khoá theo
+# (source_id, track_id). Ví dụ:
+#   python3 run_multi.py --src rtsp://.../101 cam1.txt --src file:///home/mta/highway2.mp4 cam2.txt \
+#       --server 192.168.0.158 --room demo
+import os, sys, argparse, asyncio, threading, gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+import speedflow.settings as S
+from speedflow.speed_core import load_source
+from speedflow.probes import SpeedProbe
+from speedflow.speed_log import FORMATS
+from speedflow.replay import MetaRecorder
+from speedflow.spool import make_forwarder
+from speedflow.infer_control import attach_adaptive_interval
+from speedflow.pipeline_multi import SINKS, build_multi_pipeline
+from speedflow.event_proto import WIRE_FORMATS, WIRE_JSON, check_wire_format, encode_message
+
+import websockets
+
+
+class EventLink:
+    """Gửi event (overspeed/trip) lên signaling server với role=pub, không kèm WebRTC video."""
+    def __init__(self, ws_uri, wire_format: str = WIRE_JSON, spool_dir=None):
+        self.ws_uri = ws_uri
+        self.wire_format = check_wire_format(wire_format)
+        self.ws = None
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="event-link", daemon=True)
+        self._thread.start()
+        # mất WS: event ghi spool trên đĩa, phát lại theo thứ tự khi nối lại (spool.py)
+        self.forwarder = None
+        if spool_dir:
+            self.forwarder = make_forwarder(spool_dir, lambda: self.ws, self.wire_format, tag="[MULTI]")
+            self.forwarder.start(self.loop)
+        asyncio.run_coroutine_threadsafe(self._connect_loop(), self.loop)
+
+    async def _connect_loop(self):
+        while True:
+            try:
+                self.ws = await websockets.connect(self.ws_uri)
+                print("[MULTI] WS connected", self.ws_uri)
+                await self.ws.wait_closed()
+            except Exception as e:
+                print("[MULTI] WS connect failed, retrying...", e)
+            self.ws = None
+            await asyncio.sleep(1.2)
+
+    def send_threadsafe(self, data: dict):
+        if self.forwarder is not None:
+            self.forwarder.publish(data)
+            return
+        ws = self.ws
+        if not ws: return
+        try:
+            msg = encode_message(data, self.wire_format)
+            asyncio.run_coroutine_threadsafe(ws.send(msg), self.loop)
+        except Exception as e:
+            print("[MULTI] publish failed:", e)
+
+    def close(self):
+        # đóng forwarder khi loop còn chạy (huỷ + đợi task phát lại), rồi mới dừng loop
+        if self.forwarder is not None:
+            self.forwarder.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepStream multi-camera runner (1 nvstreammux, batch N)")
+    parser.add_argument("--src", nargs=2, action="append", metavar=("URI", "CFG"), required=True,
+                        help="nguồn (RTSP/file) + file TXT riêng của camera; lặp lại cho mỗi camera")
+    parser.add_argument("--analytics", default=None,
+                        help="file nvdsanalytics dùng chung (ROI từng nguồn ở [roi-filtering-stream-<i>]); "
+                             "mặc định: ANALYTICS_CFG của nguồn đầu tiên nếu USE_NVDSANALYTICS, không thì bỏ "
+                             "(ROI lọc trong probe theo zone từng nguồn)")
+    parser.add_argument("--sink", action="append", choices=SINKS, default=None,
+                        help="display | file | fake; lặp lại để xuất nhiều output từ 1 lần suy luận")
+    parser.add_argument("--out", default=None, help="file mp4 khi --sink file")
+    parser.add_argument("--record-meta", default=None,
+                        help="ghi metadata object từng frame ra file .sfmr (replay/benchmark: bench_probe.py)")
+    parser.add_argument("--probe-stats", type=float, default=S.PROBE_STATS_INTERVAL_S, metavar="SECONDS",
+                        help="log (và publish type=probe_stats) thời gian từng stage của probe mỗi N giây; 0 = tắt")
+    parser.add_argument("--trace", type=float, default=S.PIPELINE_TRACE_INTERVAL_S, metavar="SECONDS",
+                        help="log latency/fps từng element GStreamer + bottleneck mỗi N giây; 0 = tắt")
+    parser.add_argument("--speed-log", default=S.SPEED_LOG_FORMAT, choices=FORMATS,
+                        help="log mọi phép đo (xe x frame) vào SPEED_LOG_DIR, ghi lô ở thread nền, xoay file")
+    parser.add_argument("--edge-db", default=str(S.EDGE_DB_PATH) if S.EDGE_DB_PATH else "", metavar="PATH",
+                        help="SQLite lưu overspeed/trip trên máy (truy vấn: edge_query.py); '' = tắt")
+    parser.add_argument("--spool", default=str(S.SPOOL_DIR) if S.SPOOL_DIR else "", metavar="DIR",
+                        help="event chờ gửi khi mất WS lưu ở DIR/multi_<room>, phát lại khi nối lại; '' = tắt")
+    parser.add_argument("--adaptive-interval", action=argparse.BooleanOptionalAction, default=S.INFER_ADAPTIVE,
+                        help="tự chỉnh interval của nvinfer theo tải và số xe (đường vắng/quá tải)")
+    parser.add_argument("--server", default=None, help="IP server WS signaling (bỏ trống = không publish)")
+    parser.add_argument("--room", default="demo", help="room name")
+    parser.add_argument("--wire", default=WIRE_JSON, choices=WIRE_FORMATS,
+                        help="định dạng event: json (image_b64) hoặc binary (msgpack + JPEG thô)")
+    args = parser.parse_args()
+
+    sources = [load_source(i, uri, cfg) for i, (uri, cfg) in enumerate(args.src)]
+    cams = [s.camera_id for s in sources]
+    if len(set(cams)) != len(cams):
+        print(f"ERROR: CAMERA_ID bị trùng giữa các nguồn: {cams}", file=sys.stderr)
+        sys.exit(1)
+    for s in sources:
+        print(f"[CFG] source {s.source_id}: {s.camera_id} fps={s.fps} uri={s.uri}")
+
+    Gst.init(None)
+    pipeline, tiler = build_multi_pipeline([s.uri for s in sources],
+                                           analytics_cfg=args.analytics or (sources[0].analytics_cfg
+                                                                            if S.USE_NVDSANALYTICS else None),
+                                           sink=args.sink or ["display"], out_path=args.out,
+                                           trace_interval_s=args.trace)
+    probe = SpeedProbe(sources=sources, cooldown_s=2.5, stats_interval_s=args.probe_stats,
+                       speed_log=args.speed_log, edge_db=args.edge_db or None)
+    if args.adaptive_interval:
+        # 1 batch / frame của mỗi nguồn -> ngân sách theo nguồn chậm nhất
+        attach_adaptive_interval(pipeline, probe, fps=min(s.fps for s in sources))
+    pad = tiler.get_static_pad("sink")
+    recorder = None
+    if args.record_meta:
+        recorder = MetaRecorder(args.record_meta)
+        pad.add_probe(Gst.PadProbeType.BUFFER, recorder.osd_sink_pad_buffer_probe, None)
+    pad.add_probe(Gst.PadProbeType.BUFFER, probe.osd_sink_pad_buffer_probe, None)
+
+    link = None
+    if args.server:
+        link = EventLink(f"ws://{args.server}:8080/ws?room={args.room}&role=pub", wire_format=args.wire,
+                         spool_dir=os.path.join(args.spool, f"multi_{args.room}") if args.spool else None)
+        probe.set_publisher(link.send_threadsafe)
+        probe.publish_stats()
+
+    loop = GLib.MainLoop()
+    bus = pipeline.get_bus()
+    bus.add_signal_watch()
+
+    def on_message(bus, message):
+        t = message.type
+        if t == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print(f"ERROR from {message.src.get_name()}: {err}", file=sys.stderr)
+            loop.quit()
+        elif t == Gst.MessageType.EOS:
+            print("EOS received.")
+            loop.quit()
+    bus.connect("message", on_message)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    print(f"[RUN] Multi-camera pipeline is running ({len(sources)} sources)...")
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        print("Interrupted by user.")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+        probe.close()
+        if recorder is not None:
+            recorder.close()
+        if link is not None:
+            link.close()
+
+
+if __name__ == "__main__":
+    main()
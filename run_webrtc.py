@@ -1,29 +1,46 @@
 # run_webrtc.py (bản mới)
 #!/usr/bin/env python3
-import sys, argparse, asyncio, gi
+import os, sys, argparse, asyncio, gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstWebRTC', '1.0')
 gi.require_version('GstSdp', '1.0')
 from gi.repository import Gst, GLib
 import speedflow.settings as S
-from speedflow.homography import load_points, ViewTransformer
+from speedflow.homography import load_points, load_view_transformer
+from speedflow.zones import load_zones
 from speedflow.probes import SpeedProbe
+from speedflow.speed_log import FORMATS
+from speedflow.replay import MetaRecorder
+from speedflow.spool import make_forwarder
+from speedflow.infer_control import attach_adaptive_interval
 from speedflow.config_txt import load_kv_txt
 from speedflow.pipeline_webrtc import build_webrtc_pipeline
+from speedflow.pipeline_builder import OutputSpec, OUT_MP4, OUT_DISPLAY, ENCODERS
+from speedflow.webrtc_fanout import WebRTCFanout
+from speedflow.event_proto import WIRE_FORMATS, WIRE_JSON, check_wire_format, encode_message
 
 import json, websockets
 from gi.repository import GstWebRTC, GstSdp
 
 class WebRTCSession:
-    def __init__(self, webrtc, ws_uri):
+    def __init__(self, webrtc, ws_uri, wire_format: str = WIRE_JSON, spool_dir=None):
+        # webrtc=None: chế độ nhiều viewer, self.fanout (WebRTCFanout) lo offer/answer/ice từng viewer
         self.webrtc = webrtc
+        self.fanout = None
         self.ws_uri = ws_uri
+        # "json" (image_b64, dashboard cũ) hoặc "binary" (header msgpack + JPEG thô)
+        self.wire_format = check_wire_format(wire_format)
         self.ws = None
         self.loop = None
         self._closing = False
+        # mất WS (kể cả lúc _handle_ws_drop đang nối lại): event ghi spool trên đĩa, phát lại khi nối lại
+        self.forwarder = None
+        if spool_dir:
+            self.forwarder = make_forwarder(spool_dir, lambda: self.ws, self.wire_format, tag="[JETSON]")
 
-        self.webrtc.connect("on-negotiation-needed", self.on_negotiation_needed)
-        self.webrtc.connect("on-ice-candidate", self.on_ice_candidate)
+        if self.webrtc is not None:
+            self.webrtc.connect("on-negotiation-needed", self.on_negotiation_needed)
+            self.webrtc.connect("on-ice-candidate", self.on_ice_candidate)
 
     async def _ws_connect(self):
         while not self._closing:
@@ -39,12 +56,24 @@ class WebRTCSession:
         self.loop = asyncio.get_running_loop()
         await self._ws_connect()
         asyncio.create_task(self._recv_loop())
+        if self.forwarder is not None:
+            self.forwarder.start(self.loop)
 
     async def _recv_loop(self):
         try:
             async for raw in self.ws:
+                if isinstance(raw, bytes):
+                    continue  # event binary của publisher khác trong room
                 msg = json.loads(raw)
                 t = msg.get("type")
+                if self.fanout is not None:
+                    if t == "viewer_join":
+                        self.fanout.add_viewer(msg["peer"])
+                    elif t == "viewer_leave":
+                        self.fanout.remove_viewer(msg["peer"])
+                    elif t in ("answer", "ice") and "from" in msg:
+                        self.fanout.handle(msg["from"], msg)
+                    continue
                 if t == "answer":
                     res, sdpmsg = GstSdp.SDPMessage.new_from_text(msg["sdp"])
                     if res != GstSdp.SDPResult.OK:
@@ -72,6 +101,11 @@ class WebRTCSession:
         await asyncio.sleep(0.8)
         await self._ws_connect()
         await asyncio.sleep(0.2)
+        if self.fanout is not None:
+            # server gửi lại viewer_join cho từng viewer đang có -> offer mới cho từng viewer
+            self.fanout.remove_all()
+            asyncio.create_task(self._recv_loop())
+            return
         self.on_negotiation_needed(self.webrtc)
 
     def on_negotiation_needed(self, element):
@@ -92,10 +126,20 @@ class WebRTCSession:
             "type":"ice","candidate":{"candidate":candidate,"sdpMLineIndex":int(mline)}
         })), self.loop)
 
+    def send_signal(self, msg: dict):
+        # offer/ice của WebRTCFanout (thread GStreamer)
+        if not self.ws: return
+        asyncio.run_coroutine_threadsafe(self.ws.send(json.dumps(msg)), self.loop)
+
     def send_json_threadsafe(self, data: dict):
+        if self.forwarder is not None:
+            self.forwarder.publish(data)
+            return
         if not self.ws: return
         try:
-            asyncio.run_coroutine_threadsafe(self.ws.send(json.dumps(data)), self.loop)
+            # serialize ngay trên thread gọi (encoder worker), event loop chỉ việc gửi
+            msg = encode_message(data, self.wire_format)
+            asyncio.run_coroutine_threadsafe(self.ws.send(msg), self.loop)
         except Exception as e:
             print("[JETSON] publish JSON failed:", e)
 
@@ -104,10 +148,33 @@ async def async_main():
     parser.add_argument("rtsp_or_file", help="RTSP url hoặc đường dẫn file (/path, hoặc file:///...)")
     parser.add_argument("--server", default="192.168.0.158", help="IP server WS signaling")
     parser.add_argument("--room", default="demo", help="room name")
-    parser.add_argument("--cfg", required=True, help="đường dẫn file TXT chứa ANALYTICS_CFG, HOMO_YML, VIDEO_FPS")
+    parser.add_argument("--cfg", required=True, help="đường dẫn file TXT chứa HOMO_YML, VIDEO_FPS (ANALYTICS_CFG tuỳ chọn)")
+    parser.add_argument("--wire", default=WIRE_JSON, choices=WIRE_FORMATS,
+                        help="định dạng event: json (image_b64) hoặc binary (msgpack + JPEG thô)")
+    parser.add_argument("--record", default=None,
+                        help="ghi thêm file mp4 (tee sau OSD, dùng chung 1 lần suy luận với WebRTC)")
+    parser.add_argument("--display", action="store_true", help="hiển thị thêm trên màn hình Jetson")
+    parser.add_argument("--record-meta", default=None,
+                        help="ghi metadata object từng frame ra file .sfmr (replay/benchmark: bench_probe.py)")
+    parser.add_argument("--probe-stats", type=float, default=S.PROBE_STATS_INTERVAL_S, metavar="SECONDS",
+                        help="log (và publish type=probe_stats) thời gian từng stage của probe mỗi N giây; 0 = tắt")
+    parser.add_argument("--trace", type=float, default=S.PIPELINE_TRACE_INTERVAL_S, metavar="SECONDS",
+                        help="log latency/fps từng element GStreamer + bottleneck mỗi N giây; 0 = tắt")
+    parser.add_argument("--speed-log", default=S.SPEED_LOG_FORMAT, choices=FORMATS,
+                        help="log mọi phép đo (xe x frame) vào SPEED_LOG_DIR, ghi lô ở thread nền, xoay file")
+    parser.add_argument("--edge-db", default=str(S.EDGE_DB_PATH) if S.EDGE_DB_PATH else "", metavar="PATH",
+                        help="SQLite lưu overspeed/trip trên máy (truy vấn: edge_query.py); '' = tắt")
+    parser.add_argument("--spool", default=str(S.SPOOL_DIR) if S.SPOOL_DIR else "", metavar="DIR",
+                        help="event chờ gửi khi mất WS lưu ở DIR/<camera_id>, phát lại khi nối lại; '' = tắt")
+    parser.add_argument("--max-viewers", type=int, default=S.WEBRTC_MAX_VIEWERS, metavar="N",
+                        help="1 lần encode, tee RTP ra tối đa N webrtcbin (mỗi browser 1 cái); 0 = 1 webrtcbin như cũ")
+    parser.add_argument("--encoder", default=S.WEBRTC_ENCODER, choices=ENCODERS,
+                        help="H.264 encoder cho WebRTC: nvv4l2 (NVENC), x264 (CPU, máy không có NVENC), auto")
+    parser.add_argument("--adaptive-interval", action=argparse.BooleanOptionalAction, default=S.INFER_ADAPTIVE,
+                        help="tự chỉnh interval của nvinfer theo tải và số xe (đường vắng/quá tải)")
     args = parser.parse_args()
     kv = load_kv_txt(args.cfg)
-    S.ANALYTICS_CFG = kv["ANALYTICS_CFG"]
+    S.ANALYTICS_CFG = kv.get("ANALYTICS_CFG", S.ANALYTICS_CFG)
     S.HOMO_YML      = kv["HOMO_YML"]
     S.VIDEO_FPS     = kv["VIDEO_FPS"]
     S.MUX_WIDTH  = int(kv.get("MUX_WIDTH", 1280))
@@ -116,18 +183,45 @@ async def async_main():
     print(f"[CFG] HOMO_YML={S.HOMO_YML}")
     print(f"[CFG] VIDEO_FPS={S.VIDEO_FPS}")
     print(f"[CFG] MUX_WIDTH={S.MUX_WIDTH}  MUX_HEIGHT={S.MUX_HEIGHT}")
-    pipeline, nvdsosd, webrtc = build_webrtc_pipeline(args.rtsp_or_file)
-    source_pts, target_pts = load_points(str(S.HOMO_YML))
-    vt = ViewTransformer(source_pts, target_pts)
-    probe = SpeedProbe(vt, roi_source_points=source_pts, cooldown_s=2.5)
+    extra = []
+    if args.record:
+        extra.append(OutputSpec(OUT_MP4, location=args.record))
+    if args.display:
+        extra.append(OutputSpec(OUT_DISPLAY))
+    fanout = args.max_viewers > 0
+    pipeline, nvdsosd, webrtc = build_webrtc_pipeline(args.rtsp_or_file, extra_outputs=extra,
+                                                     trace_interval_s=args.trace,
+                                                     fanout=fanout, encoder=args.encoder)
+    source_pts, _ = load_points(str(S.HOMO_YML))
+    vt = load_view_transformer(str(S.HOMO_YML), S.MUX_WIDTH, S.MUX_HEIGHT,
+                               lut=S.HOMO_LUT, bilinear=S.HOMO_LUT_BILINEAR)
+    zones = load_zones(str(S.HOMO_YML), source_pts)
+    print(f"[CFG] ROI zones={zones.names} nvdsanalytics={'on' if S.USE_NVDSANALYTICS else 'off'}")
+    probe = SpeedProbe(vt, roi_source_points=source_pts, zones=zones, cooldown_s=2.5,
+                       camera_id=kv.get("CAMERA_ID", args.room), fps=S.VIDEO_FPS,
+                       stats_interval_s=args.probe_stats, speed_log=args.speed_log,
+                       edge_db=args.edge_db or None)
+    if args.adaptive_interval:
+        attach_adaptive_interval(pipeline, probe, fps=S.VIDEO_FPS)
 
     pad = nvdsosd.get_static_pad("sink")
+    recorder = None
+    if args.record_meta:
+        # gắn trước SpeedProbe -> ghi bbox gốc
+        recorder = MetaRecorder(args.record_meta)
+        pad.add_probe(Gst.PadProbeType.BUFFER, recorder.osd_sink_pad_buffer_probe, None)
     pad.add_probe(Gst.PadProbeType.BUFFER, probe.osd_sink_pad_buffer_probe, None)
 
     ws_uri = f"ws://{args.server}:8080/ws?room={args.room}&role=pub"
-    session = WebRTCSession(webrtc, ws_uri)
+    camera_id = kv.get("CAMERA_ID", args.room)
+    session = WebRTCSession(None if fanout else webrtc, ws_uri, wire_format=args.wire,
+                            spool_dir=os.path.join(args.spool, camera_id) if args.spool else None)
+    if fanout:
+        # webrtc ở đây là tee RTP; viewer_join từ server -> thêm webrtcbin lúc pipeline đang chạy
+        session.fanout = WebRTCFanout(pipeline, webrtc, session.send_signal, max_viewers=args.max_viewers)
     await session.connect()
     probe.set_publisher(session.send_json_threadsafe)
+    probe.publish_stats()
 
     loop = GLib.MainLoop()
     pipeline.set_state(Gst.State.PLAYING)
@@ -136,6 +230,11 @@ async def async_main():
         await asyncio.get_event_loop().run_in_executor(None, loop.run)
     finally:
         pipeline.set_state(Gst.State.NULL)
+        probe.close()
+        if session.forwarder is not None:
+            await session.forwarder.aclose()
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == "__main__":
     Gst.init(None)
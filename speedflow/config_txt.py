@@ -1,7 +1,7 @@
 # config_txt.py
 from pathlib import Path
 
-REQUIRED_KEYS = {"ANALYTICS_CFG", "HOMO_YML", "VIDEO_FPS"}
+REQUIRED_KEYS = {"HOMO_YML", "VIDEO_FPS"}     # ANALYTICS_CFG chỉ cần khi USE_NVDSANALYTICS
 
 def load_kv_txt(path: str) -> dict:
     p = Path(path)
@@ -0,0 +1,256 @@
+# speedflow/edge_db.py
+# Kho sự kiện ngay trên Jetson (SQLite, WAL) để trả lời truy vấn kiểu
+# "bao nhiêu xe > 80 km/h ở cam2 hôm qua 7h-9h" mà không cần gửi log đi đâu:
+#   overspeed: 1 dòng / cảnh báo (cùng nhịp cooldown với event publish)
+#   trips    : 1 dòng / xe (TripRecord lúc track kết thúc)
+# Probe thread chỉ đưa tuple vào deque; thread nền gom lô -> 1 transaction executemany / lô,
+# định kỳ xoá dữ liệu cũ hơn retention_days. Đọc (edge_query.py) mở read-only, không chặn ghi (WAL).
+import sqlite3, threading, time
+from collections import deque
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS overspeed (
+    id        INTEGER PRIMARY KEY,
+    ts        REAL    NOT NULL,      -- epoch giây của frame
+    camera_id TEXT    NOT NULL,
+    track_id  INTEGER NOT NULL,
+    class_id  INTEGER,
+    speed_kmh REAL    NOT NULL,
+    zone      TEXT
+);
+CREATE INDEX IF NOT EXISTS overspeed_cam_ts ON overspeed(camera_id, ts);
+CREATE INDEX IF NOT EXISTS overspeed_ts     ON overspeed(ts);
+CREATE INDEX IF NOT EXISTS overspeed_speed  ON overspeed(speed_kmh);
+CREATE INDEX IF NOT EXISTS overspeed_track  ON overspeed(track_id);
+
+CREATE TABLE IF NOT EXISTS trips (
+    id         INTEGER PRIMARY KEY,
+    first_ts   REAL    NOT NULL,     -- lúc vào vùng (truy vấn theo giờ dùng cột này)
+    last_ts    REAL    NOT NULL,
+    camera_id  TEXT    NOT NULL,
+    track_id   INTEGER NOT NULL,
+    class_id   INTEGER,
+    zone       TEXT,
+    samples    INTEGER,
+    mean_kmh   REAL,
+    median_kmh REAL,
+    max_kmh    REAL,
+    exit_kmh   REAL,
+    entry_x REAL, entry_y REAL, exit_x REAL, exit_y REAL,
+    snapshot   TEXT
+);
+CREATE INDEX IF NOT EXISTS trips_cam_ts ON trips(camera_id, first_ts);
+CREATE INDEX IF NOT EXISTS trips_ts     ON trips(first_ts);
+CREATE INDEX IF NOT EXISTS trips_speed  ON trips(max_kmh);
+CREATE INDEX IF NOT EXISTS trips_track  ON trips(track_id);
+"""
+
+_INSERT = {
+    "overspeed": "INSERT INTO overspeed (ts, camera_id, track_id, class_id, speed_kmh, zone) "
+                 "VALUES (?, ?, ?, ?, ?, ?)",
+    "trips": "INSERT INTO trips (first_ts, last_ts, camera_id, track_id, class_id, zone, samples, "
+             "mean_kmh, median_kmh, max_kmh, exit_kmh, entry_x, entry_y, exit_x, exit_y, snapshot) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+}
+# cột thời gian dùng cho retention / lọc khoảng thời gian
+TS_COLUMN = {"overspeed": "ts", "trips": "first_ts"}
+SPEED_COLUMNS = {"max": "max_kmh", "median": "median_kmh", "mean": "mean_kmh", "exit": "exit_kmh"}
+
+
+def connect(path, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(f"file:{Path(path)}?mode=ro", uri=True, timeout=10.0)
+    else:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=10.0)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")   # chỉ có hiệu lực khi tạo DB mới
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")        # WAL: mất điện chỉ mất lô cuối, DB không hỏng
+        conn.executescript(SCHEMA)
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+
+class EdgeEventStore:
+    """
+    add_overspeed(...) / add_trip(rec): không I/O trên probe thread. Hàng đợi > max_pending -> bỏ (đếm dropped).
+    Ghi khi đủ batch_size dòng hoặc mỗi flush_interval_s; mỗi prune_interval_s xoá dòng cũ hơn
+    retention_days rồi trả trang trống về hệ thống (incremental_vacuum) và cắt WAL.
+    """
+    def __init__(self, path, retention_days: float = 30.0, batch_size: int = 256,
+                 flush_interval_s: float = 1.0, max_pending: int = 10_000, prune_interval_s: float = 600.0):
+        self.path = Path(path)
+        self.retention_s = float(retention_days) * 86400.0
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = float(flush_interval_s)
+        self.max_pending = max(1, int(max_pending))
+        self.prune_interval_s = float(prune_interval_s)
+
+        self._q = deque()
+        self._cv = threading.Condition()
+        self._closing = False
+
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+        self.batches = 0
+
+        # mở/tạo schema ngay để lỗi quyền/đĩa báo lúc khởi động; thread ghi dùng connection riêng
+        connect(self.path).close()
+        self._thread = threading.Thread(target=self._run, name="edge-db", daemon=True)
+        self._thread.start()
+
+    def add_overspeed(self, camera_id, ts, track_id, speed_kmh, class_id=None, zone=None):
+        self._put("overspeed", (float(ts), str(camera_id), int(track_id),
+                                None if class_id is None else int(class_id), float(speed_kmh), zone))
+
+    def add_trip(self, rec):
+        """rec: TripRecord (trips.py)."""
+        self._put("trips", (rec.first_ts, rec.last_ts, rec.camera_id, rec.track_id, rec.class_id, rec.zone,
+                            rec.samples, rec.mean_kmh, rec.median_kmh, rec.max_kmh, rec.exit_kmh,
+                            rec.entry_xy[0], rec.entry_xy[1], rec.exit_xy[0], rec.exit_xy[1], rec.snapshot))
+
+    def _put(self, table, row):
+        with self._cv:
+            if self._closing or len(self._q) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._q.append((table, row))
+            if len(self._q) >= self.batch_size:
+                self._cv.notify()
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"written": self.written, "dropped": self.dropped, "pruned": self.pruned,
+                    "batches": self.batches, "pending": len(self._q), "path": str(self.path)}
+
+    def close(self, timeout: float = 10.0):
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    # -------------------- background --------------------
+    def _run(self):
+        conn = connect(self.path)
+        next_prune = time.time()
+        try:
+            while True:
+                with self._cv:
+                    if not self._closing and len(self._q) < self.batch_size:
+                        self._cv.wait(self.flush_interval_s)
+                    batch = list(self._q)
+                    self._q.clear()
+                    done = self._closing
+                if batch:
+                    try:
+                        self._insert(conn, batch)
+                    except sqlite3.Error as e:
+                        print("[WARN] edge db insert failed:", e)
+                now = time.time()
+                if self.retention_s > 0 and now >= next_prune:
+                    next_prune = now + self.prune_interval_s
+                    try:
+                        self.pruned += prune(conn, self.retention_s, now)
+                    except sqlite3.Error as e:
+                        print("[WARN] edge db prune failed:", e)
+                if done:
+                    conn.execute("PRAGMA optimize")
+                    return
+        finally:
+            conn.close()
+
+    def _insert(self, conn, batch):
+        rows = {}
+        for table, row in batch:
+            rows.setdefault(table, []).append(row)
+        with conn:                          # 1 transaction / lô
+            for table, r in rows.items():
+                conn.executemany(_INSERT[table], r)
+        self.written += len(batch)
+        self.batches += 1
+
+
+def prune(conn, retention_s: float, now: float = None) -> int:
+    """Xoá sự kiện cũ hơn retention_s, trả trang trống về hệ thống và cắt WAL. -> số dòng đã xoá."""
+    cutoff = (time.time() if now is None else now) - float(retention_s)
+    n = 0
+    with conn:
+        for table, col in TS_COLUMN.items():
+            n += conn.execute(f"DELETE FROM {table} WHERE {col} < ?", (cutoff,)).rowcount
+    if n:
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return n
+
+
+# -------------------- truy vấn (edge_query.py) --------------------
+def _where(table, t0=None, t1=None, camera_id=None, speed_col=None, min_kmh=None, max_kmh=None):
+    ts = TS_COLUMN[table]
+    cond, args = [], []
+    if camera_id:
+        cond.append("camera_id = ?"); args.append(camera_id)
+    if t0 is not None:
+        cond.append(f"{ts} >= ?"); args.append(float(t0))
+    if t1 is not None:
+        cond.append(f"{ts} < ?"); args.append(float(t1))
+    if min_kmh is not None:
+        cond.append(f"{speed_col} > ?"); args.append(float(min_kmh))
+    if max_kmh is not None:
+        cond.append(f"{speed_col} <= ?"); args.append(float(max_kmh))
+    return (" WHERE " + " AND ".join(cond)) if cond else "", args
+
+
+def count_vehicles(conn, t0=None, t1=None, camera_id=None, min_kmh=None, by: str = "max") -> int:
+    """Số xe (trip) trong [t0, t1), tốc độ `by` (max/median/mean/exit) > min_kmh."""
+    where, args = _where("trips", t0, t1, camera_id, SPEED_COLUMNS[by], min_kmh)
+    return conn.execute(f"SELECT COUNT(*) FROM trips{where}", args).fetchone()[0]
+
+
+def count_alerts(conn, t0=None, t1=None, camera_id=None, min_kmh=None):
+    """-> (số cảnh báo overspeed, số xe khác nhau bị cảnh báo)."""
+    where, args = _where("overspeed", t0, t1, camera_id, "speed_kmh", min_kmh)
+    return conn.execute(f"SELECT COUNT(*), COUNT(DISTINCT camera_id || ':' || track_id) FROM overspeed{where}",
+                        args).fetchone()
+
+
+def hourly(conn, t0=None, t1=None, camera_id=None, min_kmh=None, by: str = "max"):
+    """-> [(giờ 'YYYY-MM-DD HH:00' theo giờ máy, số xe, km/h trung bình, km/h lớn nhất)]."""
+    col = SPEED_COLUMNS[by]
+    where, args = _where("trips", t0, t1, camera_id, col, min_kmh)
+    return conn.execute(
+        f"SELECT strftime('%Y-%m-%d %H:00', first_ts, 'unixepoch', 'localtime') AS hour, COUNT(*), "
+        f"ROUND(AVG({col}), 1), ROUND(MAX({col}), 1) FROM trips{where} GROUP BY hour ORDER BY hour",
+        args).fetchall()
+
+
+def top_speeds(conn, t0=None, t1=None, camera_id=None, limit: int = 10, by: str = "max"):
+    """-> [(first_ts, camera_id, track_id, class_id, km/h, snapshot)] nhanh nhất trước."""
+    col = SPEED_COLUMNS[by]
+    where, args = _where("trips", t0, t1, camera_id, col, None)
+    where += (" AND " if where else " WHERE ") + f"{col} IS NOT NULL"
+    return conn.execute(
+        f"SELECT first_ts, camera_id, track_id, class_id, {col}, snapshot FROM trips{where} "
+        f"ORDER BY {col} DESC LIMIT ?", args + [int(limit)]).fetchall()
+
+
+def track_events(conn, track_id, camera_id=None):
+    """-> (trips, overspeed) của 1 track_id."""
+    cam = " AND camera_id = ?" if camera_id else ""
+    args = [int(track_id)] + ([camera_id] if camera_id else [])
+    trips = conn.execute(f"SELECT first_ts, last_ts, camera_id, zone, samples, mean_kmh, median_kmh, max_kmh, "
+                         f"snapshot FROM trips WHERE track_id = ?{cam} ORDER BY first_ts", args).fetchall()
+    alerts = conn.execute(f"SELECT ts, camera_id, speed_kmh, zone FROM overspeed WHERE track_id = ?{cam} "
+                          f"ORDER BY ts", args).fetchall()
+    return trips, alerts
+
+
+def cameras(conn):
+    """-> [(camera_id, số xe, trip đầu, trip cuối, số cảnh báo)]."""
+    alerts = dict(conn.execute("SELECT camera_id, COUNT(*) FROM overspeed GROUP BY camera_id").fetchall())
+    rows = conn.execute("SELECT camera_id, COUNT(*), MIN(first_ts), MAX(first_ts) FROM trips "
+                        "GROUP BY camera_id ORDER BY camera_id").fetchall()
+    seen = {r[0] for r in rows}
+    rows += [(c, 0, None, None) for c in sorted(alerts) if c not in seen]
+    return [r + (alerts.get(r[0], 0),) for r in rows]
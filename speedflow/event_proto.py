@@ -0,0 +1,61 @@
+# speedflow/event_proto.py
+# Đóng gói event gửi qua WebSocket:
+#   - "json"  : text frame JSON, ảnh JPEG dạng base64 trong "image_b64" (dashboard cũ)
+#   - "binary": binary frame = MAGIC(2) | VERSION(1) | HEADER_LEN(u32 BE) | header msgpack | JPEG thô
+# Ở payload nội bộ, ảnh luôn là bytes JPEG trong key "image_jpeg".
+import base64, json, struct
+
+try:
+    import msgpack
+except ImportError:  # chỉ cần khi dùng chế độ binary
+    msgpack = None
+
+WIRE_JSON = "json"
+WIRE_BINARY = "binary"
+WIRE_FORMATS = (WIRE_JSON, WIRE_BINARY)
+
+MAGIC = b"SF"
+VERSION = 1
+_PREFIX = struct.Struct(">2sBI")
+
+
+def check_wire_format(wire: str) -> str:
+    if wire not in WIRE_FORMATS:
+        raise ValueError(f"Invalid wire format: {wire!r} (expected one of {WIRE_FORMATS})")
+    if wire == WIRE_BINARY and msgpack is None:
+        raise RuntimeError("Binary wire format requires msgpack (pip3 install msgpack)")
+    return wire
+
+
+def encode_json(payload: dict) -> str:
+    d = dict(payload)
+    if "image_jpeg" in d:
+        jpeg = d.pop("image_jpeg")
+        d["image_b64"] = base64.b64encode(jpeg).decode("ascii") if jpeg else None
+    return json.dumps(d)
+
+
+def encode_binary(payload: dict) -> bytes:
+    header = dict(payload)
+    jpeg = header.pop("image_jpeg", None) or b""
+    head = msgpack.packb(header, use_bin_type=True)
+    return _PREFIX.pack(MAGIC, VERSION, len(head)) + head + jpeg
+
+
+def decode_binary(data: bytes):
+    """-> (header: dict, blob: bytes). Raise ValueError nếu frame sai định dạng."""
+    if len(data) < _PREFIX.size:
+        raise ValueError("Frame too short")
+    magic, version, n = _PREFIX.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Bad frame magic/version: {magic!r}/{version}")
+    start = _PREFIX.size
+    header = msgpack.unpackb(data[start:start + n], raw=False)
+    return header, bytes(data[start + n:])
+
+
+def encode_message(payload: dict, wire: str = WIRE_JSON):
+    """payload -> str (json) hoặc bytes (binary) để ws.send()."""
+    if wire == WIRE_BINARY:
+        return encode_binary(payload)
+    return encode_json(payload)
@@ -0,0 +1,143 @@
+# speedflow/fakeds.py
+# Shim giả lập phần pyds (và Gst.PadProbeReturn) mà SpeedProbe dùng, để chạy probe thật
+# trên metadata giả/đã ghi (replay, benchmark, backend CPU) mà không cần DeepStream/GStreamer.
+#   install(speedflow.probes) -> probes.pyds = shim (và probes.Gst nếu không có GStreamer)
+import numpy as np
+
+
+class GList:
+    __slots__ = ("data", "next")
+
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+
+def glist(items):
+    """list Python -> danh sách liên kết kiểu GList (l.data, l.next), None nếu rỗng."""
+    head = None
+    for it in reversed(items):
+        head = GList(it, head)
+    return head
+
+
+class RectParams:
+    __slots__ = ("left", "top", "width", "height")
+
+    def __init__(self, left=0.0, top=0.0, width=0.0, height=0.0):
+        self.left, self.top, self.width, self.height = left, top, width, height
+
+
+class TextParams:
+    __slots__ = ("display_text",)
+
+    def __init__(self):
+        self.display_text = ""
+
+
+class ObjectMeta:
+    """Giống NvDsObjectMeta ở mức speed_core/SpeedProbe cần."""
+    __slots__ = ("object_id", "class_id", "confidence", "rect_params", "text_params",
+                 "obj_user_meta_list")
+
+    def __init__(self, object_id, class_id, confidence, left, top, width, height):
+        self.object_id = object_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.rect_params = RectParams(left, top, width, height)
+        self.text_params = TextParams()
+        self.obj_user_meta_list = None
+
+
+class FrameMeta:
+    __slots__ = ("source_id", "frame_num", "batch_id", "ntp_timestamp", "buf_pts", "obj_meta_list")
+
+    def __init__(self, source_id, frame_num, batch_id, ntp_timestamp, objs, buf_pts=None):
+        self.source_id = source_id
+        self.frame_num = frame_num
+        self.batch_id = batch_id
+        self.ntp_timestamp = ntp_timestamp
+        self.buf_pts = buf_pts        # None = recording cũ không có PTS
+        self.obj_meta_list = glist(objs)
+
+
+class BatchMeta:
+    __slots__ = ("frame_meta_list",)
+
+    def __init__(self, frames):
+        self.frame_meta_list = glist(frames)
+
+
+class _Cast:
+    @staticmethod
+    def cast(x):
+        return x
+
+
+# tên giống pyds: pyds.NvDsFrameMeta.cast(l.data) ...
+NvDsFrameMeta = NvDsObjectMeta = NvDsUserMeta = NvDsAnalyticsObjInfo = _Cast
+
+_batches = {}       # hash(buffer) -> BatchMeta
+_surface = None     # frame RGBA dùng chung cho mọi crop
+
+
+def gst_buffer_get_nvds_batch_meta(buf_hash):
+    return _batches.get(buf_hash)
+
+
+def set_surface(width: int, height: int):
+    global _surface
+    _surface = np.full((int(height), int(width), 4), 96, dtype=np.uint8)
+
+
+def get_nvds_buf_surface(buf_hash, batch_id):
+    if _surface is None:
+        set_surface(1280, 720)
+    return _surface
+
+
+class FakeBuffer:
+    """Buffer giả mang BatchMeta; attach() để gst_buffer_get_nvds_batch_meta tìm được theo hash."""
+    __slots__ = ("batch", "pts", "__weakref__")
+
+    def __init__(self, batch: BatchMeta, pts: int = 0):
+        self.batch = batch
+        self.pts = pts
+
+    def attach(self):
+        _batches[hash(self)] = self.batch
+        return self
+
+    def detach(self):
+        _batches.pop(hash(self), None)
+
+
+class FakeProbeInfo:
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def get_buffer(self):
+        return self.buffer
+
+
+class PadProbeReturn:
+    DROP = 0
+    OK = 1
+    REMOVE = 2
+    PASS = 3
+    HANDLED = 4
+
+
+class Gst:
+    PadProbeReturn = PadProbeReturn
+
+
+def install(module):
+    """Thay pyds của module (vd speedflow.probes) bằng shim; Gst chỉ thay khi không có GStreamer."""
+    import sys
+    module.pyds = sys.modules[__name__]
+    if getattr(module, "Gst", None) is None:
+        module.Gst = Gst
+    return module
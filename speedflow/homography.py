@@ -1,18 +1,178 @@
-import numpy as np, yaml, cv2, os
+import numpy as np, yaml, cv2, os, hashlib
+from pathlib import Path
+
+LUT_VERSION = 2
+
 
 class ViewTransformer:
-    def __init__(self, source: np.ndarray, target: np.ndarray) -> None:
-        self.m = cv2.getPerspectiveTransform(source, target)
+    """
+    pixel -> mặt đường (mét). Có CAMERA_MATRIX/DIST_COEFFS thì khử méo điểm trước
+    (homography tính trên toạ độ đã khử méo -> không lệch ở mép ảnh camera góc rộng).
+    """
+    def __init__(self, source: np.ndarray, target: np.ndarray,
+                 camera_matrix: np.ndarray = None, dist_coeffs: np.ndarray = None) -> None:
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self.m = cv2.getPerspectiveTransform(self.undistort(source), target)
+
+    def undistort(self, points: np.ndarray) -> np.ndarray:
+        pts = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if self.dist_coeffs is None:
+            return pts.reshape(-1, 2)
+        # P = K: kết quả vẫn ở toạ độ pixel (ảnh đã khử méo)
+        return cv2.undistortPoints(pts, self.camera_matrix, self.dist_coeffs,
+                                   P=self.camera_matrix).reshape(-1, 2)
+
     def transform_points(self, points: np.ndarray) -> np.ndarray:
         if points.size == 0:
             return points
-        reshaped_points = points.reshape(-1, 1, 2).astype(np.float32)
+        if self.dist_coeffs is not None:
+            points = self.undistort(points)
+        # (N, 2) -> (N, 1, 2) float32 liên tục, không copy nếu đã đúng dtype
+        reshaped_points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 1, 2)
         transformed_points = cv2.perspectiveTransform(reshaped_points, self.m)
         return transformed_points.reshape(-1, 2)
-        
+
+    def to_pixel(self, world: np.ndarray) -> np.ndarray:
+        """Mặt đường (m) -> pixel (ảnh gốc, có méo nếu có DIST_COEFFS); dùng cho dữ liệu giả/vẽ overlay."""
+        w = np.ascontiguousarray(world, dtype=np.float32).reshape(-1, 1, 2)
+        pix = cv2.perspectiveTransform(w, np.linalg.inv(self.m))
+        if self.dist_coeffs is None:
+            return pix.reshape(-1, 2)
+        # pixel đã khử méo -> toạ độ chuẩn hoá -> chiếu lại qua K + méo
+        norm = cv2.undistortPoints(pix, self.camera_matrix, None).reshape(-1, 2)
+        obj = np.hstack([norm, np.ones((len(norm), 1))]).astype(np.float64)
+        out, _ = cv2.projectPoints(obj, np.zeros(3), np.zeros(3), self.camera_matrix, self.dist_coeffs)
+        return out.reshape(-1, 2).astype(np.float32)
+
+
+class LutViewTransformer:
+    """
+    Bảng tra (H+1, W+1, 2) float32: toạ độ mặt đường của từng pixel 0..W x 0..H ở độ phân giải mux
+    (đã gồm khử méo). transform_points = index mảng phẳng (nearest) hoặc nội suy song tuyến (bilinear).
+    Điểm nằm ngoài khung hình -> tính chính xác bằng ViewTransformer.
+    """
+    def __init__(self, lut: np.ndarray, exact: ViewTransformer, bilinear: bool = True):
+        self.lut = np.asarray(lut)          # bỏ lớp np.memmap: index trên ndarray nhanh hơn
+        self.exact = exact
+        self.bilinear = bool(bilinear)
+        self.height, self.width = self.lut.shape[0] - 1, self.lut.shape[1] - 1
+        self.stride = self.lut.shape[1]
+        self.flat = self.lut.reshape(-1, 2)
+        self._lim = np.array([self.width, self.height], dtype=np.float32)
+        self._cell_max = np.array([self.width - 1, self.height - 1], dtype=np.intp)
+        self._w = np.array([1, self.stride], dtype=np.intp)
+
+    def transform_points(self, points: np.ndarray) -> np.ndarray:
+        if points.size == 0:
+            return points
+        p = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if p.min() < 0 or not (p <= self._lim).all():
+            return self._transform_outside(p)
+        if not self.bilinear:
+            q = (p + 0.5).astype(np.intp)
+            return self.flat[q[:, 1] * self.stride + q[:, 0]]
+        # x = W hoặc y = H: lùi về ô cuối (trọng số = 1 nên vẫn đúng)
+        q = np.minimum(p.astype(np.intp), self._cell_max)
+        f = p - q
+        idx = q @ self._w
+        flat, s = self.flat, self.stride
+        a, b, c, d = flat[idx], flat[idx + 1], flat[idx + s], flat[idx + s + 1]
+        fx, fy = f[:, 0:1], f[:, 1:2]
+        top = a + (b - a) * fx
+        return top + (c + (d - c) * fx - top) * fy
+
+    def _transform_outside(self, p):
+        inside = (p >= 0).all(axis=1) & (p <= self._lim).all(axis=1)
+        out = self.exact.transform_points(p)
+        if inside.any():
+            out[inside] = LutViewTransformer.transform_points(self, p[inside])
+        return out
+
+
+def build_lut(vt: ViewTransformer, width: int, height: int, out: np.ndarray = None) -> np.ndarray:
+    """Toạ độ mặt đường của mọi pixel 0..W x 0..H, tính theo từng hàng (không cấp phát mảng điểm lớn)."""
+    width, height = int(width), int(height)
+    if out is None:
+        out = np.empty((height + 1, width + 1, 2), dtype=np.float32)
+    row = np.empty((width + 1, 2), dtype=np.float32)
+    row[:, 0] = np.arange(width + 1, dtype=np.float32)
+    for yy in range(height + 1):
+        row[:, 1] = yy
+        out[yy] = vt.transform_points(row)
+    return out
+
+
 def load_points(yml_path: str):
     with open(yml_path, "r") as f:
         d = yaml.safe_load(f)
     source = np.array(d["SOURCE"], dtype=np.float32)
     target = np.array(d["TARGET"], dtype=np.float32)
-    return source, target
\ No newline at end of file
+    return source, target
+
+
+def load_calibration(yml_path: str, width: int = None, height: int = None):
+    """
+    -> (source, target, camera_matrix | None, dist_coeffs | None).
+    CAMERA_MATRIX (3x3) + DIST_COEFFS (k1 k2 p1 p2 [k3 ...]) tuỳ chọn trong cùng YAML;
+    IMAGE_SIZE [w, h] = độ phân giải lúc calib -> K được quy đổi về width x height (mux).
+    """
+    with open(yml_path, "r") as f:
+        d = yaml.safe_load(f)
+    source = np.array(d["SOURCE"], dtype=np.float32)
+    target = np.array(d["TARGET"], dtype=np.float32)
+    if d.get("CAMERA_MATRIX") is None or d.get("DIST_COEFFS") is None:
+        return source, target, None, None
+    k = np.array(d["CAMERA_MATRIX"], dtype=np.float64).reshape(3, 3)
+    dist = np.array(d["DIST_COEFFS"], dtype=np.float64).reshape(-1)
+    size = d.get("IMAGE_SIZE")
+    if size and width and height:
+        sx, sy = float(width) / float(size[0]), float(height) / float(size[1])
+        k = k.copy()
+        k[0, 0] *= sx; k[0, 2] *= sx
+        k[1, 1] *= sy; k[1, 2] *= sy
+    return source, target, k, dist
+
+
+def lut_cache_path(yml_path: str, width: int, height: int, cache_dir) -> Path:
+    """Khoá = hash nội dung YAML + độ phân giải + phiên bản LUT (đổi calib -> file mới)."""
+    h = hashlib.sha1(Path(yml_path).read_bytes())
+    h.update(f"{int(width)}x{int(height)}/v{LUT_VERSION}".encode())
+    return Path(cache_dir) / f"homo_{h.hexdigest()[:16]}_{int(width)}x{int(height)}.npy"
+
+
+def load_view_transformer(yml_path: str, width: int = 1280, height: int = 720, lut: bool = False,
+                          bilinear: bool = True, cache_dir=None):
+    """
+    ViewTransformer (khử méo nếu YAML có DIST_COEFFS) hoặc LutViewTransformer cho độ phân giải mux.
+    LUT lưu .npy và mở bằng mmap (chỉ đọc) -> khởi động lại / nhiều process dùng chung, không dựng lại.
+    nearest lệch tới ~1 m ở vùng xa (1 pixel ~ vài mét) -> mặc định bilinear.
+    """
+    source, target, k, dist = load_calibration(yml_path, width, height)
+    exact = ViewTransformer(source, target, k, dist)
+    if not lut:
+        return exact
+    if cache_dir is None:
+        from .settings import HOMO_CACHE_DIR
+        cache_dir = HOMO_CACHE_DIR
+    path = lut_cache_path(yml_path, width, height, cache_dir)
+    table = None
+    if path.exists():
+        try:
+            table = np.load(path, mmap_mode="r")
+            if table.shape != (int(height) + 1, int(width) + 1, 2) or table.dtype != np.float32:
+                table = None
+        except Exception as e:
+            print("[WARN] bad homography LUT cache, rebuilding:", e)
+            table = None
+    if table is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + f".{os.getpid()}.tmp.npy")
+        mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(int(height) + 1, int(width) + 1, 2))
+        build_lut(exact, width, height, out=mm)
+        mm.flush()
+        del mm
+        os.replace(tmp, path)       # ghi xong mới đổi tên -> process khác không đọc file dở
+        print(f"[HOMO] built LUT {width}x{height} -> {path}")
+        table = np.load(path, mmap_mode="r")
+    return LutViewTransformer(table, exact, bilinear=bilinear)
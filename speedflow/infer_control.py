@@ -0,0 +1,121 @@
+# speedflow/infer_control.py
+# Điều chỉnh thuộc tính `interval` của nvinfer lúc chạy (số frame bỏ qua giữa 2 lần suy luận,
+# nvtracker dự đoán bbox cho các frame bị bỏ):
+#   - đường vắng (không có xe trong idle_s giây)  -> idle_interval (tiết kiệm GPU/điện)
+#   - quá tải (element bận nhất của chuỗi suy luận >= high, hoặc fps ra < 90% fps nguồn) -> tăng interval
+#   - còn dư tải (dự đoán tải sau khi giảm vẫn < high * 0.85) -> giảm interval về min_interval
+# Tải đo bằng PipelineTracer (pipeline_trace.py) trên chuỗi infer/tracker/analytics.
+# Tốc độ vẫn đúng khi bỏ frame: speed_core tính theo PTS (hoặc frame_num thật) của từng mẫu, không theo số mẫu.
+import threading, time
+
+from .settings import (VIDEO_FPS, INFER_INTERVAL_MAX, INFER_IDLE_INTERVAL, INFER_IDLE_S,
+                       INFER_CTL_PERIOD_S)
+from .pipeline_trace import PipelineTracer
+
+# element đo tải (tên trong pipeline_builder); nvstreammux không tính: latency của nó gồm cả thời gian
+# chờ gom batch (batched-push-timeout), không phải thời gian xử lý
+INFER_CHAIN = ("primary-infer", "tracker", "analytics")
+
+
+class InferIntervalController:
+    def __init__(self, element=None, fps: float = VIDEO_FPS, min_interval: int = 0,
+                 max_interval: int = INFER_INTERVAL_MAX, idle_interval: int = INFER_IDLE_INTERVAL,
+                 idle_s: float = INFER_IDLE_S, high: float = 0.9):
+        self.element = element            # nvinfer (None = chỉ tính, không set property)
+        self.fps = float(fps)
+        self.min_interval = max(0, int(min_interval))
+        self.max_interval = max(self.min_interval, int(max_interval))
+        self.idle_interval = min(max(self.min_interval, int(idle_interval)), self.max_interval)
+        self.idle_s = float(idle_s)
+        self.high = float(high)
+        self.load_interval = self.min_interval    # mức theo tải (khi có xe)
+        self.interval = None
+        self.idle = False
+        self.busy = 0.0
+        self.changes = 0
+        self.tracer = None
+        self._last_vehicle = time.monotonic()
+        self._lock = threading.Lock()
+        self._apply("start")
+
+    # ---------- đầu vào ----------
+    def observe_vehicles(self, n: int, now: float = None):
+        """Gọi mỗi batch từ probe (số xe đã lọc class/ROI). Có xe trở lại -> thoát idle ngay."""
+        now = time.monotonic() if now is None else now
+        if n > 0:
+            self._last_vehicle = now
+            if self.idle:
+                with self._lock:
+                    self.idle = False
+                    self._apply("vehicles")
+        elif not self.idle and now - self._last_vehicle >= self.idle_s:
+            with self._lock:
+                self.idle = True
+                self._apply("idle")
+
+    def on_trace_report(self, rep: dict):
+        """Sink của PipelineTracer: busy = tỉ lệ thời gian bận của element bận nhất trong chuỗi suy luận."""
+        chain = [st for name, st in rep["elements"].items() if name in INFER_CHAIN]
+        if not chain:
+            return
+        fps_out = max(st["fps"] for st in chain)
+        if fps_out <= 0:
+            return      # chưa có buffer (khởi động/EOS)
+        busy = max(st["busy_pct"] for st in chain) / 100.0
+        self.observe_load(busy, fps_out)
+
+    def observe_load(self, busy: float, fps_out: float = None):
+        with self._lock:
+            self.busy = busy
+            k = self.load_interval
+            # chậm hơn nguồn VÀ chuỗi suy luận đang bận (fps camera thấp hơn cấu hình thì không tính)
+            behind = fps_out is not None and fps_out < 0.9 * self.fps and busy >= 0.5 * self.high
+            if (busy >= self.high or behind) and k < self.max_interval:
+                self.load_interval = k + 1
+                self._apply(f"load {busy * 100:.0f}%" + (f", {fps_out:.1f} fps" if behind else ""))
+            elif k > self.min_interval and not behind:
+                # suy luận mỗi (k+1) frame -> giảm 1 nấc thì tải tăng ~ (k+1)/k
+                if busy * (k + 1) / k < self.high * 0.85:
+                    self.load_interval = k - 1
+                    self._apply(f"load {busy * 100:.0f}%")
+
+    # ---------- áp dụng ----------
+    def target(self) -> int:
+        base = self.idle_interval if self.idle else self.min_interval
+        return max(base, self.load_interval)
+
+    def _apply(self, reason: str):
+        new = self.target()
+        if new == self.interval:
+            return
+        old, self.interval = self.interval, new
+        if self.element is not None:
+            try:
+                self.element.set_property("interval", int(new))
+            except Exception as e:
+                print("[WARN] set nvinfer interval failed:", e)
+                return
+        if old is not None:
+            self.changes += 1
+            print(f"[INFER] interval {old} -> {new} ({reason})")
+
+
+def attach_adaptive_interval(pipeline, probe=None, fps: float = VIDEO_FPS,
+                             period_s: float = INFER_CTL_PERIOD_S, **kw) -> InferIntervalController:
+    """
+    Gắn controller vào pipeline dựng bởi pipeline_builder (backend deepstream):
+    tracer riêng trên INFER_CHAIN -> on_trace_report; probe (SpeedProbe) -> observe_vehicles.
+    """
+    pgie = pipeline.get_by_name("primary-infer")
+    if pgie is None or pgie.find_property("interval") is None:
+        print("[WARN] adaptive interval: no nvinfer 'primary-infer' in pipeline")
+        pgie = None
+    ctl = InferIntervalController(pgie, fps=fps, **kw)
+    chain = {n: pipeline.get_by_name(n) for n in INFER_CHAIN}
+    tracer = PipelineTracer(period_s).attach(pipeline, {n: e for n, e in chain.items() if e is not None},
+                                             decoders=False)
+    tracer.add_sink(ctl.on_trace_report)
+    ctl.tracer = tracer
+    if probe is not None:
+        probe.add_activity_sink(ctl.observe_vehicles)
+    return ctl
@@ -0,0 +1,110 @@
+# speedflow/kalman.py
+# Kalman vận tốc không đổi (constant velocity) 2D trên mặt đường cho MỌI track cùng lúc:
+# trạng thái/hiệp phương sai là mảng theo slot của TrackStore, mỗi frame 1 bước vector hoá.
+# Trục x (ngang đường) và y (dọc đường) độc lập (Q, R chéo) -> mỗi trục 1 ma trận 2x2 (pos, vel)
+# đối xứng = 3 số: p (var vị trí), c (cov vị trí-vận tốc), v (var vận tốc).
+# Gating: khoảng cách Mahalanobis của innovation > gate_chi2 (2 bậc tự do) -> bỏ phép đo, giữ dự đoán.
+import numpy as np
+
+from .settings import (KF_ACCEL_STD, KF_MEAS_STD_X_M, KF_MEAS_STD_Y_M, KF_GATE_CHI2,
+                       KF_INIT_VEL_STD, KF_READY_VEL_STD, KF_MAX_MISSES, SPEED_TS_MAX_GAP_S)
+
+
+class KalmanCV:
+    def __init__(self, cap: int, accel_std: float = KF_ACCEL_STD,
+                 meas_std=(KF_MEAS_STD_X_M, KF_MEAS_STD_Y_M), gate_chi2: float = KF_GATE_CHI2,
+                 init_vel_std: float = KF_INIT_VEL_STD, ready_vel_std: float = KF_READY_VEL_STD,
+                 max_misses: int = KF_MAX_MISSES, max_ts_gap_s: float = SPEED_TS_MAX_GAP_S):
+        cap = int(cap)
+        self.q = float(accel_std) ** 2
+        self.r = np.square(np.asarray(meas_std, dtype=np.float64))      # (2,)
+        self.gate_chi2 = float(gate_chi2)
+        self.init_var = float(init_vel_std) ** 2
+        self.ready_var = float(ready_vel_std) ** 2
+        self.max_misses = int(max_misses)
+        self.max_ts_gap_s = float(max_ts_gap_s)
+
+        # 1 mảng (cap, 5, 2): pos, vel, p, c, v theo trục -> 1 lần gather + 1 lần scatter mỗi frame
+        self.state = np.zeros((cap, 5, 2), dtype=np.float64)
+        self.track_id = np.full(cap, -1, dtype=np.int64)   # slot được cấp lại cho track khác -> init lại
+        self.last_frame = np.zeros(cap, dtype=np.int64)
+        self.last_t = np.full(cap, np.nan, dtype=np.float64)  # PTS (giây) của lần cập nhật trước
+        self.updates = np.zeros(cap, dtype=np.int32)
+        self.misses = np.zeros(cap, dtype=np.int32)
+        self.rejected_total = 0
+
+    def _init(self, s, z, track_ids, frame_no, t):
+        st = np.empty((len(s), 5, 2), dtype=np.float64)
+        st[:, 0] = z
+        st[:, 1] = 0.0
+        st[:, 2] = self.r
+        st[:, 3] = 0.0
+        st[:, 4] = self.init_var
+        self.state[s] = st
+        self.track_id[s] = track_ids
+        self.last_frame[s] = frame_no
+        self.last_t[s] = t
+        self.updates[s] = 1
+        self.misses[s] = 0
+
+    def step(self, slots, track_ids, z, frame_no: int, fps: float, t: float = None):
+        """
+        slots (N,), track_ids (N,), z (N, 2) toạ độ mặt đường (m) của 1 frame, t = PTS (giây) hoặc None.
+        -> (speed_kmh (N,), ready (N,) bool: đã hội tụ, accepted (N,) bool: phép đo qua gating)
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        z = np.asarray(z, dtype=np.float64)[:, :2]
+        new = self.track_id[slots] != track_ids
+        t = np.nan if t is None else float(t)
+        if new.any():
+            self._init(slots[new], z[new], track_ids[new], frame_no, t)
+
+        # ---- predict: dt theo PTS (frame bị drop trước mux), thiếu/nhảy PTS -> theo frame_num ----
+        dt_frame = (frame_no - self.last_frame[slots]) / float(fps)
+        dt_ts = t - self.last_t[slots]
+        ok = (dt_ts > 0) & (dt_ts <= dt_frame + self.max_ts_gap_s)     # NaN -> False
+        dt = np.where(ok, dt_ts, dt_frame)[:, None]
+        st = self.state[slots]
+        pos, vel, p, c, v = st[:, 0], st[:, 1], st[:, 2], st[:, 3], st[:, 4]
+        pos = pos + vel * dt
+        qdt2 = self.q * dt * dt
+        p = p + dt * (2.0 * c + dt * v) + qdt2 * dt * dt / 4.0
+        c = c + dt * v + qdt2 * dt / 2.0
+        v = v + qdt2
+
+        # ---- gating ----
+        s = p + self.r
+        innov = z - pos
+        d2 = (innov * innov / s).sum(axis=1)
+        accepted = (d2 <= self.gate_chi2) | new
+        a = accepted[:, None]
+
+        # ---- update (chỉ phép đo qua gating) ----
+        kp, kv = p / s, c / s
+        st[:, 0] = np.where(a, pos + kp * innov, pos)
+        st[:, 1] = np.where(a, vel + kv * innov, vel)
+        st[:, 2] = np.where(a, (1.0 - kp) * p, p)
+        st[:, 3] = np.where(a, (1.0 - kp) * c, c)
+        st[:, 4] = np.where(a, v - kv * c, v)
+        self.state[slots] = st
+        self.last_frame[slots] = frame_no
+        self.last_t[slots] = t
+        misses = np.where(accepted, 0, self.misses[slots] + 1)
+        self.misses[slots] = misses
+        updates = self.updates[slots] + (accepted & ~new)
+        self.updates[slots] = updates
+        rejected = ~accepted
+        if rejected.any():
+            self.rejected_total += int(rejected.sum())
+            # lệch liên tục (ID switch / tracker nhảy bbox) -> khởi tạo lại từ phép đo mới
+            lost = rejected & (misses > self.max_misses)
+            if lost.any():
+                self._init(slots[lost], z[lost], track_ids[lost], frame_no, t)
+                st[lost] = self.state[slots[lost]]
+                updates[lost] = 1
+
+        vel = st[:, 1]
+        speed = np.hypot(vel[:, 0], vel[:, 1]) * 3.6
+        ready = (updates >= 2) & (st[:, 4].max(axis=1) <= self.ready_var)
+        return speed, ready, accepted
@@ -0,0 +1,213 @@
+# speedflow/metarec.py
+# Ghi/đọc metadata object theo frame ra file nhị phân gọn, mmap được (không cần DeepStream để đọc).
+# File .sfmr = HEADER(16 byte) | record cố định REC_DTYPE nối tiếp nhau:
+#   MAGIC b"SFMR" | VERSION u16 | RECORD_SIZE u16 | reserved 8 byte
+# 1 record = 1 object; frame không có object được ghi 1 record đánh dấu (class_id = MARK_CLASS)
+# để replay giữ đúng nhịp frame (thu hồi track theo frame_num).
+import struct
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"SFMR"
+VERSION = 2
+_HEADER = struct.Struct("<4sHH8x")
+MARK_CLASS = -1
+NO_PTS = -1
+
+_FIELDS_V1 = [
+    ("batch", "<u4"),        # số thứ tự batch (các frame cùng 1 lần gọi probe)
+    ("source_id", "<u2"),
+    ("class_id", "<i2"),     # MARK_CLASS = frame rỗng
+    ("frame_num", "<i4"),
+    ("ts_ns", "<i8"),        # ntp_timestamp (0 nếu không có)
+    ("track_id", "<u8"),
+    ("left", "<f4"), ("top", "<f4"), ("width", "<f4"), ("height", "<f4"),
+    ("confidence", "<f4"),
+]
+# v2: thêm buf_pts của frame (NO_PTS = không có) -> replay tính tốc độ theo PTS như pipeline thật
+REC_DTYPE = np.dtype(_FIELDS_V1 + [("pts_ns", "<i8")])
+_REC_DTYPES = {1: np.dtype(_FIELDS_V1), 2: REC_DTYPE}
+
+
+class MetaWriter:
+    """Ghi record theo lô (mảng NumPy cấp phát sẵn), mỗi lô đầy mới gọi write 1 lần."""
+    def __init__(self, path, chunk: int = 4096):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.path, "wb")
+        self.f.write(_HEADER.pack(MAGIC, VERSION, REC_DTYPE.itemsize))
+        self.buf = np.zeros(max(1, int(chunk)), dtype=REC_DTYPE)
+        self.n = 0
+        self.batches = 0
+        self.records = 0
+
+    def add(self, source_id, frame_num, ts_ns, class_id=MARK_CLASS, track_id=0,
+            left=0.0, top=0.0, width=0.0, height=0.0, confidence=0.0, pts_ns=NO_PTS):
+        if self.n == len(self.buf):
+            self.flush()
+        self.buf[self.n] = (self.batches, source_id, class_id, frame_num, ts_ns, track_id,
+                            left, top, width, height, confidence, pts_ns)
+        self.n += 1
+        self.records += 1
+
+    def end_batch(self):
+        self.batches += 1
+
+    def flush(self):
+        if self.n:
+            self.f.write(self.buf[:self.n].tobytes())
+            self.n = 0
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.close()
+
+
+def open_recording(path) -> np.memmap:
+    """-> mảng record (memmap, chỉ đọc). Đọc được cả file v1 (không có cột pts_ns)."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        head = f.read(_HEADER.size)
+    if len(head) < _HEADER.size:
+        raise ValueError(f"Not a metadata recording: {path}")
+    magic, version, rec_size = _HEADER.unpack(head)
+    dtype = _REC_DTYPES.get(version)
+    if magic != MAGIC or dtype is None or rec_size != dtype.itemsize:
+        raise ValueError(f"Bad recording header: {magic!r} v{version} rec={rec_size}")
+    n = (path.stat().st_size - _HEADER.size) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=_HEADER.size, shape=(n,))
+
+
+def iter_batches(recs):
+    """
+    -> từng batch: list[(source_id, frame_num, ts_ns, pts_ns, rows)], rows = mảng record object của frame,
+    pts_ns = NO_PTS nếu recording không có PTS (v1).
+    """
+    if len(recs) == 0:
+        return
+    has_pts = "pts_ns" in recs.dtype.names
+    bounds = np.flatnonzero(np.diff(recs["batch"])) + 1
+    for rows in np.split(recs, bounds):
+        frames = []
+        key = None
+        start = 0
+        for i in range(len(rows) + 1):
+            k = None if i == len(rows) else (int(rows["source_id"][i]), int(rows["frame_num"][i]))
+            if k != key:
+                if key is not None:
+                    fr = rows[start:i]
+                    pts_ns = int(fr["pts_ns"][0]) if has_pts else NO_PTS
+                    frames.append((key[0], key[1], int(fr["ts_ns"][0]), pts_ns, fr[fr["class_id"] != MARK_CLASS]))
+                key, start = k, i
+        yield frames
+
+
+class SyntheticTraffic:
+    """
+    Xe giả chạy dọc khung hình (mỗi xe 1 làn, tốc độ pixel/frame cố định); ra khỏi khung hình
+    -> vào lại với track_id mới. Dùng cho detector giả (backend CPU) và tạo recording cho benchmark.
+    -> detect(frame_num) = list[(track_id, class_id, confidence, left, top, width, height)]
+    """
+    def __init__(self, width, height, n_vehicles=4, class_id=2, seed=0):
+        self.width, self.height = int(width), int(height)
+        self.class_id = int(class_id)
+        rng = np.random.default_rng(seed)
+        n = max(0, int(n_vehicles))
+        self.box_w = self.width / max(4, 2 * n)
+        self.box_h = self.box_w * 0.6
+        self.lanes = (np.arange(n) + 0.5) * self.width / max(1, n) - self.box_w / 2
+        self.speed_px = rng.uniform(0.004, 0.012, n) * self.height   # px/frame
+        self.offset = rng.uniform(0, self.height, n)
+
+    def detect(self, frame_num: int):
+        period = self.height + self.box_h
+        pos = self.offset + self.speed_px * frame_num
+        out = []
+        for lane, (x, p) in enumerate(zip(self.lanes, pos)):
+            lap, y = divmod(p, period)
+            out.append((lane * 1_000_000 + int(lap), self.class_id, 0.9,
+                        float(x), float(y - self.box_h), float(self.box_w), float(self.box_h)))
+        return out
+
+
+class WorldTraffic:
+    """
+    Xe giả chạy với tốc độ KHÔNG ĐỔI trên mặt đường rồi chiếu ra pixel (to_pixel: (N, 2) mét -> pixel)
+    -> biết tốc độ thật của từng xe để đo sai số (SyntheticTraffic chạy đều theo pixel nên tốc độ
+    mặt đường thay đổi theo phối cảnh). Cùng giao diện detect(frame_num).
+    """
+    def __init__(self, to_pixel, road_width, road_length, n_vehicles=4, fps=25.0, kmh=(30.0, 90.0),
+                 class_id=2, seed=0):
+        self.to_pixel = to_pixel
+        self.length = float(road_length)
+        self.fps = float(fps)
+        self.class_id = int(class_id)
+        rng = np.random.default_rng(seed)
+        n = max(0, int(n_vehicles))
+        self.lane_x = (np.arange(n) + 0.5) * float(road_width) / max(1, n)
+        self.speed_ms = rng.uniform(kmh[0], kmh[1], n) / 3.6
+        self.offset = rng.uniform(0, self.length, n)
+
+    def kmh(self, track_id: int) -> float:
+        """Tốc độ thật (km/h) của track_id do detect() sinh ra."""
+        return float(self.speed_ms[(int(track_id) & ((1 << 40) - 1)) // 1_000_000] * 3.6)
+
+    def detect(self, frame_num: int):
+        if len(self.lane_x) == 0:
+            return []
+        lap, y = np.divmod(self.offset + self.speed_ms * (frame_num / self.fps), self.length)
+        foot = self.to_pixel(np.stack([self.lane_x, y], axis=1))
+        side = self.to_pixel(np.stack([self.lane_x + 0.9, y], axis=1))     # nửa bề ngang xe ~1.8 m
+        out = []
+        for lane, ((cx, by), (sx, _)) in enumerate(zip(foot, side)):
+            w = max(2.0, 2.0 * abs(float(sx) - float(cx)))
+            h = 0.8 * w
+            out.append((lane * 1_000_000 + int(lap[lane]), self.class_id, 0.9,
+                        float(cx) - w / 2, float(by) - h, w, h))
+        return out
+
+
+def synth_recording(path, frames: int = 3000, vehicles: int = 20, sources: int = 1,
+                    width: int = 1280, height: int = 720, fps: float = 25.0, seed: int = 0,
+                    drop: float = 0.0, traffic=None):
+    """
+    Tạo recording tổng hợp (không cần camera): mỗi batch = 1 frame của mỗi nguồn.
+    drop: tỉ lệ frame bị bỏ ngẫu nhiên trước nvstreammux (như rtspsrc drop-on-latency): frame_num của
+    frame còn lại vẫn liên tục, chỉ PTS cho biết thời gian thật.
+    traffic: list generator (detect(frame_num)) mỗi nguồn, mặc định SyntheticTraffic.
+    """
+    if traffic is None:
+        traffic = [SyntheticTraffic(width, height, vehicles, seed=seed + s) for s in range(sources)]
+    sources = len(traffic)
+    rng = np.random.default_rng(seed + 7919)
+    frame_num = [0] * sources
+    w = MetaWriter(path)
+    t0 = 1_700_000_000_000_000_000
+    try:
+        for f in range(frames):
+            pts_ns = int(f * 1e9 / fps)
+            ts_ns = t0 + pts_ns
+            keep = rng.random(sources) >= drop if drop > 0 else [True] * sources
+            if not any(keep):
+                continue
+            for s, tr in enumerate(traffic):
+                if not keep[s]:
+                    continue
+                fn = frame_num[s]
+                frame_num[s] += 1
+                dets = tr.detect(f)
+                if not dets:
+                    w.add(s, fn, ts_ns, pts_ns=pts_ns)
+                for tid, cls, conf, l, t, bw, bh in dets:
+                    # track_id khác nhau giữa các nguồn như nvtracker
+                    w.add(s, fn, ts_ns, cls, (s << 40) | tid, l, t, bw, bh, conf, pts_ns)
+            w.end_batch()
+    finally:
+        w.close()
+    return path
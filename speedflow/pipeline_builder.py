@@ -0,0 +1,537 @@
+# speedflow/pipeline_builder.py
+# Dựng pipeline từ 1 spec khai báo: nguồn -> mux -> infer -> tracker -> analytics -> OSD -> tee -> N output.
+# 1 lần suy luận phục vụ mọi output (display / mp4 / webrtc / fakesink), mỗi nhánh sau tee có queue riêng.
+# Backend:
+#   - "deepstream": nvstreammux/nvinfer/nvtracker/nvdsanalytics/nvdsosd (Jetson/dGPU)
+#   - "cpu"       : decode phần mềm + detector giả (StubDetector) -> chạy được graph + probe trên CI
+import os, math, time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+import cv2
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import speedflow.settings as S
+from .speed_core import crop_bbox, pts_seconds
+from .fakeds import ObjectMeta
+from .metarec import SyntheticTraffic
+from .pipeline_trace import PipelineTracer, format_report
+from .infer_control import attach_adaptive_interval
+
+BACKEND_DS = "deepstream"
+BACKEND_CPU = "cpu"
+BACKENDS = (BACKEND_DS, BACKEND_CPU)
+
+OUT_DISPLAY = "display"
+OUT_MP4 = "mp4"
+OUT_WEBRTC = "webrtc"
+OUT_FAKE = "fakesink"
+OUTPUTS = (OUT_DISPLAY, OUT_MP4, OUT_WEBRTC, OUT_FAKE)
+
+# tên sink của output đầu tiên mỗi loại (run_file.py tìm "filesink", run_webrtc.py dùng "webrtc")
+_SINK_NAMES = {OUT_DISPLAY: "display", OUT_MP4: "filesink", OUT_WEBRTC: "webrtc", OUT_FAKE: "fakesink"}
+# H.264: "auto" = nvv4l2h264enc (deepstream) / x264enc (cpu); "x264" = encoder phần mềm cả ở backend
+# deepstream (chạy thử WebRTC trên máy Linux không có phần cứng Jetson)
+ENCODER_AUTO, ENCODER_NV, ENCODER_X264 = "auto", "nvv4l2", "x264"
+ENCODERS = (ENCODER_AUTO, ENCODER_NV, ENCODER_X264)
+# output live: queue leaky -> viewer chậm không chặn suy luận; mp4 thì không được rơi frame
+_LEAKY = {OUT_DISPLAY, OUT_WEBRTC, OUT_FAKE}
+
+
+def is_file_uri(u: str) -> bool:
+    return u.startswith("file://") or (os.path.isabs(u) and os.path.isfile(u))
+
+
+def normalize_uri(u: str) -> str:
+    return u if u.startswith("file://") or not is_file_uri(u) else "file://" + u
+
+
+@dataclass
+class OutputSpec:
+    kind: str                     # display | mp4 | webrtc | fakesink
+    location: str = ""            # mp4: file đầu ra
+    bitrate: int = 4_000_000
+    name: str = ""                # tên element sink (mặc định theo _SINK_NAMES)
+    encoder: str = ENCODER_AUTO   # mp4/webrtc: xem ENCODERS
+    fanout: bool = False          # webrtc: RTP -> tee "<name>-rtp_tee", webrtcbin/viewer thêm lúc chạy (webrtc_fanout.py)
+
+
+@dataclass
+class PipelineSpec:
+    sources: List[str]
+    outputs: List[OutputSpec] = field(default_factory=lambda: [OutputSpec(OUT_DISPLAY)])
+    backend: str = BACKEND_DS
+    source_kind: str = "uri"      # "uri" (uridecodebin) | "file" (filesrc + decodebin) | "test" (videotestsrc)
+    mux_width: int = None         # None = settings.MUX_WIDTH/MUX_HEIGHT (hoặc 1280x720)
+    mux_height: int = None
+    live: Optional[bool] = None   # None = tự đoán theo URI
+    infer_config: str = None      # None = settings.INFER_CONFIG
+    tracker_cfg: str = None
+    tracker_width: int = 640
+    tracker_height: int = 384
+    # "" = settings.ANALYTICS_CFG nếu USE_NVDSANALYTICS, None = bỏ, path = luôn thêm nvdsanalytics
+    # (ROI đã lọc trong probe: zones.py)
+    analytics_cfg: Optional[str] = ""
+    tile_width: int = 1280
+    tile_height: int = 720
+    rtsp_latency_ms: int = 100
+    stub_vehicles: int = 4        # backend cpu: số xe giả trên khung hình
+    test_frames: int = 300        # source_kind "test": số frame của videotestsrc
+    trace_interval_s: float = 0.0  # >0: đo latency/fps từng element (pipeline_trace.py), log mỗi N giây
+    adaptive_interval: bool = False  # interval của nvinfer theo tải/mật độ xe (infer_control.py)
+    fps: float = None             # fps nguồn cho adaptive_interval (None = settings.VIDEO_FPS)
+
+
+@dataclass
+class BuiltPipeline:
+    pipeline: object
+    elements: dict                # tên -> element
+    probe_element: object         # gắn probe tốc độ vào sink pad (nvdsosd, hoặc tiler khi N nguồn)
+    backend: str
+    stub: object = None           # StubDetector (backend cpu)
+    tracer: object = None         # PipelineTracer khi spec.trace_interval_s > 0
+    infer_ctl: object = None      # InferIntervalController khi spec.adaptive_interval
+
+    def get(self, name):
+        return self.elements.get(name)
+
+    @property
+    def osd(self):
+        return self.elements.get("onscreendisplay")
+
+    @property
+    def webrtc(self):
+        return self.elements.get(_SINK_NAMES[OUT_WEBRTC])
+
+    @property
+    def rtp_tee(self):
+        """tee RTP H.264 của output webrtc fanout (1 lần encode cho mọi viewer)."""
+        return self.elements.get(_SINK_NAMES[OUT_WEBRTC] + "-rtp_tee")
+
+
+class _Graph:
+    def __init__(self, name):
+        self.pipeline = Gst.Pipeline.new(name)
+        self.elements = {}
+        self.branches = {}        # tên queue đầu nhánh -> tên output
+
+    def make(self, factory, name, **props):
+        e = Gst.ElementFactory.make(factory, name)
+        if not e: raise RuntimeError(f"Failed to create: {factory} ({name})")
+        for k, v in props.items():
+            e.set_property(k.replace("_", "-"), v)
+        self.pipeline.add(e)
+        self.elements[name] = e
+        return e
+
+    def chain(self, *elements):
+        for a, b in zip(elements, elements[1:]):
+            if not a.link(b):
+                raise RuntimeError(f"Failed to link {a.get_name()} -> {b.get_name()}")
+        return elements[-1]
+
+
+def _try_set(e, prop, val):
+    try: e.set_property(prop, val)
+    except Exception: pass
+
+
+# ==================== nguồn ====================
+def _add_source(g, spec, index, uri, link_pad):
+    """link_pad(pad): nối src pad video của decoder vào graph (mux sink_i hoặc convert của CPU)."""
+    suffix = "" if len(spec.sources) == 1 else f"-{index:02d}"
+
+    def on_pad_added(decodebin, pad):
+        caps = pad.get_current_caps()
+        if caps and caps.to_string().startswith("video/"):
+            link_pad(pad)
+
+    if spec.source_kind == "test":
+        src = g.make("videotestsrc", "source-bin" + suffix, num_buffers=int(spec.test_frames))
+        return src, False
+    if spec.source_kind == "file":
+        src = g.make("filesrc", "file-source" + suffix)
+        if uri:
+            src.set_property("location", uri)
+        dec = g.make("decodebin", "decoder" + suffix)
+        src.link(dec)
+        dec.connect("pad-added", on_pad_added)
+        return None, False
+
+    uri = normalize_uri(uri)
+    is_file = is_file_uri(uri)
+    src = g.make("uridecodebin", "source-bin" + suffix, uri=uri)
+    if spec.backend == BACKEND_CPU:
+        _try_set(src, "force-sw-decoders", True)
+
+    def on_source_setup(decodebin, s):
+        if not is_file:
+            for prop, val in [("latency", spec.rtsp_latency_ms), ("drop-on-latency", True)]:
+                _try_set(s, prop, val)
+    src.connect("source-setup", on_source_setup)
+    src.connect("pad-added", on_pad_added)
+    return None, not is_file
+
+
+# ==================== output (sau tee) ====================
+def _add_output(g, spec, tee, out, index, names_used):
+    kind = out.kind
+    if kind not in OUTPUTS:
+        raise ValueError(f"Invalid output: {kind!r} (expected one of {OUTPUTS})")
+    name = out.name or _SINK_NAMES[kind]
+    if name in names_used:
+        name = f"{name}_{index}"
+    names_used.add(name)
+    cpu = spec.backend == BACKEND_CPU
+
+    q = g.make("queue", f"{name}-queue")
+    g.branches[q.get_name()] = name
+    if kind in _LEAKY:
+        q.set_property("leaky", 2)              # downstream: bỏ buffer cũ
+        q.set_property("max-size-buffers", 4)
+    branch = [q]
+
+    if kind == OUT_FAKE:
+        branch.append(g.make("fakesink", name, sync=False, **{"async": False}))
+    elif kind == OUT_DISPLAY:
+        if cpu:
+            branch += [g.make("videoconvert", f"{name}-conv"), g.make("autovideosink", name, sync=False)]
+        else:
+            branch += [g.make("nvvideoconvert", f"{name}-conv"),
+                       g.make("nvegltransform", f"{name}-eglT"),
+                       g.make("nveglglessink", name, sync=False, qos=False)]
+    else:
+        branch += _encoder(g, name, cpu, out.bitrate, out.encoder, webrtc=kind == OUT_WEBRTC)
+        if kind == OUT_MP4:
+            mux = g.make("mp4mux" if cpu else "qtmux", f"{name}-muxer")
+            sink = g.make("filesink", name, sync=False)
+            sink.set_property("location", out.location or str(S.PATH_LOGS / "output.mp4"))
+            branch += [mux, sink]
+        else:   # webrtc
+            pay = g.make("rtph264pay", f"{name}-pay", pt=96, config_interval=1)
+            rtp_caps = g.make("capsfilter", f"{name}-rtp_caps")
+            rtp_caps.set_property("caps", Gst.Caps.from_string(
+                "application/x-rtp,media=video,encoding-name=H264,payload=96,clock-rate=90000"))
+            if out.fanout:
+                # viewer (queue + webrtcbin) gắn vào tee lúc chạy; nhánh fakesink giữ luồng khi chưa ai xem
+                rtp_tee = g.make("tee", f"{name}-rtp_tee", allow_not_linked=True)
+                idle_q = g.make("queue", f"{name}-idle_queue", leaky=2, max_size_buffers=1)
+                idle = g.make("fakesink", f"{name}-idle", sync=False, **{"async": False})
+                branch += [pay, rtp_caps, rtp_tee, idle_q, idle]
+                g.chain(*branch)
+                branch = None
+            else:
+                webrtc = g.make("webrtcbin", name)
+                _try_set(webrtc, "stun-server", S.WEBRTC_STUN)
+                branch += [pay, rtp_caps]
+                g.chain(*branch)
+                sinkpad = webrtc.get_request_pad("sink_%u")
+                if not sinkpad or rtp_caps.get_static_pad("src").link(sinkpad) != Gst.PadLinkReturn.OK:
+                    raise RuntimeError("Failed to link RTP to webrtcbin")
+                branch = None
+
+    if branch is not None:
+        g.chain(*branch)
+    teepad = tee.get_request_pad("src_%u")
+    if teepad.link(q.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+        raise RuntimeError(f"Failed to link tee -> {name}")
+
+
+def _encoder(g, name, cpu, bitrate, encoder=ENCODER_AUTO, webrtc=False):
+    if encoder not in ENCODERS:
+        raise ValueError(f"Invalid encoder: {encoder!r} (expected one of {ENCODERS})")
+    if encoder == ENCODER_X264 or (encoder == ENCODER_AUTO and cpu):
+        enc = g.make("x264enc", f"{name}-enc", bitrate=max(1, int(bitrate) // 1000), key_int_max=30)
+        _try_set(enc, "tune", "zerolatency")
+        _try_set(enc, "speed-preset", "ultrafast")
+        # deepstream: NVMM -> RAM trước encoder phần mềm
+        head = ([g.make("videoconvert", f"{name}-conv")] if cpu else
+                [g.make("nvvideoconvert", f"{name}-conv"), g.make("capsfilter", f"{name}-raw_caps",
+                                                                  caps=Gst.Caps.from_string("video/x-raw,format=I420"))])
+        tail = [g.make("h264parse", f"{name}-parse")]
+        if webrtc:
+            # browser giải mã chắc chắn được constrained-baseline (profile-level-id 42e0xx)
+            tail.insert(0, g.make("capsfilter", f"{name}-h264_caps",
+                                  caps=Gst.Caps.from_string("video/x-h264,profile=constrained-baseline")))
+        return head + [enc] + tail
+    if cpu:
+        raise ValueError("nvv4l2h264enc needs the deepstream backend")
+    enc = g.make("nvv4l2h264enc", f"{name}-enc", insert_sps_pps=True, iframeinterval=30,
+                 bitrate=int(bitrate))
+    _try_set(enc, "maxperf-enable", True)
+    return [g.make("nvvideoconvert", f"{name}-conv"), enc, g.make("h264parse", f"{name}-parse")]
+
+
+# ==================== backend ====================
+def _build_deepstream(g, spec, width, height):
+    n = len(spec.sources)
+    streammux = g.make("nvstreammux", "stream-muxer")
+
+    live = False
+    for i, uri in enumerate(spec.sources):
+        def link_pad(pad, i=i):
+            # sink_<i> -> frame_meta.source_id == i
+            sinkpad = streammux.get_request_pad(f"sink_{i}")
+            if sinkpad and not sinkpad.is_linked():
+                pad.link(sinkpad)
+        src, is_live = _add_source(g, spec, i, uri, link_pad)
+        if src is not None:   # videotestsrc: pad tĩnh
+            link_pad(src.get_static_pad("src"))
+        live = live or is_live
+    if spec.live is not None:
+        live = spec.live
+
+    streammux.set_property('batch-size', n)
+    streammux.set_property('width', width)
+    streammux.set_property('height', height)
+    streammux.set_property('batched-push-timeout', 40000)
+    streammux.set_property('live-source', 1 if live else 0)
+
+    pgie = g.make("nvinfer", "primary-infer")
+    pgie.set_property('config-file-path', str(spec.infer_config or S.INFER_CONFIG))
+    if n > 1:
+        pgie.set_property('batch-size', n)   # 1 TensorRT context batch N thay cho N context batch 1
+
+    tracker = g.make("nvtracker", "tracker")
+    tracker.set_property('ll-lib-file', "/opt/nvidia/deepstream/deepstream/lib/libnvds_nvmultiobjecttracker.so")
+    tracker.set_property('ll-config-file', str(spec.tracker_cfg or S.TRACKER_CFG))
+    tracker.set_property('tracker-width', spec.tracker_width)
+    tracker.set_property('tracker-height', spec.tracker_height)
+    tracker.set_property('gpu_id', 0)
+
+    chain = [streammux, pgie, tracker]
+    if spec.analytics_cfg or (spec.analytics_cfg == "" and S.USE_NVDSANALYTICS):
+        analytics = g.make("nvdsanalytics", "analytics")
+        analytics.set_property('config-file', str(spec.analytics_cfg or S.ANALYTICS_CFG))
+        chain.append(analytics)
+
+    # RGBA trước OSD/tiler để probe crop được surface
+    preosd_convert = g.make("nvvideoconvert", "preosd_convert")
+    preosd_caps = g.make("capsfilter", "preosd_caps")
+    preosd_caps.set_property("caps", Gst.Caps.from_string("video/x-raw(memory:NVMM), format=RGBA"))
+    chain += [preosd_convert, preosd_caps]
+
+    probe_element = None
+    if n > 1:
+        tiler = g.make("nvmultistreamtiler", "tiler")
+        rows = int(math.sqrt(n))
+        tiler.set_property("rows", rows)
+        tiler.set_property("columns", int(math.ceil(n / rows)))
+        tiler.set_property("width", int(spec.tile_width))
+        tiler.set_property("height", int(spec.tile_height))
+        chain.append(tiler)
+        probe_element = tiler      # trước tiler frame của từng nguồn còn tách riêng
+
+    nvdsosd = g.make("nvdsosd", "onscreendisplay", display_text=1, display_bbox=1)
+    chain.append(nvdsosd)
+    g.chain(*chain)
+    return nvdsosd, probe_element or nvdsosd, None
+
+
+def _build_cpu(g, spec, width, height):
+    if len(spec.sources) != 1:
+        raise ValueError("CPU backend supports a single source")
+    conv = g.make("videoconvert", "decode-convert")
+    scale = g.make("videoscale", "decode-scale")
+    caps = g.make("capsfilter", "preosd_caps")
+    caps.set_property("caps", Gst.Caps.from_string(f"video/x-raw,format=RGBA,width={width},height={height}"))
+
+    def link_pad(pad):
+        sinkpad = conv.get_static_pad("sink")
+        if not sinkpad.is_linked():
+            pad.link(sinkpad)
+    src, _ = _add_source(g, spec, 0, spec.sources[0], link_pad)
+    if src is not None:
+        link_pad(src.get_static_pad("src"))
+
+    # detector + tracker giả, OSD giả (identity) giữ tên element như backend deepstream
+    pgie = g.make("identity", "primary-infer")
+    stub = StubDetector(width, height, n_vehicles=spec.stub_vehicles)
+    pgie.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, stub.on_buffer, None)
+    osd = g.make("identity", "onscreendisplay")
+    g.chain(conv, scale, caps, pgie, osd)
+    return osd, osd, stub
+
+
+def build_pipeline(spec: PipelineSpec, name: str = "speedflow") -> BuiltPipeline:
+    if spec.backend not in BACKENDS:
+        raise ValueError(f"Invalid backend: {spec.backend!r} (expected one of {BACKENDS})")
+    if not spec.sources:
+        raise ValueError("Need at least one source")
+    if not spec.outputs:
+        raise ValueError("Need at least one output")
+    Gst.init(None)
+    width = int(spec.mux_width or getattr(S, "MUX_WIDTH", 1280))
+    height = int(spec.mux_height or getattr(S, "MUX_HEIGHT", 720))
+
+    g = _Graph(name)
+    build = _build_cpu if spec.backend == BACKEND_CPU else _build_deepstream
+    osd, probe_element, stub = build(g, spec, width, height)
+
+    # 1 lần suy luận -> tee -> mọi output
+    tee = g.make("tee", "osd-tee")
+    g.chain(osd, tee)
+    names_used = set()
+    for i, out in enumerate(spec.outputs):
+        _add_output(g, spec, tee, out, i, names_used)
+
+    tracer = None
+    if spec.trace_interval_s and spec.trace_interval_s > 0:
+        tracer = PipelineTracer(spec.trace_interval_s).attach(g.pipeline, g.elements, g.branches)
+        tracer.add_sink(lambda rep: print(format_report(rep)))
+    infer_ctl = None
+    if spec.adaptive_interval:
+        if spec.backend == BACKEND_DS:
+            infer_ctl = attach_adaptive_interval(g.pipeline, fps=spec.fps or S.VIDEO_FPS)
+        else:
+            print("[WARN] adaptive interval needs the deepstream backend (nvinfer), ignored")
+    return BuiltPipeline(g.pipeline, g.elements, probe_element, spec.backend, stub, tracer, infer_ctl)
+
+
+# ==================== backend CPU: detector giả + probe ====================
+class StubDetector:
+    """
+    Detector + tracker giả cho backend CPU (metarec.SyntheticTraffic): xe chạy dọc khung hình,
+    ra khỏi khung hình -> vào lại với track_id mới (trip kết thúc).
+    Kết quả (fakeds.ObjectMeta) giữ theo PTS để probe phía sau (cùng streaming thread) lấy ra.
+    """
+    def __init__(self, width, height, n_vehicles=4, class_id=2, seed=0):
+        self.traffic = SyntheticTraffic(width, height, n_vehicles, class_id, seed)
+        self.width, self.height = int(width), int(height)
+        self.frame_num = 0
+        self.pending = {}
+
+    def detect(self, frame_num: int):
+        return [ObjectMeta(*d) for d in self.traffic.detect(frame_num)]
+
+    def on_buffer(self, pad, info, u_data):
+        buf = info.get_buffer()
+        if buf:
+            self.pending[buf.pts] = (self.frame_num, self.detect(self.frame_num))
+            self.frame_num += 1
+        return Gst.PadProbeReturn.OK
+
+    def take(self, pts):
+        return self.pending.pop(pts, (self.frame_num, []))
+
+
+class CpuFrame:
+    """Frame RGBA trong bộ nhớ hệ thống; chỉ map buffer khi có crop (giống LazyFrame)."""
+    __slots__ = ("buffer", "width", "height", "_image")
+
+    def __init__(self, buffer, width, height):
+        self.buffer = buffer
+        self.width, self.height = int(width), int(height)
+        self._image = None
+
+    def image(self):
+        if self._image is None:
+            ok, info = self.buffer.map(Gst.MapFlags.READ)
+            if not ok:
+                raise RuntimeError("Failed to map buffer")
+            try:
+                n = self.width * self.height * 4
+                self._image = np.frombuffer(info.data, dtype=np.uint8)[:n] \
+                    .reshape(self.height, self.width, 4).copy()
+            finally:
+                self.buffer.unmap(info)
+        return self._image
+
+    def crop_bgr(self, obj):
+        roi = crop_bbox(self.image(), obj)
+        return None if roi is None else cv2.cvtColor(roi, cv2.COLOR_RGBA2BGR)
+
+
+def attach_speed_probe(built: BuiltPipeline, probe):
+    """Gắn SpeedProbe vào pipeline: deepstream đọc NvDsBatchMeta, cpu đọc kết quả StubDetector."""
+    pad = built.probe_element.get_static_pad("sink")
+    if built.infer_ctl is not None:
+        probe.add_activity_sink(built.infer_ctl.observe_vehicles)
+    if built.backend == BACKEND_DS:
+        pad.add_probe(Gst.PadProbeType.BUFFER, probe.osd_sink_pad_buffer_probe, None)
+        return
+    stub = built.stub
+
+    def on_buffer(pad, info, u_data):
+        buf = info.get_buffer()
+        if not buf:
+            return Gst.PadProbeReturn.OK
+        frame_num, objs = stub.take(buf.pts)
+        ts = time.time()
+        ts_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts))
+        probe.process_frames([(0, frame_num, ts, ts_iso, objs, CpuFrame(buf, stub.width, stub.height),
+                               pts_seconds(buf.pts))])
+        return Gst.PadProbeReturn.OK
+    pad.add_probe(Gst.PadProbeType.BUFFER, on_buffer, None)
+
+
+def parse_output(text: str) -> OutputSpec:
+    """"mp4:/tmp/out.mp4" | "webrtc" | "display" | "fakesink" -> OutputSpec."""
+    kind, _, location = text.partition(":")
+    return OutputSpec(kind=kind, location=location)
+
+
+# ==================== chạy thử (CI, backend cpu) ====================
+def main():
+    import argparse
+    from gi.repository import GLib
+    from .homography import load_points, load_view_transformer
+    from .zones import load_zones
+    from .probes import SpeedProbe
+
+    parser = argparse.ArgumentParser(description="Chạy thử pipeline từ spec (mặc định backend cpu + fakesink)")
+    parser.add_argument("source", nargs="?", default="test", help="URI/đường dẫn video, hoặc 'test' (videotestsrc)")
+    parser.add_argument("--backend", default=BACKEND_CPU, choices=BACKENDS)
+    parser.add_argument("--output", action="append", default=None,
+                        help="display | fakesink | webrtc | mp4:<path>; lặp lại để tee ra nhiều output")
+    parser.add_argument("--frames", type=int, default=300, help="số frame khi source=test")
+    parser.add_argument("--homo", default=str(S.HOMO_YML))
+    parser.add_argument("--trace", type=float, default=0.0, metavar="SECONDS",
+                        help="log latency/fps từng element + bottleneck mỗi N giây")
+    args = parser.parse_args()
+
+    spec = PipelineSpec(
+        sources=[args.source], backend=args.backend,
+        source_kind="test" if args.source == "test" else "uri",
+        outputs=[parse_output(o) for o in (args.output or [OUT_FAKE])],
+        test_frames=args.frames, trace_interval_s=args.trace,
+    )
+    built = build_pipeline(spec)
+    source_pts, _ = load_points(args.homo)
+    vt = load_view_transformer(args.homo, spec.mux_width or S.MUX_WIDTH, spec.mux_height or S.MUX_HEIGHT)
+    probe = SpeedProbe(vt, roi_source_points=source_pts, zones=load_zones(args.homo, source_pts),
+                       save_snapshots=False, edge_db=None)
+    trips = []
+    probe.add_trip_sink(trips.append)
+    attach_speed_probe(built, probe)
+
+    loop = GLib.MainLoop()
+    bus = built.pipeline.get_bus()
+    bus.add_signal_watch()
+
+    def on_message(bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print(f"ERROR from {message.src.get_name()}: {err}")
+            loop.quit()
+        elif message.type == Gst.MessageType.EOS:
+            loop.quit()
+    bus.connect("message", on_message)
+
+    t0 = time.perf_counter()
+    built.pipeline.set_state(Gst.State.PLAYING)
+    try:
+        loop.run()
+    finally:
+        built.pipeline.set_state(Gst.State.NULL)
+        probe.close()
+    frames = built.stub.frame_num if built.stub else -1
+    print(f"[RUN] {frames} frames in {time.perf_counter() - t0:.2f}s, {len(trips)} trips")
+    if built.tracer is not None:
+        print(format_report(built.tracer.report()))
+
+
+if __name__ == "__main__":
+    main()
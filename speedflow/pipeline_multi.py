@@ -0,0 +1,35 @@
+# speedflow/pipeline_multi.py
+# N nguồn -> 1 nvstreammux (batch-size N) -> 1 nvinfer/nvtracker(/nvdsanalytics) dùng chung
+# -> RGBA -> nvmultistreamtiler -> nvdsosd -> tee -> outputs (xem pipeline_builder.py).
+# Probe tốc độ gắn ở sink pad của tiler: frame của từng nguồn còn tách riêng (source_id, surface).
+from .pipeline_builder import PipelineSpec, OutputSpec, OUT_DISPLAY, OUT_MP4, OUT_FAKE, build_pipeline
+
+SINKS = ("display", "file", "fake")
+_SINK_OUTPUT = {"display": OUT_DISPLAY, "file": OUT_MP4, "fake": OUT_FAKE}
+
+
+def build_multi_pipeline(uris, analytics_cfg: str = None, sink="display",
+                         out_path: str = None, tile_width: int = 1280, tile_height: int = 720,
+                         trace_interval_s: float = 0.0):
+    """
+    uris[i] -> nvstreammux sink_i (source_id = i).
+    analytics_cfg: 1 file nvdsanalytics cho cả batch, ROI từng nguồn ở [roi-filtering-stream-<i>]
+      (None = theo USE_NVDSANALYTICS; ROI tốc độ đã lọc trong probe theo zone của từng nguồn).
+    sink: 1 hoặc list trong SINKS (cùng 1 lần suy luận, tee sau OSD).
+    -> (pipeline, tiler): gắn SpeedProbe vào tiler.get_static_pad("sink").
+    """
+    sinks = [sink] if isinstance(sink, str) else list(sink)
+    for s in sinks:
+        if s not in SINKS:
+            raise ValueError(f"Invalid sink: {s!r} (expected one of {SINKS})")
+    n = len(uris)
+    if n == 0:
+        raise ValueError("Need at least one source")
+    spec = PipelineSpec(
+        sources=list(uris),
+        outputs=[OutputSpec(_SINK_OUTPUT[s], location=out_path or "") for s in sinks],
+        analytics_cfg=analytics_cfg or "",
+        tile_width=tile_width, tile_height=tile_height, trace_interval_s=trace_interval_s,
+    )
+    built = build_pipeline(spec, name="ds-multi")
+    return built.pipeline, built.probe_element
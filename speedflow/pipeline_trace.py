@@ -0,0 +1,203 @@
+# speedflow/pipeline_trace.py
+# Đo latency/fps từng element của pipeline bằng buffer probe trên pad (tương tự tracer "latency" của
+# GStreamer nhưng chạy được trên Jetson mà không cần GST_TRACERS):
+#   sink pad: ghi thời điểm vào theo PTS  ->  src pad: cùng PTS -> latency của element
+#   fps = số buffer ra trong cửa sổ trượt window_s; fps nhánh = src pad của queue mỗi output sau tee.
+# Bottleneck = element có tải cao nhất (latency trung bình x fps = tỉ lệ thời gian bận).
+# Qua nvstreammux PTS của batch lấy theo frame trong batch -> latency mux chỉ mang tính tham khảo.
+import threading, time
+
+import numpy as np
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):  # tính toán/report không cần GStreamer
+    Gst = None
+
+RING = 1024           # số mẫu giữ lại mỗi element (đủ cho window 5s ở 200 fps)
+MAX_IN_FLIGHT = 64    # PTS chờ ra tối đa mỗi element (buffer bị drop/đổi PTS không làm rò bộ nhớ)
+# element không xử lý gì đáng đo (chỉ chuyển tiếp / chia nhánh)
+_SKIP_FACTORIES = {"capsfilter", "tee"}
+
+
+class _ElementTrace:
+    __slots__ = ("name", "factory", "branch", "t", "lat", "n", "in_flight", "fl_lock", "sink_only")
+
+    def __init__(self, name, factory, branch=None, sink_only=False):
+        self.name = name
+        self.factory = factory
+        self.branch = branch          # tên output nếu là queue đầu nhánh sau tee
+        self.sink_only = sink_only    # sink: chỉ đếm buffer vào (fps), không có latency
+        self.t = np.zeros(RING, dtype=np.float64)
+        self.lat = np.full(RING, np.nan, dtype=np.float32)
+        self.n = 0
+        self.in_flight = {}
+        # sink pad (on_in) và src pad (on_out) chạy trên 2 streaming thread khác nhau
+        self.fl_lock = threading.Lock()
+
+
+class PipelineTracer:
+    """
+    tracer = PipelineTracer(interval_s=5); tracer.attach(pipeline, elements, branches)
+    Report định kỳ (gọi từ streaming thread khi có buffer) -> các sink (vd log qua format_report).
+    """
+    def __init__(self, interval_s: float = 5.0, window_s: float = None):
+        self.interval_s = float(interval_s)
+        self.window_s = float(window_s or interval_s)
+        self.elements = {}
+        self.sinks = []
+        self._lock = threading.Lock()
+        self._next_report = time.monotonic() + self.interval_s
+
+    def add_sink(self, fn):
+        """fn(report: dict) -> None, gọi mỗi interval_s."""
+        self.sinks.append(fn)
+
+    # ---------- ghi mẫu ----------
+    def _get(self, name, factory="", branch=None, sink_only=False):
+        tr = self.elements.get(name)
+        if tr is None:
+            tr = self.elements[name] = _ElementTrace(name, factory, branch, sink_only)
+        return tr
+
+    def on_in(self, tr, pts, now=None):
+        now = time.monotonic() if now is None else now
+        if tr.sink_only:
+            self._record(tr, now, np.nan)
+            return
+        fl = tr.in_flight
+        with tr.fl_lock:
+            if len(fl) >= MAX_IN_FLIGHT:
+                fl.pop(next(iter(fl)))  # bỏ PTS cũ nhất
+            fl[pts] = now
+
+    def on_out(self, tr, pts, now=None):
+        now = time.monotonic() if now is None else now
+        with tr.fl_lock:
+            t_in = tr.in_flight.pop(pts, None)
+        self._record(tr, now, np.nan if t_in is None else now - t_in)
+
+    def _record(self, tr, now, lat):
+        with self._lock:
+            i = tr.n % RING
+            tr.t[i] = now
+            tr.lat[i] = lat
+            tr.n += 1
+            due = now >= self._next_report
+            if due:
+                self._next_report = now + self.interval_s
+        if due:
+            rep = self.report(now)
+            for fn in self.sinks:
+                try:
+                    fn(rep)
+                except Exception as e:
+                    print("[WARN] pipeline trace sink failed:", e)
+
+    # ---------- report ----------
+    def report(self, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        t_min = now - self.window_s
+        elements, branches = {}, {}
+        with self._lock:
+            traces = [(tr, tr.t.copy(), tr.lat.copy(), tr.n) for tr in self.elements.values()]
+        for tr, t, lat, n in traces:
+            k = min(n, RING)
+            mask = t[:k] >= t_min
+            cnt = int(mask.sum())
+            fps = cnt / self.window_s
+            if tr.branch is not None:
+                branches[tr.branch] = round(fps, 2)
+            if tr.sink_only:
+                continue
+            lw = lat[:k][mask]
+            lw = lw[~np.isnan(lw)]
+            mean_ms = float(lw.mean() * 1e3) if len(lw) else 0.0
+            elements[tr.name] = {
+                "factory": tr.factory,
+                "fps": round(fps, 2),
+                "lat_ms": round(mean_ms, 3),
+                "p95_ms": round(float(np.percentile(lw, 95) * 1e3), 3) if len(lw) else 0.0,
+                "busy_pct": round(mean_ms * fps / 10.0, 1),      # ms * fps / 1000 * 100
+            }
+        # queue: latency = thời gian chờ (hệ quả của nhánh sau chậm), không phải element bận
+        work = {k: v for k, v in elements.items() if v["factory"] != "queue"}
+        bottleneck = max(work, key=lambda k: work[k]["busy_pct"]) if work else None
+        return {
+            "type": "pipeline_trace",
+            "ts": round(time.time(), 3),
+            "window_s": self.window_s,
+            "elements": elements,
+            "branches": branches,
+            "bottleneck": bottleneck,
+        }
+
+    # ---------- gắn probe ----------
+    def trace_element(self, element, branch=None):
+        """Gắn probe vào sink/src pad của element (kể cả request pad tạo sau, vd nvstreammux sink_%u)."""
+        if Gst is None:
+            raise RuntimeError("GStreamer is not available")
+        name = element.get_name()
+        factory = element.get_factory().get_name() if element.get_factory() else ""
+        has_src = any(t.direction == Gst.PadDirection.SRC for t in element.get_pad_template_list())
+        tr = self._get(name, factory, branch, sink_only=not has_src)
+
+        def on_in(pad, info, u_data):
+            buf = info.get_buffer()
+            if buf:
+                self.on_in(tr, buf.pts)
+            return Gst.PadProbeReturn.OK
+
+        def on_out(pad, info, u_data):
+            buf = info.get_buffer()
+            if buf:
+                self.on_out(tr, buf.pts)
+            return Gst.PadProbeReturn.OK
+
+        def add_pad(pad):
+            if pad.get_direction() == Gst.PadDirection.SINK:
+                pad.add_probe(Gst.PadProbeType.BUFFER, on_in, None)
+            elif not tr.sink_only:
+                pad.add_probe(Gst.PadProbeType.BUFFER, on_out, None)
+
+        for pad in element.pads:
+            add_pad(pad)
+        element.connect("pad-added", lambda e, pad: add_pad(pad))
+        return tr
+
+    def attach(self, pipeline, elements: dict = None, branches: dict = None, decoders: bool = True):
+        """
+        elements: tên -> element (mặc định: mọi element con trực tiếp của pipeline).
+        branches: tên element queue -> tên output (fps từng nhánh sau tee).
+        decoders: đo cả decoder nằm trong uridecodebin/decodebin (bắt qua deep-element-added).
+        """
+        branches = branches or {}
+        if elements is None:
+            elements = {e.get_name(): e for e in pipeline.children}
+        for name, e in elements.items():
+            if isinstance(e, Gst.Bin):
+                continue          # bin (uridecodebin, webrtcbin): đo các element bên trong
+            factory = e.get_factory().get_name() if e.get_factory() else ""
+            if factory in _SKIP_FACTORIES:
+                continue
+            self.trace_element(e, branch=branches.get(name))
+
+        def on_deep_added(bin_, sub_bin, element):
+            f = element.get_factory()
+            if f is not None and "Decoder" in (f.get_metadata("klass") or ""):
+                self.trace_element(element)
+        if decoders:
+            pipeline.connect("deep-element-added", on_deep_added)
+        return self
+
+
+def format_report(rep: dict) -> str:
+    lines = [f"[TRACE] window {rep['window_s']:.0f}s bottleneck={rep['bottleneck']}"]
+    for name, st in sorted(rep["elements"].items(), key=lambda kv: -kv[1]["busy_pct"]):
+        flag = " <==" if name == rep["bottleneck"] else ""
+        lines.append(f"  {name:<22} {st['factory']:<16} {st['fps']:>6.1f} fps "
+                     f"{st['lat_ms']:>8.2f} ms (p95 {st['p95_ms']:.2f}) busy {st['busy_pct']:>5.1f}%{flag}")
+    if rep["branches"]:
+        lines.append("  branches: " + " ".join(f"{k}={v:.1f}fps" for k, v in rep["branches"].items()))
+    return "\n".join(lines)
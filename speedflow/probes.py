@@ -2,384 +2,404 @@
 # probes.py
 # -*- coding: utf-8 -*-
 # speedflow/probes.py
-import time, os, base64
-from collections import defaultdict, deque
+import time
 import numpy as np
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
-import pyds
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):  # replay/benchmark không có GStreamer: xem fakeds.install()
+    Gst = None
+try:
+    import pyds
+except ImportError:  # backend CPU / replay: meta đi qua speedflow.fakeds
+    pyds = None
 import cv2
 
 from .settings import (
-    VIDEO_FPS, VEHICLE_CLASS_IDS, SPEED_LOG,
+    VIDEO_FPS, VEHICLE_CLASS_IDS,
     SPEED_LIMIT_KMH, JPEG_QUALITY, SNAP_DIR, MAX_SNAPSHOT_PER_ID,
-    MIN_TRACK_AGE_FRAMES, MIN_WORLD_DISPL_M, MAX_ABS_KMH,
-    BBOX_AREA_JUMP, MIN_DET_CONF, MEDIAN_WINDOW
+    TRACK_MAX_LIVE, SNAP_ENCODE_WORKERS, SNAP_QUEUE_MAX, SNAP_DROP_POLICY,
+    CAMERA_ID, SNAP_SAVE, TRIP_EVIDENCE, TRIP_EVIDENCE_DIR, TRIP_EVIDENCE_QUOTA_MB, TRIP_EVIDENCE_QUALITY,
+    SNAP_QUOTA_MB, SNAP_RETENTION_DAYS, PROBE_STATS_INTERVAL_S, SPEED_ESTIMATOR,
+    SPEED_TIMEBASE, SPEED_LOG_FORMAT, SPEED_LOG_DIR, SPEED_LOG_ROTATE_MB, SPEED_LOG_ROTATE_S,
+    SPEED_LOG_FLUSH_S, SPEED_LOG_MAX_PENDING, EDGE_DB_PATH, EDGE_DB_RETENTION_DAYS, EDGE_DB_BATCH,
+    EDGE_DB_FLUSH_S, EDGE_DB_MAX_PENDING
 )
-class CSVLogger:
-    """Nhẹ nhàng: ghi CSV nếu cần, không bắt buộc."""
-    def __init__(self, path, header):
-        self.path = path
-        self.header = header
-        try:
-            if not os.path.exists(path):
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(",".join(header) + "\n")
-        except Exception:
-            pass
-    def write(self, row):
-        try:
-            with open(self.path, "a", encoding="utf-8") as f:
-                f.write(",".join(map(str, row)) + "\n")
-        except Exception:
-            pass
+from .speed_core import SourceConfig, MultiSourceSpeed, crop_bbox, pts_seconds
+from .snapshots import SnapshotEncoder, SnapshotWriter
+from .stage_stats import StageStats, format_snapshot, ST_META_WALK, ST_CROP, ST_TOTAL
+from .speed_log import SpeedLogWriter
+from .edge_db import EdgeEventStore
+
+class LazyFrame:
+    """
+    Truy cập NvBufSurface của 1 frame theo kiểu lazy:
+    - Chỉ map surface khi frame có ít nhất 1 crop overspeed (lần gọi crop_bgr đầu tiên)
+    - Chỉ cắt + đổi màu vùng bbox, không copy/convert cả frame
+    """
+    __slots__ = ("gst_buffer", "frame_meta", "_surface")
+
+    def __init__(self, gst_buffer, frame_meta):
+        self.gst_buffer = gst_buffer
+        self.frame_meta = frame_meta
+        self._surface = None
+
+    def surface(self):
+        if self._surface is None:
+            self._surface = pyds.get_nvds_buf_surface(hash(self.gst_buffer), self.frame_meta.batch_id)
+        return self._surface
+
+    def crop_bgr(self, obj_meta):
+        surface = self.surface()
+        roi = SpeedProbe._crop_bbox(surface, obj_meta)   # view, chưa copy
+        if roi is None:
+            return None
+        if roi.ndim == 3 and roi.shape[2] == 4:
+            return cv2.cvtColor(roi, cv2.COLOR_RGBA2BGR)  # cvtColor tạo mảng mới = bản copy của ROI
+        if roi.ndim == 2:
+            return cv2.cvtColor(roi, cv2.COLOR_GRAY2BGR)
+        return np.array(roi, copy=True, order='C')
+
 
 class SpeedProbe:
     """
     - Lấy điểm (cx, bottom_y) của bbox -> chuyển sang world bằng homography
     - Tốc độ = Δy_world / Δt trong cửa sổ ~1s -> km/h
-    - Nếu > SPEED_LIMIT_KMH: crop bbox -> lưu JPG (1 ảnh/track_id) + (tuỳ chọn) publish base64
+    - Nếu > SPEED_LIMIT_KMH: crop bbox -> lưu JPG (1 ảnh/track_id) + (tuỳ chọn) publish JPEG
+    - 1 hoặc nhiều nguồn (nvstreammux batch-size N): trạng thái khoá theo (source_id, track_id),
+      mỗi nguồn có homography/FPS/camera_id riêng (sources=[SourceConfig]); phần tính toán nằm
+      trong speed_core.MultiSourceSpeed (không cần pyds)
+    - Track kết thúc (không thấy > TRIP_END_GRACE_S) -> 1 trip record gửi qua publisher/trip sinks
+    - trip_evidence: mỗi trip 1 ảnh bằng chứng (crop 1 lần ở lần đo hợp lệ đầu) bất kể tốc độ, ghi vào
+      TRIP_EVIDENCE_DIR (quota riêng); trip được gửi sau khi ảnh ghi xong (rec.evidence = path, None nếu
+      ảnh bị bỏ); cần save_snapshots
+    - edge_db: cảnh báo overspeed + trip ghi vào SQLite trên máy (edge_db.py), None = tắt
     """
-    def __init__(self, view_transformer, roi_source_points, cooldown_s: float = 2.5):
-        self.view_transformer = view_transformer
-        self.roi_points = np.array(roi_source_points, dtype=np.float32)
-
-        # Lịch sử vị trí y_world theo track_id (cửa sổ ~1s)
-        self.history_positions = defaultdict(lambda: deque(maxlen=int(VIDEO_FPS)))
-        self.last_speed_text   = defaultdict(lambda: "")
-        self.last_update_frame = defaultdict(lambda: -int(VIDEO_FPS))
+    def __init__(self, view_transformer=None, roi_source_points=None, cooldown_s: float = 2.5,
+                 max_tracks: int = TRACK_MAX_LIVE, ttl_frames: int = None,
+                 camera_id: str = CAMERA_ID, save_snapshots: bool = SNAP_SAVE,
+                 sources=None, fps: float = VIDEO_FPS, stats_interval_s: float = PROBE_STATS_INTERVAL_S,
+                 speed_estimator: str = SPEED_ESTIMATOR, speed_timebase: str = SPEED_TIMEBASE,
+                 zones=None, speed_log: str = SPEED_LOG_FORMAT, edge_db=EDGE_DB_PATH,
+                 trip_evidence: bool = TRIP_EVIDENCE):
+        if sources is None:
+            # 1 nguồn (pipeline cũ): sink_0 của nvstreammux
+            sources = [SourceConfig(source_id=0, camera_id=str(camera_id),
+                                    view_transformer=view_transformer,
+                                    roi_points=np.array(roi_source_points, dtype=np.float32),
+                                    fps=float(fps), zones=zones)]
+        self.sources = list(sources)
+        self.camera_id = self.sources[0].camera_id
+
+        # đo thời gian từng stage (stage_stats.py); None = tắt, đường nóng chỉ còn `if timer`
+        self.stats = StageStats(stats_interval_s) if stats_interval_s else None
+        if self.stats is not None:
+            self.stats.add_sink(lambda snap: print(format_snapshot(snap)))
+
+        # log từng phép đo (speed_log.py): probe chỉ đưa cột NumPy vào hàng đợi, ghi ở thread nền
+        self.speed_log = None
+        if speed_log and speed_log != "off":
+            self.speed_log = SpeedLogWriter(SPEED_LOG_DIR, fmt=speed_log, rotate_mb=SPEED_LOG_ROTATE_MB,
+                                            rotate_s=SPEED_LOG_ROTATE_S, flush_interval_s=SPEED_LOG_FLUSH_S,
+                                            max_pending_rows=SPEED_LOG_MAX_PENDING)
+
+        # ảnh bằng chứng / trip: giữ crop của lần đo hợp lệ đầu, lưu khi track kết thúc
+        self.trip_evidence = bool(trip_evidence and save_snapshots)
+
+        # lịch sử y_world (~1s), median tốc độ, tuổi track, cooldown, số ảnh... theo (nguồn, slot)
+        self.core = MultiSourceSpeed(self.sources, max_tracks=max_tracks, ttl_frames=ttl_frames,
+                                     on_trip=self._emit_trip,
+                                     on_overspeed=self._maybe_publish_and_save,
+                                     on_measure=self._keep_evidence if self.trip_evidence else None,
+                                     timer=self.stats, estimator=speed_estimator,
+                                     timebase=speed_timebase, log=self.speed_log)
 
         # chống spam socket
-        self.last_alert_ts     = defaultdict(lambda: 0.0)
         self.cooldown_s        = float(cooldown_s)
 
-        # số ảnh đã chụp cho mỗi track_id
-        self.snap_count        = defaultdict(int)
-
         # publisher để đẩy JSON sang web (tuỳ bạn set)
         self.publisher = None
-        # cai thien hien thi toc do ao
-        self.speed_history = defaultdict(lambda: deque(maxlen=MEDIAN_WINDOW))
-        self.track_birth_frame = {}  # lưu frame first-seen cho từng track
-
-        # logger CSV (tuỳ)
-        # self.logger = CSVLogger(SPEED_LOG, header=["frame","track_id","speed_km_h"])
-
-        # đảm bảo thư mục tồn tại
-        try:
-            os.makedirs(str(SNAP_DIR), exist_ok=True)
-        except Exception:
-            pass
-# cai thien hien thi toc do
-    def _bbox_area(self, obj_meta):
-        w = max(1.0, obj_meta.rect_params.width)
-        h = max(1.0, obj_meta.rect_params.height)
-        return float(w * h)
-
-    def _valid_measurement(self, tid, frame_no, hist, speed_kmh, area_start, area_end, det_conf):
-        # Tuổi track
-        birth = self.track_birth_frame.get(tid, frame_no)
-        age_frames = frame_no - birth
-        if age_frames < MIN_TRACK_AGE_FRAMES:
-            return False
-
-        # Dịch chuyển tối thiểu
-        if len(hist) >= 2:
-            disp_m = abs(hist[-1] - hist[0])
-            if disp_m < MIN_WORLD_DISPL_M:
-                return False
-
-        # Giới hạn vật lý
-        if speed_kmh <= 0 or speed_kmh > MAX_ABS_KMH:
-            return False
-
-        # Ổn định kích thước bbox
-        if area_start > 0 and area_end / area_start > BBOX_AREA_JUMP:
-            return False
-
-        # Độ tin cậy detection (nếu có)
-        if det_conf is not None and det_conf < MIN_DET_CONF:
-            return False
-
-        return True
+        # nơi nhận TripRecord (ngoài publisher): fn(rec: TripRecord) -> None
+        self.trip_sinks = []
+        # số xe mỗi batch (vd infer_control.InferIntervalController.observe_vehicles)
+        self.activity_sinks = []
+        # ghi ảnh bằng chứng xuống SNAP_DIR/<ngày>/<camera_id>/ (thread riêng, có quota + retention,
+        # 1 writer dùng chung cho mọi camera -> quota tính trên tổng)
+        self.writer = None
+        if save_snapshots:
+            self.writer = SnapshotWriter(SNAP_DIR, camera_id=self.camera_id,
+                                         quota_bytes=int(SNAP_QUOTA_MB * 1024 * 1024),
+                                         retention_days=SNAP_RETENTION_DAYS)
+        # kho sự kiện SQLite trên edge (thread ghi riêng, transaction theo lô, retention)
+        self.events = None
+        if edge_db:
+            self.events = EdgeEventStore(edge_db, retention_days=EDGE_DB_RETENTION_DAYS, batch_size=EDGE_DB_BATCH,
+                                         flush_interval_s=EDGE_DB_FLUSH_S, max_pending=EDGE_DB_MAX_PENDING)
+        # encode ảnh overspeed ở background (xem snapshots.py)
+        self.snapshots = SnapshotEncoder(self._publish, workers=SNAP_ENCODE_WORKERS,
+                                         max_queue=SNAP_QUEUE_MAX, policy=SNAP_DROP_POLICY,
+                                         quality=JPEG_QUALITY, writer=self.writer, timer=self.stats)
+        # ảnh trip: encoder + writer riêng (quality thấp hơn, quota riêng), không chung hàng đợi overspeed
+        self.trip_writer = self.trip_snapshots = None
+        if self.trip_evidence:
+            self.trip_writer = SnapshotWriter(TRIP_EVIDENCE_DIR, camera_id=self.camera_id,
+                                              quota_bytes=int(TRIP_EVIDENCE_QUOTA_MB * 1024 * 1024),
+                                              retention_days=SNAP_RETENTION_DAYS)
+            self.trip_snapshots = SnapshotEncoder(None, workers=1, max_queue=SNAP_QUEUE_MAX,
+                                                  policy=SNAP_DROP_POLICY, quality=TRIP_EVIDENCE_QUALITY,
+                                                  writer=self.trip_writer, timer=self.stats)
+
+    @property
+    def tracks(self):
+        """TrackStore của nguồn đầu tiên (tương thích chế độ 1 camera)."""
+        return self.core[self.sources[0].source_id].tracks
 
     def set_publisher(self, fn):
         """fn(payload: dict) -> None"""
         self.publisher = fn
 
-    # -------------------- helpers --------------------
-    def _compute_speed_kmh(self, hist):
-        if len(hist) < int(VIDEO_FPS):
-            return None
-        distance_m = abs(hist[-1] - hist[0])
-        time_s = (len(hist) - 1) / float(VIDEO_FPS)
-        if time_s <= 0:
-            return 0.0
-        return (distance_m / time_s) * 3.6
-
-    def _obj_in_analytics_roi(self, obj_meta) -> bool:
-        """Nếu bạn có NvDsAnalytics và bật roiStatus thì lọc theo ROI; nếu không có thì luôn True."""
-        try:
-            user_meta_list = obj_meta.obj_user_meta_list
-            while user_meta_list is not None:
-                user_meta = pyds.NvDsUserMeta.cast(user_meta_list.data)
-                # Nếu SDK của bạn không có hằng số meta_type này, trả về True để không chặn
-                if user_meta and hasattr(pyds, "nvds_get_user_meta_type"):
-                    mt = pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSOBJ.USER_META")
-                    if user_meta.base_meta.meta_type == mt:
-                        info = pyds.NvDsAnalyticsObjInfo.cast(user_meta.user_meta_data)
-                        if getattr(info, "roiStatus", None):
-                            return True
-                user_meta_list = user_meta_list.next
-            # không thấy meta => không lọc
-            return True
-        except Exception:
-            return True
-
-    @staticmethod
-    def _frame_bgr_from_gst_buffer(gst_buffer, frame_meta):
-        surface = pyds.get_nvds_buf_surface(hash(gst_buffer), frame_meta.batch_id)
-        img = np.array(surface, copy=True, order='C')
-        if img.ndim == 3 and img.shape[2] == 4:
-            img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-        elif img.ndim == 2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        # DEBUG: in ra 1 lần để biết đã lấy được khung
-        if not hasattr(SpeedProbe, "_dbg_frame_once"):
-            print("[DBG] frame_bgr OK ->", img.shape)
-            SpeedProbe._dbg_frame_once = True
-        return img
-
-
-    @staticmethod
-    def _crop_bbox(image_bgr, obj_meta):
-        h, w = image_bgr.shape[:2]
-        x  = int(round(obj_meta.rect_params.left))
-        y  = int(round(obj_meta.rect_params.top))
-        bw = int(round(obj_meta.rect_params.width))
-        bh = int(round(obj_meta.rect_params.height))
-        x = max(0, x); y = max(0, y)
-        x2 = min(w, x + max(1, bw))
-        y2 = min(h, y + max(1, bh))
-        if x >= x2 or y >= y2:
-            return None
-        return image_bgr[y:y2, x:x2]
+    def publish_stats(self, enable: bool = True):
+        """Gửi snapshot stage stats (type "probe_stats") qua publisher mỗi chu kỳ."""
+        if self.stats is None or not enable:
+            return
+        def sink(snap):
+            if self.publisher:
+                self.publisher(dict(snap, camera_id=self.camera_id))
+        self.stats.add_sink(sink)
+
+    def add_trip_sink(self, fn):
+        """fn(rec: TripRecord) -> None, gọi khi 1 track kết thúc"""
+        self.trip_sinks.append(fn)
+
+    def add_activity_sink(self, fn):
+        """fn(n_vehicles: int) -> None, gọi mỗi batch với tổng số xe (đã lọc class/ROI)"""
+        self.activity_sinks.append(fn)
+
+    def _emit_trip(self, rec, src=None, slot=None):
+        ev = src.tracks.evidence[slot] if self.trip_evidence and src is not None else None
+        if rec.snapshot is not None or ev is None:
+            rec.evidence = rec.snapshot
+            self._deliver_trip(rec)
+            return
+        # ảnh bằng chứng: encode + ghi ở background, trip gửi đi khi file đã ghi (hoặc bị bỏ)
+        ts, speed_kmh, crop = ev
+        path = self.trip_writer.path_for(ts, rec.track_id, speed_kmh, camera_id=rec.camera_id, tag="trip")
+
+        def done(ok):
+            rec.evidence = path if ok else None
+            self._deliver_trip(rec)
+        self.trip_snapshots.submit(None, crop, snap=(ts, rec.track_id, speed_kmh, path, done))
+
+    def _deliver_trip(self, rec):
+        if self.events is not None:
+            self.events.add_trip(rec)
+        for fn in self.trip_sinks:
+            try:
+                fn(rec)
+            except Exception as e:
+                print("[WARN] trip sink failed:", e)
+        if self.publisher:
+            try:
+                self.publisher(rec.to_payload())
+            except Exception as e:
+                print("[WARN] publish trip failed:", e)
+
+    def flush_trips(self):
+        """Kết thúc mọi track còn sống (gọi khi dừng pipeline/EOS)."""
+        self.core.flush()
+
+    def close(self):
+        """Gọi khi dừng pipeline: xuất trip còn lại + encode nốt ảnh đang chờ + ghi nốt speed log/edge db."""
+        # ảnh overspeed đang chờ ghi xong trước -> trip còn lại trỏ tới file đã có
+        self.snapshots.flush()
+        if self.writer is not None:
+            self.writer.flush()
+        self.flush_trips()
+        self.snapshots.close()
+        if self.writer is not None:
+            self.writer.close()
+        if self.trip_snapshots is not None:
+            self.trip_snapshots.close()
+            self.trip_writer.close()
+        if self.speed_log is not None:
+            self.speed_log.close()
+        if self.events is not None:
+            self.events.close()
 
-    @staticmethod
-    def _jpg_b64_and_bytes(image_bgr, quality=85):
-        ok, buf = cv2.imencode(".jpg", image_bgr, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-        if not ok:
-            return None, None
-        b = buf.tobytes()
-        return base64.b64encode(b).decode("ascii"), b
+    # -------------------- helpers --------------------
+    # view (không copy) vùng bbox, dùng chung với backend CPU (speed_core.crop_bbox)
+    _crop_bbox = staticmethod(crop_bbox)
 
     # speedflow/probes.py (thay _maybe_publish_and_save)
-    def _maybe_publish_and_save(self, frame_iso_ts, track_id, speed_kmh, crop_bgr):
+    def _maybe_publish_and_save(self, src, slot, track_id, speed_kmh, frame_ts, frame_iso_ts, frame, obj_meta):
         now = time.time()
-
-        image_b64 = None
-        if crop_bgr is not None:
-            image_b64, _ = self._jpg_b64_and_bytes(crop_bgr, JPEG_QUALITY)
-
-        if self.publisher and (now - self.last_alert_ts[track_id] >= self.cooldown_s):
-            self.last_alert_ts[track_id] = now
+        tracks = src.tracks
+        due = now - tracks.last_alert_ts[slot] >= self.cooldown_s
+        publish = bool(self.publisher) and due
+        if due and self.events is not None:
+            # cùng nhịp cooldown với event publish (kể cả khi không có publisher)
+            tracks.last_alert_ts[slot] = now
+            self.events.add_overspeed(src.camera_id, frame_ts, track_id, speed_kmh,
+                                      class_id=int(tracks.class_id[slot]),
+                                      zone=src.zones.name(int(tracks.zone[slot])) if src.zones is not None else None)
+        save = self.writer is not None and tracks.snap_count[slot] < MAX_SNAPSHOT_PER_ID
+        if not publish and not save:
+            return
+
+        # chỉ crop khi thực sự publish/lưu (surface được map lazy ở đây)
+        timer = self.stats
+        if timer:
+            t0 = time.perf_counter()
+        try:
+            crop = frame.crop_bgr(obj_meta)
+        except Exception as e:
+            print("[ERR] crop from surface failed:", e)
+            crop = None
+        if timer:
+            timer.add(ST_CROP, time.perf_counter() - t0)
+        has_crop = crop is not None and crop.size > 0
+
+        payload = None
+        if publish:
+            tracks.last_alert_ts[slot] = now
             payload = {
                 "type": "overspeed",
                 "ts": frame_iso_ts,
+                "epoch": round(float(frame_ts), 3),
+                "camera_id": src.camera_id,
                 "track_id": int(track_id),
                 "speed_kmh": float(speed_kmh),
-                "image_b64": image_b64,
+                "image_jpeg": None,
             }
-            try:
-                self.publisher(payload)
-            except Exception as e:
-                print("[WARN] publish overspeed failed:", e)
-
-        if self.snap_count[track_id] < 1 and image_b64 is not None:
-            self.snap_count[track_id] += 1
+            if not has_crop:
+                self._publish(payload)
+                return
+
+        snap = None
+        if save and has_crop:
+            # path xác định ngay (chỉ format chuỗi), file được ghi ở SnapshotWriter
+            path = self.writer.path_for(frame_ts, track_id, speed_kmh, camera_id=src.camera_id)
+            tid = int(track_id)
+            snap = (frame_ts, tid, float(speed_kmh), path,
+                    lambda ok: self._snap_done(tracks, slot, tid, path, ok))
+            # ghi nhận ngay (không submit thêm ảnh cho track khi ảnh trước còn chờ);
+            # job bị bỏ (hàng đợi encoder/writer đầy, encode/ghi lỗi) -> _snap_done trả lại lượt + path
+            tracks.snap_count[slot] += 1
+            tracks.snap_path[slot] = path
+            if payload is not None:
+                payload["snapshot"] = path
+        if payload is None and snap is None:
+            return
+        # JPEG + base64 + ghi đĩa chạy ở background, không chặn streaming thread
+        self.snapshots.submit(payload, crop, snap=snap)
+
+    def _keep_evidence(self, src, slot, track_id, speed_kmh, frame_ts, frame, obj_meta):
+        # crop 1 lần / track (lần đo hợp lệ đầu): các frame sau không map surface cho ảnh trip
+        tracks = src.tracks
+        if tracks.evidence[slot] is not None or tracks.snap_path[slot] is not None:
+            return          # đã có crop, hoặc đã có ảnh overspeed dùng làm bằng chứng của trip
+        timer = self.stats
+        if timer:
+            t0 = time.perf_counter()
+        try:
+            crop = frame.crop_bgr(obj_meta)
+        except Exception as e:
+            print("[ERR] crop from surface failed:", e)
+            crop = None
+        if timer:
+            timer.add(ST_CROP, time.perf_counter() - t0)
+        if crop is not None and crop.size > 0:
+            tracks.evidence[slot] = (frame_ts, float(speed_kmh), crop)
 
+    @staticmethod
+    def _snap_done(tracks, slot, track_id, path, ok):
+        # gọi từ thread encoder/writer; slot có thể đã được cấp cho xe khác
+        if ok or int(tracks.track_ids[slot]) != track_id:
+            return
+        if tracks.snap_count[slot] > 0:
+            tracks.snap_count[slot] -= 1
+        if tracks.snap_path[slot] == path:
+            tracks.snap_path[slot] = None
+
+    def _publish(self, payload):
+        if not self.publisher:
+            return
+        try:
+            self.publisher(payload)
+        except Exception as e:
+            print("[WARN] publish overspeed failed:", e)
 
     # -------------------- main probe --------------------
     def osd_sink_pad_buffer_probe(self, pad, info, u_data):
         """
         - Chỉ hiển thị/tính tốc độ khi phép đo HỢP LỆ để loại bỏ tốc độ ảo.
-        - Các ngưỡng có thể đặt trong settings.py; nếu chưa có, dùng default bên dưới.
+        - Các ngưỡng đặt trong settings.py.
+        - Batch nhiều nguồn: frame_meta.source_id chọn trạng thái/homography của camera tương ứng.
         """
-
-        # ===== Ngưỡng mặc định (nếu bạn CHƯA thêm vào settings.py) =====
-        # Gợi ý: đưa các hằng này sang settings.py để chỉnh từ 1 chỗ.
-        try:
-            MIN_TRACK_AGE_FRAMES
-        except NameError:
-            # cần tối thiểu ~0.5 giây tuổi track
-            MIN_TRACK_AGE_FRAMES = int(VIDEO_FPS * 0.5)
-        try:
-            MIN_WORLD_DISPL_M
-        except NameError:
-            # dịch chuyển mặt đất tối thiểu trong cửa sổ
-            MIN_WORLD_DISPL_M = 0.5
-        try:
-            MAX_ABS_KMH
-        except NameError:
-            # trần tốc độ hợp lý theo bối cảnh
-            MAX_ABS_KMH = 160.0
-        try:
-            BBOX_AREA_JUMP
-        except NameError:
-            # nếu area_end / area_prev > BBOX_AREA_JUMP => coi là nhảy hình/zoom
-            BBOX_AREA_JUMP = 2.5
-        try:
-            MIN_DET_CONF
-        except NameError:
-            # ngưỡng độ tin cậy detection (nếu có)
-            MIN_DET_CONF = 0.45
-        try:
-            MEDIAN_WINDOW
-        except NameError:
-            # kích thước cửa sổ median smoothing cho tốc độ
-            MEDIAN_WINDOW = 5
-
-        # ===== Bộ nhớ tạm cần thiết (tự khởi tạo nếu chưa có trong __init__) =====
-
-        if not hasattr(self, "speed_history"):
-            self.speed_history = defaultdict(lambda: deque(maxlen=MEDIAN_WINDOW))
-        if not hasattr(self, "track_birth_frame"):
-            self.track_birth_frame = {}  # tid -> frame first-seen
-        if not hasattr(self, "last_area"):
-            self.last_area = {}          # tid -> bbox area ở frame trước
-
-        def _bbox_area(obj_meta):
-            w = max(1.0, obj_meta.rect_params.width)
-            h = max(1.0, obj_meta.rect_params.height)
-            return float(w * h)
-
-        def _valid_measurement(tid, frame_no, hist, speed_kmh, area_prev, area_now, det_conf):
-            # 1) tuổi track
-            birth = self.track_birth_frame.get(tid, frame_no)
-            age_frames = frame_no - birth
-            if age_frames < MIN_TRACK_AGE_FRAMES:
-                return False
-
-            # 2) dịch chuyển mặt đất tối thiểu
-            if len(hist) >= 2:
-                disp_m = abs(hist[-1] - hist[0])
-                if disp_m < MIN_WORLD_DISPL_M:
-                    return False
-
-            # 3) giới hạn vật lý
-            if (speed_kmh is None) or (speed_kmh <= 0) or (speed_kmh > MAX_ABS_KMH):
-                return False
-
-            # 4) nhảy diện tích bbox (zoom/ID switch/dao động)
-            if area_prev is not None and area_prev > 0:
-                if (area_now / area_prev) > BBOX_AREA_JUMP:
-                    return False
-
-            # 5) độ tin cậy detection (nếu có)
-            if det_conf is not None and det_conf < MIN_DET_CONF:
-                return False
-
-            return True
-
         gst_buffer = info.get_buffer()
         if not gst_buffer:
             return Gst.PadProbeReturn.OK
+        timer = self.stats
+        if timer:
+            t_start = time.perf_counter()
 
         batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+
+        # ===== Pha 1: đọc meta của cả batch (source_id, frame, xe) =====
+        frames = []       # (source_id, frame_number, ts, ts_iso, [obj_meta], LazyFrame, pts)
         l_frame = batch_meta.frame_meta_list
         while l_frame:
             frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
-            frame_number = frame_meta.frame_num
 
             # timestamp (ISO)
             ts_ns = getattr(frame_meta, "ntp_timestamp", 0) or int(time.time() * 1e9)
             ts_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts_ns / 1e9))
 
-            # lấy frame BGR cho crop (nếu cần)
-            try:
-                frame_bgr = self._frame_bgr_from_gst_buffer(gst_buffer, frame_meta)
-                if frame_bgr is None or frame_bgr.size == 0:
-                    print("[DBG] frame_bgr is None/empty")
-            except Exception as e:
-                print("[ERR] get frame_bgr failed:", e)
-                frame_bgr = None
-
+            objs = []
             l_obj = frame_meta.obj_meta_list
             while l_obj:
                 obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
-
-                # chỉ xét các object nằm trong ROI analytics
-                if not self._obj_in_analytics_roi(obj_meta):
-                    l_obj = l_obj.next
-                    continue
-
+                # ROI (zone) lọc theo footpoint trong speed_core, 1 lần cho cả batch
                 if obj_meta.class_id in VEHICLE_CLASS_IDS:
-                    # tính world-coordinate từ chân bbox (cx, bottom_y)
-                    cx = obj_meta.rect_params.left + obj_meta.rect_params.width  / 2.0
-                    bottom_y = obj_meta.rect_params.top  + obj_meta.rect_params.height
-                    pts_world = self.view_transformer.transform_points(
-                        np.array([[cx, bottom_y]], dtype=np.float32)
-                    )
-                    y_world = float(pts_world[0][1])
-
-                    tid = obj_meta.object_id
-                    hist = self.history_positions[tid]
-                    hist.append(y_world)
-
-                    # lưu thời điểm sinh track
-                    if tid not in self.track_birth_frame:
-                        self.track_birth_frame[tid] = frame_number
-
-                    # area bbox hiện tại
-                    area_now = _bbox_area(obj_meta)
-                    area_prev = self.last_area.get(tid, None)
-
-                    # độ tin cậy detection (có thể None trên 1 số phiên bản)
-                    det_conf = getattr(obj_meta, "confidence", None)
-
-                    display_text = self.last_speed_text[tid] or f"#{tid}"
-
-                    # mỗi ~1s mới cập nhật một lần như code gốc
-                    if len(hist) >= int(VIDEO_FPS) and \
-                    (frame_number - self.last_update_frame[tid] >= int(VIDEO_FPS)):
-
-                        speed_kmh = self._compute_speed_kmh(hist)
-
-                        if _valid_measurement(tid, frame_number, hist, speed_kmh, area_prev, area_now, det_conf):
-                            # median smoothing
-                            sh = self.speed_history[tid]
-                            sh.append(speed_kmh)
-                            if len(sh) >= 3:
-                                speed_smooth = float(np.median(sh))
-                            else:
-                                speed_smooth = speed_kmh
-
-                            display_text = f"#{tid} {int(speed_smooth)} km/h"
-                            self.last_speed_text[tid]   = display_text
-                            self.last_update_frame[tid] = frame_number
-
-                            # --- OVERSPEED ---
-                            if speed_smooth >= float(SPEED_LIMIT_KMH):
-                                crop = None
-                                if frame_bgr is not None:
-                                    crop = self._crop_bbox(frame_bgr, obj_meta)
-                                    if crop is not None and crop.size > 0 and not hasattr(self, "_dbg_crop_once"):
-                                        print(f"[DBG] got first CROP shape={crop.shape} for track {tid}")
-                                        self._dbg_crop_once = True
-
-                                self._maybe_publish_and_save(ts_iso, tid, speed_smooth, crop)
-                        else:
-                            # phép đo không hợp lệ: chỉ hiển thị id
-                            display_text = f"#{tid}"
-                            self.last_speed_text[tid] = display_text
-
-                    # Hiển thị OSD
-                    obj_meta.text_params.display_text = display_text
-
-                    # cập nhật area_prev cho lần sau
-                    self.last_area[tid] = area_now
-
+                    objs.append(obj_meta)
                 l_obj = l_obj.next
+
+            # surface chỉ được map khi có crop overspeed (xem LazyFrame)
+            # buf_pts: PTS của frame nguồn -> thời gian thật giữa các mẫu kể cả khi frame bị drop
+            frames.append((frame_meta.source_id, frame_meta.frame_num, ts_ns / 1e9, ts_iso,
+                           objs, LazyFrame(gst_buffer, frame_meta),
+                           pts_seconds(getattr(frame_meta, "buf_pts", None))))
             l_frame = l_frame.next
-        return Gst.PadProbeReturn.OK
\ No newline at end of file
+
+        if timer:
+            timer.add(ST_META_WALK, time.perf_counter() - t_start)
+
+        # ===== Pha 2: homography (1 lần/nguồn), cập nhật track, thu hồi track đã biến mất =====
+        self.process_frames(frames, t_start=t_start if timer else None)
+        return Gst.PadProbeReturn.OK
+
+    def process_frames(self, frames, t_start: float = None):
+        """
+        frames: [(source_id, frame_no, ts, ts_iso, objs, frame, pts)] của 1 batch, objs giống NvDsObjectMeta
+        (đã lọc class), frame có crop_bgr(obj), pts = PTS (giây) hoặc None.
+        Ghi display_text vào obj.text_params của obj trong ROI.
+        """
+        timer = self.stats
+        if timer and t_start is None:
+            t_start = time.perf_counter()
+        texts = self.core.process(frames)
+        n = 0
+        for (_sid, _fn, _ts, _iso, objs, _frame, _pts), frame_texts in zip(frames, texts):
+            if frame_texts:
+                for obj_meta, text in zip(objs, frame_texts):
+                    if text is not None:
+                        obj_meta.text_params.display_text = text
+                        n += 1
+        if self.activity_sinks:
+            for fn in self.activity_sinks:
+                fn(n)
+        if timer:
+            timer.add(ST_TOTAL, time.perf_counter() - t_start)
+            timer.frame_done(len(frames))
+        return texts
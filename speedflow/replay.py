@@ -0,0 +1,106 @@
+# speedflow/replay.py
+# Ghi metadata từ pipeline thật (MetaRecorder) và phát lại qua SpeedProbe.osd_sink_pad_buffer_probe
+# bằng shim fakeds (không cần Jetson/DeepStream), nhanh nhất có thể hoặc theo nhịp fps.
+import time
+
+import numpy as np
+
+from . import fakeds
+from . import probes
+from .metarec import MetaWriter, open_recording, iter_batches, NO_PTS
+from .speed_core import pts_seconds
+
+
+class MetaRecorder:
+    """
+    Probe ghi metadata: gắn vào cùng pad với SpeedProbe (thêm TRƯỚC để ghi bbox gốc).
+    Ghi mọi object (SpeedProbe tự lọc class/ROI khi replay).
+    """
+    def __init__(self, path):
+        self.writer = MetaWriter(path)
+        self.path = self.writer.path
+
+    def osd_sink_pad_buffer_probe(self, pad, info, u_data):
+        gst_buffer = info.get_buffer()
+        if not gst_buffer:
+            return probes.Gst.PadProbeReturn.OK
+        pyds = probes.pyds
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+        w = self.writer
+        try:
+            l_frame = batch_meta.frame_meta_list
+            while l_frame:
+                fm = pyds.NvDsFrameMeta.cast(l_frame.data)
+                ts_ns = int(getattr(fm, "ntp_timestamp", 0) or time.time() * 1e9)
+                pts_s = pts_seconds(getattr(fm, "buf_pts", None))
+                pts_ns = NO_PTS if pts_s is None else int(fm.buf_pts)
+                n = 0
+                l_obj = fm.obj_meta_list
+                while l_obj:
+                    om = pyds.NvDsObjectMeta.cast(l_obj.data)
+                    r = om.rect_params
+                    w.add(fm.source_id, fm.frame_num, ts_ns, om.class_id, om.object_id,
+                          r.left, r.top, r.width, r.height, getattr(om, "confidence", 0.0) or 0.0, pts_ns)
+                    n += 1
+                    l_obj = l_obj.next
+                if n == 0:
+                    w.add(fm.source_id, fm.frame_num, ts_ns, pts_ns=pts_ns)
+                l_frame = l_frame.next
+            w.end_batch()
+        except Exception as e:
+            print("[WARN] meta recorder failed:", e)
+        return probes.Gst.PadProbeReturn.OK
+
+    def close(self):
+        self.writer.close()
+
+
+def make_batch(frames):
+    """frames từ metarec.iter_batches -> FakeBuffer mang BatchMeta (fakeds)."""
+    fms = []
+    for batch_id, (sid, frame_num, ts_ns, pts_ns, rows) in enumerate(frames):
+        objs = [fakeds.ObjectMeta(int(r["track_id"]), int(r["class_id"]), float(r["confidence"]),
+                                  float(r["left"]), float(r["top"]), float(r["width"]), float(r["height"]))
+                for r in rows]
+        fms.append(fakeds.FrameMeta(sid, frame_num, batch_id, ts_ns, objs,
+                                    buf_pts=None if pts_ns == NO_PTS else pts_ns))
+    return fakeds.FakeBuffer(fakeds.BatchMeta(fms))
+
+
+def replay(recording, probe, limit: int = None, fps: float = None, on_batch=None):
+    """
+    Phát lại recording (path hoặc mảng record) qua probe.osd_sink_pad_buffer_probe.
+    fps=None: nhanh nhất có thể; fps>0: giữ nhịp thời gian thực.
+    Chỉ đo thời gian của lời gọi probe (dựng meta giả không tính).
+    -> dict: batches, frames, objects, latency_s (np.ndarray mỗi batch), wall_s
+    """
+    fakeds.install(probes)
+    recs = recording if isinstance(recording, np.ndarray) else open_recording(recording)
+    lat = []
+    n_frames = n_objs = 0
+    period = 1.0 / fps if fps else 0.0
+    t_start = time.perf_counter()
+    for i, frames in enumerate(iter_batches(recs)):
+        if limit is not None and i >= limit:
+            break
+        buf = make_batch(frames).attach()
+        info = fakeds.FakeProbeInfo(buf)
+        if period:
+            delay = t_start + i * period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        probe.osd_sink_pad_buffer_probe(None, info, None)
+        lat.append(time.perf_counter() - t0)
+        buf.detach()
+        n_frames += len(frames)
+        n_objs += sum(len(f[4]) for f in frames)
+        if on_batch is not None:
+            on_batch(i, frames, buf.batch)
+    return {
+        "batches": len(lat),
+        "frames": n_frames,
+        "objects": n_objs,
+        "latency_s": np.asarray(lat, dtype=np.float64),
+        "wall_s": time.perf_counter() - t_start,
+    }
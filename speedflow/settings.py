@@ -21,11 +21,27 @@ PATH_LOGS.mkdir(parents=True, exist_ok=True)
 INFER_CONFIG  = ROOT / "DeepStream-Yolo/config_infer_primary_yolo11.txt"
 # Lưu ý: configs nằm ở ROOT, không phải trong DeepStream-Yolo
 ANALYTICS_CFG = ROOT / "configs/config_nvdsanalytics.txt"
+# ROI lọc ngay trong probe (zones.py: SOURCE hoặc ZONES của HOMO_YML) -> nvdsanalytics không bắt buộc
+ROI_FILTER        = True
+USE_NVDSANALYTICS = False                 # True: vẫn thêm nvdsanalytics (ANALYTICS_CFG) vào pipeline
 HOMO_YML      = ROOT / "configs/points_source_target.yml"
+# bảng tra pixel -> mặt đường ở độ phân giải mux (homography.py), cache mmap theo hash của YAML
+# (bench_probe.py homography: với <= ~100 xe/frame 1 lần cv2.perspectiveTransform + undistortPoints
+#  vẫn rẻ hơn index mảng NumPy -> mặc định tắt; khử méo áp dụng cho cả 2 cách)
+HOMO_LUT          = False
+HOMO_LUT_BILINEAR = True                  # nearest lệch tới ~1 m ở vùng xa
+HOMO_CACHE_DIR    = ROOT / "cache" / "homography"
+MUX_WIDTH, MUX_HEIGHT = 1280, 720
 
 # Tracker config mặc định của DS 7.1
 TRACKER_CFG   = "/opt/nvidia/deepstream/deepstream/samples/configs/deepstream-app/config_tracker_NvDCF_perf.yml"
-SPEED_LOG     = str(PATH_LOGS / "speed_log.csv")
+# Log từng phép đo (mỗi xe mỗi frame) ở thread nền (speed_log.py)
+SPEED_LOG_FORMAT   = "off"                # "off" | "csv" | "parquet" | "arrow" (2 format sau cần pyarrow)
+SPEED_LOG_DIR      = PATH_LOGS / "speed"
+SPEED_LOG_ROTATE_MB = 64.0                # xoay file khi >= N MB ...
+SPEED_LOG_ROTATE_S  = 3600.0              # ... hoặc sau N giây
+SPEED_LOG_FLUSH_S   = 2.0                 # chu kỳ ghi lô
+SPEED_LOG_MAX_PENDING = 200_000           # số dòng chờ ghi tối đa (đĩa chậm -> bỏ, đếm dropped_rows)
 
 # --- Overspeed config ---
 SPEED_LIMIT_KMH = 60.0
@@ -33,6 +49,33 @@ JPEG_QUALITY    = 100
 SNAP_DIR        = PATH_LOGS / "overspeed_snaps"
 SNAP_DIR.mkdir(parents=True, exist_ok=True)
 MAX_SNAPSHOT_PER_ID = 1
+SNAP_ENCODE_WORKERS = 1               # số thread encode JPEG/base64
+SNAP_QUEUE_MAX      = 8               # số crop chờ encode tối đa
+SNAP_DROP_POLICY    = "drop_oldest"   # "drop_oldest" | "drop_newest" khi hàng đợi đầy
+SNAP_SAVE           = True            # ghi ảnh overspeed xuống SNAP_DIR (thread riêng)
+SNAP_QUOTA_MB       = 2048            # tổng dung lượng ảnh tối đa trên eMMC/SD
+SNAP_RETENTION_DAYS = 7.0             # xoá ảnh cũ hơn N ngày
+CAMERA_ID           = "cam0"          # thư mục con trong SNAP_DIR/<ngày>/
+# 1 ảnh bằng chứng / trip (crop 1 lần ở lần đo hợp lệ đầu) bất kể tốc độ: section_speed cần ảnh cả 2 đầu
+# kể cả xe giảm tốc qua camera. Mỗi xe 1 ảnh -> tắt mặc định; thư mục + quota riêng để không đẩy ảnh
+# overspeed ra khỏi SNAP_QUOTA_MB, cần SNAP_SAVE
+TRIP_EVIDENCE          = False
+TRIP_EVIDENCE_DIR      = PATH_LOGS / "trip_snaps"
+TRIP_EVIDENCE_QUOTA_MB = 512
+TRIP_EVIDENCE_QUALITY  = 70           # JPEG quality của ảnh trip (ảnh overspeed: JPEG_QUALITY)
+# Kho sự kiện trên edge (edge_db.py, SQLite WAL): overspeed + trip, truy vấn bằng edge_query.py
+EDGE_DB_PATH           = PATH_LOGS / "edge_events.db"   # None = tắt
+EDGE_DB_RETENTION_DAYS = 30.0         # xoá sự kiện cũ hơn N ngày
+EDGE_DB_BATCH          = 256          # số dòng mỗi transaction
+EDGE_DB_FLUSH_S        = 1.0          # ghi lô ít nhất mỗi N giây
+EDGE_DB_MAX_PENDING    = 10_000       # số dòng chờ ghi tối đa (đĩa chậm -> bỏ, đếm dropped)
+# Store-and-forward (spool.py): event gửi server ghi xuống đĩa khi mất WS, phát lại theo thứ tự khi nối lại
+SPOOL_DIR           = PATH_LOGS / "spool"   # thư mục con theo camera/room; None = tắt (mất event khi WS rớt)
+SPOOL_MAX_MB        = 256.0       # vượt -> bỏ event cũ nhất trước
+SPOOL_SEGMENT_MB    = 8.0
+SPOOL_REPLAY_KBPS   = 256.0       # giới hạn phát lại backlog, chừa uplink cho video WebRTC
+SPOOL_REPLAY_MSGS_S = 20.0
+SPOOL_FSYNC_S       = 1.0         # chu kỳ fsync segment + lưu cursor
 
 MIN_TRACK_AGE_FRAMES = int(VIDEO_FPS * 0.5)
 MIN_WORLD_DISPL_M    = 0.5
@@ -40,3 +83,40 @@ MAX_ABS_KMH          = 160.0
 BBOX_AREA_JUMP       = 2.5
 MIN_DET_CONF         = 0.45
 MEDIAN_WINDOW        = 5
+
+# --- Ước lượng tốc độ ---
+SPEED_ESTIMATOR  = "kalman"               # "kalman" (kalman.py, mỗi frame) | "window" (hiệu y_world ~1s + median)
+KF_ACCEL_STD     = 3.0                    # m/s^2, nhiễu quá trình (tăng/giảm tốc)
+KF_MEAS_STD_X_M  = 0.3                    # m, dao động footpoint ngang đường
+KF_MEAS_STD_Y_M  = 0.8                    # m, dao động footpoint dọc đường (vùng xa lớn hơn)
+KF_GATE_CHI2     = 13.8                   # chi2 2 bậc tự do, 99.9%
+KF_INIT_VEL_STD  = 15.0                   # m/s, độ bất định vận tốc lúc khởi tạo
+KF_READY_VEL_STD = 1.0                    # m/s, chỉ hiển thị tốc độ khi std vận tốc <= ngưỡng
+KF_MAX_MISSES    = 3                      # bị gating loại liên tiếp > N -> khởi tạo lại track
+# Thời gian giữa 2 mẫu: "pts" = buf_pts của frame (đúng cả khi rtspsrc drop-on-latency bỏ frame trước mux,
+# frame_num vẫn liên tục), thiếu/nhảy PTS thì lùi về số frame / fps; "frame" = luôn theo số frame.
+SPEED_TIMEBASE     = "pts"
+SPEED_TS_MAX_GAP_S = 1.0                  # PTS lệch quá (số frame / fps + N giây) -> coi như gián đoạn
+
+# --- Track state (TrackStore) ---
+TRACK_MAX_LIVE   = 512                    # số track sống tối đa (bộ nhớ cố định)
+TRIP_END_GRACE_S = 2.0                    # không thấy > N giây -> track kết thúc, xuất trip
+TRACK_TTL_FRAMES = int(VIDEO_FPS * TRIP_END_GRACE_S)  # thu hồi slot sau N frame
+TRIP_MIN_FRAMES  = MIN_TRACK_AGE_FRAMES   # track ngắn hơn -> không xuất trip
+
+# --- Đo thời gian stage trong probe (stage_stats.py) ---
+PROBE_STATS_INTERVAL_S = 0.0              # chu kỳ log/publish snapshot (giây); 0 = tắt
+PIPELINE_TRACE_INTERVAL_S = 0.0           # latency/fps từng element (pipeline_trace.py); 0 = tắt
+
+# --- interval của nvinfer theo tải/mật độ xe (infer_control.py) ---
+INFER_ADAPTIVE      = False
+INFER_INTERVAL_MAX  = 4                   # bỏ tối đa N frame giữa 2 lần suy luận (tracker lấp chỗ trống)
+INFER_IDLE_INTERVAL = 4                   # interval khi đường vắng
+INFER_IDLE_S        = 10.0                # không có xe > N giây -> idle
+INFER_CTL_PERIOD_S  = 2.0                 # chu kỳ đo tải / quyết định
+
+# --- WebRTC: 1 lần encode H.264, tee RTP -> 1 webrtcbin / viewer (webrtc_fanout.py) ---
+WEBRTC_MAX_VIEWERS     = 8                # số browser xem cùng lúc; 0 = 1 webrtcbin, offer broadcast cả room (cũ)
+WEBRTC_ENCODER         = "auto"           # "auto" | "nvv4l2" | "x264" (phần mềm, chạy thử không cần Jetson)
+WEBRTC_STUN            = "stun://stun.l.google.com:19302"
+WEBRTC_VIEWER_QUEUE_MS = 200              # queue leaky mỗi viewer: viewer chậm chỉ bỏ gói của chính nó
@@ -0,0 +1,374 @@
+# speedflow/snapshots.py
+# Encode JPEG + ghi ảnh overspeed ở thread riêng, không chặn streaming thread của GStreamer.
+import threading, time
+from collections import deque
+from pathlib import Path
+
+import cv2
+
+from .stage_stats import ST_ENCODE, ST_PUBLISH
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+def encode_jpeg(image_bgr, quality=85):
+    ok, buf = cv2.imencode(".jpg", image_bgr, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        return None
+    return buf.tobytes()
+
+
+def _snap_done(done, ok: bool):
+    # done(ok) của job lưu ảnh: True = đã ghi xuống đĩa, False = bị bỏ (hàng đợi đầy/encode/ghi lỗi)
+    if done is None:
+        return
+    try:
+        done(ok)
+    except Exception as e:
+        print("[WARN] snapshot done callback failed:", e)
+
+
+class SnapshotEncoder:
+    """
+    Pool worker encode ảnh crop:
+    - submit(payload, crop_bgr): probe chỉ đẩy (payload, bản copy crop) vào hàng đợi có giới hạn
+    - worker: imencode JPEG -> payload["image_jpeg"] -> publish(payload)
+      (base64/JSON hay binary frame do publisher quyết định, xem event_proto.py)
+    - nếu job có snap (ts, track_id, speed, path[, done]): JPEG được chuyển cho SnapshotWriter ghi đĩa,
+      done(ok) được gọi đúng 1 lần khi ảnh đã ghi (True) hoặc bị bỏ ở bất kỳ bước nào (False)
+    - hàng đợi đầy: DROP_OLDEST (bỏ job cũ nhất) hoặc DROP_NEWEST (bỏ job mới)
+    - đếm queued / dropped / encoded / failed
+    """
+    def __init__(self, publish, workers: int = 1, max_queue: int = 8,
+                 policy: str = DROP_OLDEST, quality: int = 85, writer=None, timer=None):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Invalid drop policy: {policy!r}")
+        self.publish = publish
+        self.writer = writer
+        self.timer = timer          # StageStats: đo encode/publish (None = tắt)
+        self.max_queue = max(1, int(max_queue))
+        self.policy = policy
+        self.quality = int(quality)
+
+        self._q = deque()
+        lock = threading.RLock()
+        self._cv = threading.Condition(lock)
+        self._idle = threading.Condition(lock)    # flush(): chờ hàng đợi rỗng + không job nào đang encode
+        self._busy = 0
+        self._closing = False
+
+        self.queued = 0
+        self.dropped = 0
+        self.encoded = 0
+        self.failed = 0
+
+        self._threads = []
+        for i in range(max(1, int(workers))):
+            t = threading.Thread(target=self._run, name=f"snap-encoder-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, payload, crop_bgr, snap=None) -> bool:
+        """
+        Gọi từ probe thread. crop_bgr phải là bản copy (không phải view vào surface).
+        payload=None: chỉ lưu ảnh, không publish. snap=(ts, track_id, speed_kmh, path[, done]): lưu ảnh.
+        Trả False (và gọi done(False)) nếu job bị bỏ ngay.
+        """
+        accepted, dropped = True, None
+        with self._cv:
+            if self._closing:
+                accepted, dropped = False, snap
+            elif len(self._q) >= self.max_queue:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    accepted, dropped = False, snap
+                else:
+                    dropped = self._q.popleft()[2]
+            if accepted:
+                self._q.append((payload, crop_bgr, snap))
+                self.queued += 1
+                self._cv.notify()
+        if dropped is not None:
+            _snap_done(dropped[4] if len(dropped) > 4 else None, False)
+        return accepted
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "encoded": self.encoded,
+                "failed": self.failed,
+                "pending": len(self._q),
+            }
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Chờ encode + chuyển cho writer xong mọi job đang có (worker vẫn chạy). False nếu hết giờ."""
+        end = time.monotonic() + timeout
+        with self._idle:
+            while self._q or self._busy:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self._idle.wait(left)
+        return True
+
+    def close(self, timeout: float = 2.0):
+        """Encode nốt các job còn lại rồi dừng worker."""
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._q and not self._closing:
+                    self._cv.wait()
+                if not self._q:
+                    return
+                payload, crop_bgr, snap = self._q.popleft()
+                self._busy += 1
+            try:
+                self._encode(payload, crop_bgr, snap)
+            finally:
+                with self._cv:
+                    self._busy -= 1
+                    if not self._q and not self._busy:
+                        self._idle.notify_all()
+
+    def _encode(self, payload, crop_bgr, snap):
+        timer = self.timer
+        if timer:
+            t0 = time.perf_counter()
+        try:
+            jpeg = encode_jpeg(crop_bgr, self.quality)
+        except Exception as e:
+            print("[WARN] snapshot encode failed:", e)
+            jpeg = None
+        if timer:
+            timer.add(ST_ENCODE, time.perf_counter() - t0)
+        with self._cv:
+            if jpeg is None:
+                self.failed += 1
+            else:
+                self.encoded += 1
+        if snap is not None:
+            done = snap[4] if len(snap) > 4 else None
+            if jpeg is not None and self.writer is not None:
+                self.writer.submit(*snap[:3], jpeg, path=snap[3], done=done)
+            else:
+                _snap_done(done, False)
+        if payload is None:
+            return
+        payload["image_jpeg"] = jpeg
+        if timer:
+            t0 = time.perf_counter()
+        try:
+            self.publish(payload)
+        except Exception as e:
+            print("[WARN] publish overspeed failed:", e)
+        if timer:
+            timer.add(ST_PUBLISH, time.perf_counter() - t0)
+
+
+class SnapshotWriter:
+    """
+    Ghi ảnh overspeed xuống đĩa ở thread riêng (không bao giờ ghi trên probe thread):
+    - <root>/<YYYY-MM-DD>/<camera_id>/<HHMMSS>_<track_id>_<speed>kmh.jpg (ảnh bằng chứng trip: ..._trip.jpg)
+    - mỗi thư mục có index.csv sidecar: ts,track_id,speed_kmh,path
+    - gom job thành lô, mỗi lô mở index.csv 1 lần
+    - giữ tổng dung lượng <= quota_bytes và xoá ảnh cũ hơn retention_days (cũ nhất trước)
+    """
+    INDEX_NAME = "index.csv"
+
+    def __init__(self, root, camera_id: str = "cam0", quota_bytes: int = 2 * 1024 ** 3,
+                 retention_days: float = 7.0, max_pending: int = 64,
+                 batch_size: int = 16, flush_interval_s: float = 1.0,
+                 prune_interval_s: float = 600.0):
+        self.root = Path(root)
+        self.camera_id = str(camera_id)
+        self.quota_bytes = int(quota_bytes)
+        self.retention_s = float(retention_days) * 86400.0
+        self.max_pending = max(1, int(max_pending))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = float(flush_interval_s)
+        self.prune_interval_s = float(prune_interval_s)
+
+        self._q = deque()
+        lock = threading.RLock()
+        self._cv = threading.Condition(lock)
+        self._idle = threading.Condition(lock)    # flush(): chờ ghi xong lô đang có
+        self._writing = False
+        self._closing = False
+
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+        self.bytes_on_disk = 0
+        self._files = deque()   # (mtime, path, size) cũ -> mới, để xoá theo quota/tuổi
+
+        self._thread = threading.Thread(target=self._run, name="snap-writer", daemon=True)
+        self._thread.start()
+
+    def path_for(self, ts: float, track_id: int, speed_kmh: float, camera_id: str = None, tag: str = "") -> str:
+        """
+        Đường dẫn file sẽ ghi (chỉ format chuỗi, không đụng đĩa). 1 writer dùng chung nhiều camera.
+        tag: hậu tố tên file (vd "trip" cho ảnh bằng chứng của trip).
+        """
+        lt = time.localtime(ts)
+        day = time.strftime("%Y-%m-%d", lt)
+        name = f"{time.strftime('%H%M%S', lt)}_{int(track_id)}_{int(speed_kmh)}kmh{'_' + tag if tag else ''}.jpg"
+        return str(self.root / day / (camera_id or self.camera_id) / name)
+
+    def submit(self, ts: float, track_id: int, speed_kmh: float, jpeg_bytes: bytes, path=None,
+               done=None) -> str:
+        """
+        Đưa 1 ảnh vào hàng đợi ghi. Trả path (hoặc None nếu bị drop vì hàng đợi đầy).
+        done(ok): gọi từ thread ghi sau khi file đã ghi (True) / ghi lỗi hoặc bị drop (False).
+        """
+        path = path or self.path_for(ts, track_id, speed_kmh)
+        with self._cv:
+            full = self._closing or len(self._q) >= self.max_pending
+            if full:
+                self.dropped += 1
+            else:
+                self._q.append((ts, int(track_id), float(speed_kmh), path, jpeg_bytes, done))
+                if len(self._q) >= self.batch_size:
+                    self._cv.notify()
+        if full:
+            _snap_done(done, False)
+            return None
+        return path
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "pruned": self.pruned,
+                "pending": len(self._q),
+                "bytes_on_disk": self.bytes_on_disk,
+            }
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Ghi ngay các ảnh đang chờ (không đợi flush_interval_s). False nếu hết giờ."""
+        end = time.monotonic() + timeout
+        with self._idle:
+            self._cv.notify()
+            while self._q or self._writing:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self._idle.wait(left)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    # -------------------- background --------------------
+    def _run(self):
+        self._scan_existing()
+        self._prune()
+        last_prune = time.monotonic()
+        while True:
+            with self._cv:
+                if not self._q and not self._closing:
+                    self._cv.wait(self.flush_interval_s)
+                batch = [self._q.popleft() for _ in range(min(len(self._q), self.batch_size))]
+                self._writing = bool(batch)
+                done = self._closing and not self._q
+            if batch:
+                try:
+                    self._write_batch(batch)
+                finally:
+                    with self._cv:
+                        self._writing = False
+                        if not self._q:
+                            self._idle.notify_all()
+            now = time.monotonic()
+            if (batch and self.bytes_on_disk > self.quota_bytes) or now - last_prune >= self.prune_interval_s:
+                self._prune()
+                last_prune = now
+            if done:
+                return
+
+    def _write_batch(self, batch):
+        rows_by_dir = {}
+        for ts, tid, speed, path, data, done in batch:
+            p = Path(path)
+            try:
+                p.parent.mkdir(parents=True, exist_ok=True)
+                with open(p, "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                print("[WARN] snapshot write failed:", e)
+                _snap_done(done, False)
+                continue
+            _snap_done(done, True)
+            size = len(data)
+            self._files.append((ts, p, size))
+            self.written += 1
+            self.bytes_on_disk += size
+            rows_by_dir.setdefault(p.parent, []).append(
+                f"{ts:.3f},{tid},{speed:.1f},{p}\n")
+        for d, rows in rows_by_dir.items():
+            idx = d / self.INDEX_NAME
+            try:
+                new = not idx.exists()
+                with open(idx, "a", encoding="utf-8") as f:
+                    if new:
+                        f.write("ts,track_id,speed_kmh,path\n")
+                    f.writelines(rows)
+            except OSError as e:
+                print("[WARN] snapshot index write failed:", e)
+
+    def _scan_existing(self):
+        # nạp ảnh đã có trên đĩa (sau restart) để quota/retention tính đúng
+        files = []
+        for p in self.root.glob("*/*/*.jpg"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, p, st.st_size))
+        files.sort(key=lambda x: x[0])
+        self._files = deque(files)
+        self.bytes_on_disk = sum(f[2] for f in files)
+
+    def _prune(self):
+        # index.csv có thể còn dòng trỏ tới ảnh đã xoá; người đọc cần kiểm tra file tồn tại
+        cutoff = time.time() - self.retention_s
+        touched = set()
+        while self._files and (self._files[0][0] < cutoff or self.bytes_on_disk > self.quota_bytes):
+            _, p, size = self._files.popleft()
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("[WARN] snapshot prune failed:", e)
+                continue
+            self.bytes_on_disk -= size
+            self.pruned += 1
+            touched.add(p.parent)
+        for d in touched:
+            self._remove_empty_dirs(d)
+
+    def _remove_empty_dirs(self, d: Path):
+        # xoá thư mục camera/ngày khi chỉ còn index.csv
+        try:
+            left = [x for x in d.iterdir() if x.name != self.INDEX_NAME]
+            if left:
+                return
+            (d / self.INDEX_NAME).unlink(missing_ok=True)
+            d.rmdir()
+            if d.parent != self.root and not any(d.parent.iterdir()):
+                d.parent.rmdir()
+        except OSError:
+            pass
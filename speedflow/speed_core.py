@@ -0,0 +1,412 @@
+# speedflow/speed_core.py
+# Phần tính tốc độ KHÔNG phụ thuộc DeepStream/pyds: trạng thái track theo từng nguồn (camera),
+# lọc phép đo, median smoothing, trip record. Probe chỉ đọc meta -> gọi vào đây -> ghi display_text.
+# Object chỉ cần các thuộc tính giống NvDsObjectMeta: object_id, class_id, confidence,
+# rect_params.left/top/width/height -> test/replay được bằng meta giả (SimpleNamespace).
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from .settings import (
+    VIDEO_FPS, SPEED_LIMIT_KMH, HOMO_LUT, HOMO_LUT_BILINEAR, MUX_WIDTH, MUX_HEIGHT,
+    MIN_TRACK_AGE_FRAMES, MIN_WORLD_DISPL_M, MAX_ABS_KMH,
+    BBOX_AREA_JUMP, MIN_DET_CONF, MEDIAN_WINDOW,
+    TRACK_MAX_LIVE, TRIP_END_GRACE_S, TRIP_MIN_FRAMES, SPEED_ESTIMATOR,
+    SPEED_TIMEBASE, SPEED_TS_MAX_GAP_S, ROI_FILTER,
+)
+from .config_txt import load_kv_txt
+from .homography import load_points, load_view_transformer
+from .track_store import TrackStore
+from .kalman import KalmanCV
+from .zones import ZoneSet, load_zones
+from .trips import trip_from_slot
+from .stage_stats import ST_HOMOGRAPHY, ST_TRACKS, ST_SPEED
+
+
+@dataclass
+class SourceConfig:
+    source_id: int                 # pad index trên nvstreammux (= frame_meta.source_id)
+    camera_id: str
+    view_transformer: object       # ViewTransformer riêng của camera
+    roi_points: np.ndarray         # SOURCE points (pixel) của homography
+    fps: float = VIDEO_FPS
+    uri: str = ""
+    analytics_cfg: str = ""
+    zones: object = None           # ZoneSet lọc ROI (None = 1 zone từ roi_points)
+
+
+def load_source(source_id: int, uri: str, cfg_path: str, camera_id: str = None) -> SourceConfig:
+    """
+    1 file TXT/camera (HOMO_YML, VIDEO_FPS, ANALYTICS_CFG/CAMERA_ID/MUX_WIDTH/MUX_HEIGHT tuỳ chọn)
+    -> SourceConfig. Homography dùng bảng tra theo độ phân giải mux (HOMO_LUT), zone ROI theo HOMO_YML.
+    """
+    kv = load_kv_txt(cfg_path)
+    source_pts, _ = load_points(kv["HOMO_YML"])
+    vt = load_view_transformer(str(kv["HOMO_YML"]), int(kv.get("MUX_WIDTH", MUX_WIDTH)),
+                               int(kv.get("MUX_HEIGHT", MUX_HEIGHT)), lut=HOMO_LUT, bilinear=HOMO_LUT_BILINEAR)
+    return SourceConfig(
+        source_id=int(source_id),
+        camera_id=str(camera_id or kv.get("CAMERA_ID", f"cam{source_id}")),
+        view_transformer=vt,
+        roi_points=source_pts,
+        fps=float(kv["VIDEO_FPS"]),
+        uri=uri,
+        analytics_cfg=kv.get("ANALYTICS_CFG", ""),
+        zones=load_zones(str(kv["HOMO_YML"]), source_pts),
+    )
+
+
+CLOCK_TIME_NONE = (1 << 64) - 1     # GST_CLOCK_TIME_NONE
+UNTRACKED_OBJECT_ID = (1 << 64) - 1 # obj chưa được nvtracker gán id (tràn int64 của TrackStore)
+
+
+def pts_seconds(pts_ns):
+    """buf_pts (ns) -> giây; None nếu không có (thiếu thuộc tính / GST_CLOCK_TIME_NONE / âm)."""
+    if pts_ns is None or pts_ns < 0 or pts_ns >= CLOCK_TIME_NONE:
+        return None
+    return pts_ns / 1e9
+
+
+def footpoint(obj):
+    """(cx, bottom_y) của bbox = điểm chạm mặt đường."""
+    r = obj.rect_params
+    return r.left + r.width / 2.0, r.top + r.height
+
+
+def footpoints(objs) -> np.ndarray:
+    return np.asarray([footpoint(o) for o in objs], dtype=np.float32).reshape(-1, 2)
+
+
+def crop_bbox(image, obj):
+    """Trả view (không copy) vùng bbox trong image, hoặc None nếu bbox nằm ngoài."""
+    h, w = image.shape[:2]
+    x  = int(round(obj.rect_params.left))
+    y  = int(round(obj.rect_params.top))
+    bw = int(round(obj.rect_params.width))
+    bh = int(round(obj.rect_params.height))
+    x = max(0, x); y = max(0, y)
+    x2 = min(w, x + max(1, bw))
+    y2 = min(h, y + max(1, bh))
+    if x >= x2 or y >= y2:
+        return None
+    return image[y:y2, x:x2]
+
+
+def bbox_area(obj) -> float:
+    w = max(1.0, obj.rect_params.width)
+    h = max(1.0, obj.rect_params.height)
+    return float(w * h)
+
+
+class SourceSpeed:
+    """
+    Trạng thái tốc độ của 1 nguồn: TrackStore riêng (track_id của nguồn này), FPS riêng.
+    Các ngưỡng tính theo frame trong settings (đặt cho VIDEO_FPS) được quy đổi theo fps của nguồn.
+    - update(frame_no, ts, ts_iso, objs, pts_world, frame, pts) -> display_text cho từng obj
+    - on_overspeed(src, slot, track_id, speed_kmh, ts, ts_iso, frame, obj): phép đo hợp lệ >= limit
+    - on_measure(src, slot, track_id, speed_kmh, ts, frame, obj): mọi phép đo hợp lệ (sau on_overspeed)
+    - on_trip(rec: TripRecord, src, slot): track kết thúc (slot chưa bị thu hồi)
+    """
+    def __init__(self, cfg: SourceConfig, max_tracks: int = TRACK_MAX_LIVE, ttl_frames: int = None,
+                 on_trip=None, on_overspeed=None, timer=None, estimator: str = SPEED_ESTIMATOR,
+                 timebase: str = SPEED_TIMEBASE, log=None, on_measure=None):
+        self.cfg = cfg
+        self.log = log              # SpeedLogWriter (None = tắt)
+        self.timer = timer          # StageStats (None = tắt đo)
+        self.source_id = int(cfg.source_id)
+        self.camera_id = str(cfg.camera_id)
+        self.fps = float(cfg.fps)
+        self.win = max(2, int(self.fps))                 # cửa sổ lịch sử ~1s
+        scale = self.fps / float(VIDEO_FPS)
+        self.min_age_frames = int(round(MIN_TRACK_AGE_FRAMES * scale))
+        self.trip_min_frames = int(round(TRIP_MIN_FRAMES * scale))
+        if ttl_frames is None:
+            ttl_frames = int(self.fps * TRIP_END_GRACE_S)
+        self.on_trip = on_trip
+        self.on_overspeed = on_overspeed
+        self.on_measure = on_measure
+        self.tracks = TrackStore(max_tracks=max_tracks, hist_len=self.win,
+                                 speed_len=MEDIAN_WINDOW, ttl_frames=ttl_frames,
+                                 on_release=self._emit_trip)
+        if estimator not in ("kalman", "window"):
+            raise ValueError(f"Invalid speed estimator: {estimator!r}")
+        # kalman: tốc độ mỗi frame từ KalmanCV (1 bước vector hoá/frame), window: hiệu y_world ~1s + median
+        self.kf = KalmanCV(self.tracks.max_tracks) if estimator == "kalman" else None
+        if timebase not in ("pts", "frame"):
+            raise ValueError(f"Invalid speed timebase: {timebase!r}")
+        self.use_pts = timebase == "pts"
+        # ROI: footpoint ngoài mọi zone -> bỏ qua (không track/tính tốc độ)
+        self.zones = None
+        if ROI_FILTER:
+            self.zones = cfg.zones
+            if self.zones is None and cfg.roi_points is not None:
+                self.zones = ZoneSet({"roi": cfg.roi_points})
+
+    # -------------------- trip --------------------
+    def _emit_trip(self, slot):
+        tracks = self.tracks
+        # bỏ track rác (quá ngắn) -> không tính là 1 xe
+        if tracks.last_seen_frame[slot] - tracks.birth_frame[slot] < self.trip_min_frames:
+            return
+        if self.on_trip is not None:
+            self.on_trip(trip_from_slot(tracks, slot, self.camera_id,
+                                        self.zones.names if self.zones is not None else None), self, slot)
+
+    def flush(self):
+        """Kết thúc mọi track còn sống (dừng pipeline/EOS)."""
+        for s in list(self.tracks.slot_of.values()):
+            self.tracks.release(s)
+
+    # -------------------- đo tốc độ --------------------
+    def compute_speed_kmh(self, slot):
+        n = int(self.tracks.hist_count[slot])
+        if n < self.win:
+            return None
+        first, last = self.tracks.hist_ends(slot)
+        # theo frame_num thật: nvinfer interval > 0 / tracker không xuất bbox ở 1 số frame
+        # -> n mẫu có thể trải dài hơn n - 1 frame
+        time_s = self.tracks.hist_span_frames(slot) / self.fps
+        if self.use_pts:
+            # frame drop trước nvstreammux không để lại lỗ trong frame_num -> PTS mới là thời gian thật
+            span_s = self.tracks.hist_span_s(slot)
+            if 0 < span_s <= time_s + SPEED_TS_MAX_GAP_S:        # NaN (thiếu PTS) -> theo frame
+                time_s = span_s
+        if time_s <= 0:
+            return 0.0
+        return (abs(last - first) / time_s) * 3.6
+
+    def valid_measurement(self, slot, frame_no, speed_kmh, area_prev, area_now, det_conf):
+        tracks = self.tracks
+        # 1) tuổi track
+        if frame_no - int(tracks.birth_frame[slot]) < self.min_age_frames:
+            return False
+        # 2) dịch chuyển mặt đất tối thiểu (kalman: quãng đường ~1s theo vận tốc ước lượng)
+        if self.kf is not None:
+            if speed_kmh is not None and speed_kmh / 3.6 * self.win / self.fps < MIN_WORLD_DISPL_M:
+                return False
+        elif tracks.hist_count[slot] >= 2:
+            first, last = tracks.hist_ends(slot)
+            if abs(last - first) < MIN_WORLD_DISPL_M:
+                return False
+        # 3) giới hạn vật lý
+        if (speed_kmh is None) or (speed_kmh <= 0) or (speed_kmh > MAX_ABS_KMH):
+            return False
+        # 4) nhảy diện tích bbox (zoom/ID switch/dao động)
+        if area_prev is not None and area_prev > 0 and (area_now / area_prev) > BBOX_AREA_JUMP:
+            return False
+        # 5) độ tin cậy detection (nếu có); < 0 = frame chỉ có tracker (nvinfer interval), không xét
+        if det_conf is not None and 0 <= det_conf < MIN_DET_CONF:
+            return False
+        return True
+
+    def transform(self, objs):
+        return self.cfg.view_transformer.transform_points(footpoints(objs))
+
+    def update(self, frame_no, ts, ts_iso, objs, pts_world=None, frame=None, pts=None, zone=None):
+        """
+        objs: xe của 1 frame (đã lọc class/ROI/untracked); pts_world: (N, 2) đã transform (None = tự tính);
+        pts: PTS của frame (giây, None = không có) -> thời gian giữa các mẫu; zone: (N,) chỉ số zone.
+        """
+        if not objs:
+            return []
+        if pts_world is None:
+            pts_world = self.transform(objs)
+        tracks = self.tracks
+        win = self.win
+        timer = self.timer
+        kf = self.kf
+        t = pts if (pts is not None and self.use_pts) else None
+        n = len(objs)
+        slots = np.empty(n, dtype=np.intp)
+        tids = np.empty(n, dtype=np.int64)
+        for i, obj in enumerate(objs):
+            tid = obj.object_id
+            slot = tracks.slot(tid, frame_no)
+            slots[i] = slot
+            tids[i] = tid
+            if kf is None:
+                tracks.push_position(slot, float(pts_world[i, 1]), frame_no, np.nan if t is None else t)
+            tracks.observe(slot, ts, float(pts_world[i, 0]), float(pts_world[i, 1]), obj.class_id,
+                           -1 if zone is None else int(zone[i]))
+
+        if kf is not None:
+            if timer:
+                t_speed = time.perf_counter()
+            kf_speed, kf_ready, _ = kf.step(slots, tids, pts_world, frame_no, self.fps, t)
+            if self.log is not None:
+                logged = np.where(kf_ready, kf_speed, np.nan)
+            kf_speed = kf_speed.tolist()
+            kf_ready = kf_ready.tolist()
+            if timer:
+                timer.add(ST_SPEED, time.perf_counter() - t_speed)
+        elif self.log is not None:
+            logged = np.full(n, np.nan, dtype=np.float32)     # window: chỉ có tốc độ ở nhịp ~1s
+
+        texts = []
+        for i, obj in enumerate(objs):
+            slot = int(slots[i])
+            tid = obj.object_id
+            area_now = bbox_area(obj)
+            area_prev = float(tracks.last_area[slot]) or None
+            det_conf = getattr(obj, "confidence", None)   # có thể None trên 1 số phiên bản
+
+            display_text = tracks.speed_text[slot] or f"#{tid}"
+            if kf is not None:
+                # tốc độ hiển thị mỗi frame khi bộ lọc đã hội tụ
+                speed_kf = kf_speed[i] if kf_ready[i] else None
+                if (speed_kf is not None and 0 < speed_kf <= MAX_ABS_KMH
+                        and frame_no - int(tracks.birth_frame[slot]) >= self.min_age_frames):
+                    display_text = f"#{tid} {int(speed_kf)} km/h"
+                    tracks.speed_text[slot] = display_text
+
+            # mỗi ~1s mới cập nhật một lần (trip stats + overspeed)
+            if ((tracks.hist_count[slot] >= win if kf is None else speed_kf is not None)
+                    and frame_no - tracks.last_update_frame[slot] >= win):
+                if timer:
+                    t_speed = time.perf_counter()
+                speed_kmh = self.compute_speed_kmh(slot) if kf is None else speed_kf
+                if self.valid_measurement(slot, frame_no, speed_kmh, area_prev, area_now, det_conf):
+                    if kf is not None:
+                        speed_smooth = speed_kmh          # Kalman đã làm mượt
+                    else:
+                        # median smoothing
+                        tracks.push_speed(slot, speed_kmh)
+                        if tracks.speed_count[slot] >= 3:
+                            speed_smooth = tracks.speed_median(slot)
+                        else:
+                            speed_smooth = speed_kmh
+                    tracks.push_trip_speed(slot, speed_smooth)
+                    if kf is None and self.log is not None:
+                        logged[i] = speed_smooth
+
+                    display_text = f"#{tid} {int(speed_smooth)} km/h"
+                    tracks.speed_text[slot] = display_text
+                    tracks.last_update_frame[slot] = frame_no
+                    if timer:
+                        timer.add(ST_SPEED, time.perf_counter() - t_speed)
+
+                    if speed_smooth >= float(SPEED_LIMIT_KMH) and self.on_overspeed is not None:
+                        self.on_overspeed(self, slot, tid, speed_smooth, ts, ts_iso, frame, obj)
+                    if self.on_measure is not None:
+                        self.on_measure(self, slot, tid, speed_smooth, ts, frame, obj)
+                else:
+                    # phép đo không hợp lệ: chỉ hiển thị id
+                    display_text = f"#{tid}"
+                    tracks.speed_text[slot] = display_text
+                    if timer:
+                        timer.add(ST_SPEED, time.perf_counter() - t_speed)
+
+            texts.append(display_text)
+            tracks.last_area[slot] = area_now
+        if self.log is not None:
+            self.log.add(self.camera_id, frame_no, ts, tids, [o.class_id for o in objs], pts_world, logged)
+        return texts
+
+
+class MultiSourceSpeed:
+    """
+    N nguồn trong 1 batch nvstreammux: trạng thái khoá theo (source_id, track_id)
+    = mỗi source_id 1 SourceSpeed (TrackStore, homography, FPS riêng).
+    process(frames): frames = [(source_id, frame_no, ts, ts_iso, objs, frame, pts)] của 1 batch
+      -> list display_texts theo từng frame (None nếu source_id không được cấu hình),
+         text None = obj nằm ngoài ROI hoặc chưa có track id (không ghi display_text)
+    Footpoint được gom theo nguồn -> 1 lần lọc zone + 1 lần transform/nguồn/batch.
+    """
+    def __init__(self, sources, max_tracks: int = TRACK_MAX_LIVE, ttl_frames: int = None,
+                 on_trip=None, on_overspeed=None, timer=None, estimator: str = SPEED_ESTIMATOR,
+                 timebase: str = SPEED_TIMEBASE, log=None, on_measure=None):
+        self.timer = timer
+        self.sources = {}
+        for cfg in sources:
+            if cfg.source_id in self.sources:
+                raise ValueError(f"Duplicate source_id: {cfg.source_id}")
+            self.sources[cfg.source_id] = SourceSpeed(cfg, max_tracks=max_tracks, ttl_frames=ttl_frames,
+                                                      on_trip=on_trip, on_overspeed=on_overspeed,
+                                                      timer=timer, estimator=estimator, timebase=timebase,
+                                                      log=log, on_measure=on_measure)
+        self.unknown_frames = 0
+        self.outside_roi = 0       # số obj bị bỏ vì footpoint ngoài mọi zone
+        self.untracked = 0         # số obj bị bỏ vì object_id = UNTRACKED_OBJECT_ID
+
+    def __getitem__(self, source_id) -> SourceSpeed:
+        return self.sources[source_id]
+
+    def __iter__(self):
+        return iter(self.sources.values())
+
+    def process(self, frames):
+        texts = [None] * len(frames)
+        groups = {}       # source_id -> [frame index có xe]
+        max_frame = {}    # source_id -> frame_no lớn nhất trong batch (để thu hồi track)
+        for fi, (sid, frame_no, _ts, _iso, objs, _frame, _pts) in enumerate(frames):
+            if sid not in self.sources:
+                self.unknown_frames += 1
+                continue
+            max_frame[sid] = max(max_frame.get(sid, frame_no), frame_no)
+            if objs:
+                groups.setdefault(sid, []).append(fi)
+            else:
+                texts[fi] = []
+
+        timer = self.timer
+        for sid, fis in groups.items():
+            src = self.sources[sid]
+            if timer:
+                t0 = time.perf_counter()
+            all_objs = [o for fi in fis for o in frames[fi][4]]
+            fp = footpoints(all_objs)
+            zone = keep = None
+            if src.zones is not None:
+                zone = src.zones.zone_index(fp)
+                keep = zone >= 0
+                self.outside_roi += int(len(keep) - np.count_nonzero(keep))
+            # obj chưa có track id: bỏ trước khi vào TrackStore (track_ids int64, -1 = trống)
+            untracked = [i for i, o in enumerate(all_objs) if o.object_id == UNTRACKED_OBJECT_ID]
+            if untracked:
+                if keep is None:
+                    keep = np.ones(len(fp), dtype=bool)
+                keep[untracked] = False
+                self.untracked += len(untracked)
+            if keep is not None:
+                if keep.all():
+                    keep = None
+                else:
+                    fp = fp[keep]
+            pts_world = src.cfg.view_transformer.transform_points(fp)
+            if timer:
+                t1 = time.perf_counter()
+                timer.add(ST_HOMOGRAPHY, t1 - t0)
+            k = j = 0          # k: vị trí trong mọi obj của nguồn, j: trong obj trong ROI
+            for fi in fis:
+                _sid, frame_no, ts, ts_iso, objs, frame, pts = frames[fi]
+                n = len(objs)
+                if keep is None:
+                    z = None if zone is None else zone[k:k + n]
+                    texts[fi] = src.update(frame_no, ts, ts_iso, objs, pts_world[k:k + n], frame, pts, z)
+                else:
+                    km = keep[k:k + n]
+                    inside = [o for o, ok in zip(objs, km) if ok]
+                    m = len(inside)
+                    frame_texts = [None] * n
+                    if m:
+                        sub = src.update(frame_no, ts, ts_iso, inside, pts_world[j:j + m], frame, pts,
+                                         None if zone is None else zone[k:k + n][km])
+                        it = iter(sub)
+                        for i in np.flatnonzero(km):
+                            frame_texts[i] = next(it)
+                    texts[fi] = frame_texts
+                    j += m
+                k += n
+            if timer:
+                # gồm cả speed/crop/submit của overspeed (các stage đó cũng được đo riêng)
+                timer.add(ST_TRACKS, time.perf_counter() - t1)
+
+        # thu hồi slot của các track đã biến mất (theo frame_no của từng nguồn)
+        for sid, frame_no in max_frame.items():
+            self.sources[sid].tracks.evict_stale(frame_no)
+        return texts
+
+    def flush(self):
+        for src in self.sources.values():
+            src.flush()
@@ -0,0 +1,183 @@
+# speedflow/speed_log.py
+# Log đầy đủ từng phép đo (mỗi xe mỗi frame) mà không làm chậm probe:
+#   probe thread: add() chỉ đưa các cột NumPy của 1 frame vào deque (không I/O, không format chuỗi)
+#   thread nền  : mỗi flush_interval_s gom lô -> ghi CSV, Parquet hoặc Arrow IPC (nén zstd)
+# Xoay file theo dung lượng (rotate_mb) và thời gian (rotate_s): <root>/<prefix>_<YYYYmmdd_HHMMSS>.<ext>
+# Parquet chỉ đọc được sau khi file đóng (footer) -> dùng "arrow" (IPC stream) nếu cần đọc file đang ghi.
+import os, threading, time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # chỉ cần cho format parquet/arrow
+    pa = pq = None
+
+FORMATS = ("off", "csv", "parquet", "arrow")
+_EXT = {"csv": "csv", "parquet": "parquet", "arrow": "arrow"}
+COLUMNS = ("ts", "camera_id", "frame", "track_id", "class_id", "x_m", "y_m", "speed_kmh")
+
+
+def arrow_schema():
+    return pa.schema([("ts", pa.float64()), ("camera_id", pa.string()), ("frame", pa.int64()),
+                      ("track_id", pa.int64()), ("class_id", pa.int16()),
+                      ("x_m", pa.float32()), ("y_m", pa.float32()), ("speed_kmh", pa.float32())])
+
+
+class SpeedLogWriter:
+    """
+    add(camera_id, frame_no, ts, track_ids, class_ids, xy, speed_kmh): 1 frame của 1 nguồn,
+    speed_kmh NaN = chưa có tốc độ. Hàng đợi vượt max_pending_rows -> bỏ frame (đếm dropped_rows).
+    """
+    def __init__(self, root, fmt: str = "csv", prefix: str = "speed", rotate_mb: float = 64.0,
+                 rotate_s: float = 3600.0, flush_interval_s: float = 2.0, max_pending_rows: int = 200_000):
+        if fmt not in FORMATS or fmt == "off":
+            raise ValueError(f"Invalid speed log format: {fmt!r}")
+        if fmt != "csv" and pa is None:
+            print(f"[WARN] pyarrow not installed, speed log falls back to csv (wanted {fmt})")
+            fmt = "csv"
+        self.root = Path(root)
+        self.fmt = fmt
+        self.prefix = str(prefix)
+        self.rotate_bytes = int(float(rotate_mb) * 1024 * 1024)
+        self.rotate_s = float(rotate_s)
+        self.flush_interval_s = float(flush_interval_s)
+        self.max_pending_rows = int(max_pending_rows)
+
+        self._q = deque()
+        self._pending = 0
+        self._cv = threading.Condition()
+        self._closing = False
+
+        self.rows = 0
+        self.dropped_rows = 0
+        self.files = 0
+        self.path = None
+        self._f = None           # file (csv) / writer pyarrow
+        self._sink = None        # arrow: file bên dưới IPC writer
+        self._opened = 0.0
+        self._schema = arrow_schema() if fmt != "csv" else None
+
+        self._thread = threading.Thread(target=self._run, name="speed-log", daemon=True)
+        self._thread.start()
+
+    def add(self, camera_id, frame_no, ts, track_ids, class_ids, xy, speed_kmh):
+        n = len(track_ids)
+        if n == 0:
+            return
+        with self._cv:
+            if self._closing or self._pending + n > self.max_pending_rows:
+                self.dropped_rows += n
+                return
+            self._q.append((str(camera_id), int(frame_no), float(ts), track_ids, class_ids, xy, speed_kmh))
+            self._pending += n
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"rows": self.rows, "dropped_rows": self.dropped_rows, "pending_rows": self._pending,
+                    "files": self.files, "path": str(self.path) if self.path else None}
+
+    def close(self, timeout: float = 10.0):
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    # -------------------- background --------------------
+    def _run(self):
+        while True:
+            with self._cv:
+                if not self._closing:
+                    self._cv.wait(self.flush_interval_s)
+                chunks = list(self._q)
+                self._q.clear()
+                self._pending = 0
+                done = self._closing
+            if chunks:
+                try:
+                    self._write(self._columns(chunks))
+                except Exception as e:
+                    print("[WARN] speed log write failed:", e)
+                    self._close_file()
+            elif self._f is not None and time.time() - self._opened >= self.rotate_s:
+                self._close_file()
+            if done:
+                self._close_file()
+                return
+
+    @staticmethod
+    def _columns(chunks) -> dict:
+        lens = [len(c[3]) for c in chunks]
+        rep = lambda i, dtype: np.repeat(np.array([c[i] for c in chunks], dtype=dtype), lens)
+        xy = np.concatenate([np.asarray(c[5], dtype=np.float32).reshape(-1, 2) for c in chunks])
+        return {
+            "ts": rep(2, np.float64),
+            "camera_id": rep(0, object),
+            "frame": rep(1, np.int64),
+            "track_id": np.concatenate([np.asarray(c[3], dtype=np.int64) for c in chunks]),
+            "class_id": np.concatenate([np.asarray(c[4], dtype=np.int16) for c in chunks]),
+            "x_m": xy[:, 0],
+            "y_m": xy[:, 1],
+            "speed_kmh": np.concatenate([np.asarray(c[6], dtype=np.float32) for c in chunks]),
+        }
+
+    def _write(self, cols):
+        now = time.time()
+        if self._f is not None and (now - self._opened >= self.rotate_s or self._size() >= self.rotate_bytes):
+            self._close_file()
+        if self._f is None:
+            self._open_file(now)
+        n = len(cols["ts"])
+        if self.fmt == "csv":
+            self._f.write("".join(
+                f"{t:.3f},{c},{fr},{tid},{cl},{x:.2f},{y:.2f},{'' if s != s else f'{s:.1f}'}\n"
+                for t, c, fr, tid, cl, x, y, s in zip(*(cols[k].tolist() for k in COLUMNS))))
+            self._f.flush()
+        else:
+            table = pa.table({k: cols[k] for k in COLUMNS}, schema=self._schema)
+            if self.fmt == "parquet":
+                self._f.write_table(table)
+            else:
+                self._f.write(table)
+        self.rows += n
+
+    def _open_file(self, now):
+        self.root.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+        path = self.root / f"{self.prefix}_{stamp}.{_EXT[self.fmt]}"
+        k = 1
+        while path.exists():        # xoay nhiều lần trong 1 giây
+            path = self.root / f"{self.prefix}_{stamp}_{k}.{_EXT[self.fmt]}"
+            k += 1
+        if self.fmt == "csv":
+            self._f = open(path, "w", encoding="utf-8")
+            self._f.write(",".join(COLUMNS) + "\n")
+        elif self.fmt == "parquet":
+            self._f = pq.ParquetWriter(str(path), self._schema, compression="zstd")
+        else:
+            self._sink = pa.OSFile(str(path), "wb")
+            self._f = pa.ipc.new_stream(self._sink, self._schema,
+                                        options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        self.path = path
+        self._opened = now
+        self.files += 1
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _close_file(self):
+        if self._f is None:
+            return
+        try:
+            self._f.close()
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+        except Exception as e:
+            print("[WARN] speed log close failed:", e)
+        self._f = None
@@ -0,0 +1,401 @@
+# speedflow/spool.py
+# Store-and-forward cho event (overspeed/trip/probe_stats) khi mất uplink (Wi-Fi/LTE chập chờn):
+#   EventSpool    : hàng đợi append-only trên đĩa = các segment <root>/seg_<seq>.spool + file cursor
+#                   (segment, offset) của bản ghi kế tiếp cần gửi. Bản ghi = LEN(u32) | CRC32(u32) | KIND(u8) | data
+#                   (message đã encode đúng wire format). Vượt max_bytes -> xoá segment cũ nhất trước.
+#                   Khởi động lại: quét header, cắt bản ghi ghi dở ở cuối, tiếp tục từ cursor.
+#   SpoolForwarder: đứng giữa probe và WebSocket. Có WS + spool rỗng -> gửi thẳng; mất WS (hoặc còn
+#                   backlog, giữ thứ tự) -> ghi spool; task trên event loop phát lại backlog theo thứ tự,
+#                   giới hạn KB/s + msg/s để không chiếm uplink của video WebRTC.
+# Giao nhận at-least-once: cursor lưu mỗi cursor_interval_s -> crash có thể gửi lặp vài event cuối.
+import asyncio, os, struct, threading, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:  # Windows: bỏ khoá thư mục
+    fcntl = None
+
+from .event_proto import WIRE_JSON, check_wire_format, encode_message
+
+_REC = struct.Struct(">IIB")
+KIND_TEXT, KIND_BINARY = 0, 1
+SEG_PREFIX, SEG_SUFFIX = "seg_", ".spool"
+CURSOR_NAME = "cursor"
+
+
+class EventSpool:
+    """
+    append(msg: str | bytes) thread-safe (probe/encoder thread); peek() + ack(token) cho 1 consumer.
+    pending = số event chưa gửi; discarded = số event bị bỏ vì vượt max_bytes (cũ nhất trước).
+    """
+    def __init__(self, root, max_bytes: int = 256 * 1024 ** 2, segment_bytes: int = 8 * 1024 ** 2,
+                 cursor_interval_s: float = 1.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.segment_bytes = max(4096, min(int(segment_bytes), self.max_bytes // 2))
+        self.cursor_interval_s = float(cursor_interval_s)
+        self._lock = threading.Lock()
+
+        # 1 process / thư mục: 2 writer cùng append sẽ làm hỏng segment
+        self._lockf = open(self.root / "lock", "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lockf.close()
+                raise RuntimeError(f"Spool {self.root} is used by another process")
+
+        self._segs = {}             # seq -> [bytes, records], cũ -> mới
+        self.total_bytes = 0
+        self.pending = 0
+        self.appended = 0
+        self.sent = 0
+        self.discarded = 0
+        self.corrupt = 0
+        self._cur = [0, 0, 0]       # seq, offset, số bản ghi đã gửi trong segment
+        self._cursor_saved = 0.0
+        self._rf = None             # (seq, file) đang đọc
+        self._w = None
+        self._w_seq = -1
+        self._dirty = False
+        self._unsynced = []         # fd (dup) của segment đã roll, chờ fsync ở sync()
+        self._load()
+
+    # -------------------- khởi động --------------------
+    def _seg_path(self, seq: int) -> Path:
+        return self.root / f"{SEG_PREFIX}{seq:08d}{SEG_SUFFIX}"
+
+    @staticmethod
+    def _scan(path, stop: int = None):
+        """-> (offset cuối bản ghi hợp lệ, số bản ghi); stop: dừng ở offset này (cursor)."""
+        size = path.stat().st_size
+        pos = n = 0
+        with open(path, "rb") as f:
+            while pos + _REC.size <= size and (stop is None or pos < stop):
+                f.seek(pos)
+                length = _REC.unpack(f.read(_REC.size))[0]
+                if pos + _REC.size + length > size:
+                    break                       # bản ghi ghi dở (mất điện/kill giữa chừng)
+                pos += _REC.size + length
+                n += 1
+        return pos, n
+
+    def _load(self):
+        for p in sorted(self.root.glob(f"{SEG_PREFIX}*{SEG_SUFFIX}")):
+            try:
+                seq = int(p.name[len(SEG_PREFIX):-len(SEG_SUFFIX)])
+            except ValueError:
+                continue
+            end, n = self._scan(p)
+            if end < p.stat().st_size:
+                print(f"[SPOOL] truncating torn record in {p.name} at {end}")
+                os.truncate(p, end)
+            self._segs[seq] = [end, n]
+            self.total_bytes += end
+        seqs = list(self._segs)
+        try:
+            seq, off = (int(v) for v in (self.root / CURSOR_NAME).read_text().split()[:2])
+        except (OSError, ValueError):
+            seq, off = (seqs[0], 0) if seqs else (0, 0)
+        if seqs and seq not in self._segs:
+            seq, off = (seqs[0], 0) if seq < seqs[0] else (seqs[-1], self._segs[seqs[-1]][0])
+        for s in seqs:
+            if s < seq:                         # đã gửi hết, chưa kịp xoá
+                self._unlink(s)
+        idx = 0
+        if seq in self._segs:
+            off, idx = self._scan(self._seg_path(seq), stop=off)
+        self._cur = [seq, off, idx]
+        self.pending = sum(n for _, n in self._segs.values()) - idx
+        last = max(self._segs) if self._segs else seq
+        self._open_writer(last)
+        if self.pending:
+            print(f"[SPOOL] {self.pending} events pending in {self.root}")
+
+    def _open_writer(self, seq: int):
+        self._w = open(self._seg_path(seq), "ab")
+        self._w_seq = seq
+        self._segs.setdefault(seq, [0, 0])
+
+    def _unlink(self, seq: int):
+        size, _ = self._segs.pop(seq)
+        self.total_bytes -= size
+        if self._rf is not None and self._rf[0] == seq:
+            self._rf[1].close()
+            self._rf = None
+        try:
+            self._seg_path(seq).unlink()
+        except OSError:
+            pass
+
+    # -------------------- ghi --------------------
+    def append(self, msg) -> bool:
+        kind = KIND_BINARY if isinstance(msg, (bytes, bytearray, memoryview)) else KIND_TEXT
+        data = bytes(msg) if kind == KIND_BINARY else msg.encode("utf-8")
+        rec = _REC.pack(len(data), zlib.crc32(data), kind) + data
+        with self._lock:
+            if len(rec) > self.segment_bytes:
+                self.discarded += 1
+                return False
+            if self._segs[self._w_seq][0] + len(rec) > self.segment_bytes:
+                self._roll()
+            self._w.write(rec)
+            self._w.flush()                     # vào page cache; fsync ở sync() (thread khác)
+            seg = self._segs[self._w_seq]
+            seg[0] += len(rec)
+            seg[1] += 1
+            self.total_bytes += len(rec)
+            self.pending += 1
+            self.appended += 1
+            self._dirty = True
+            while self.total_bytes > self.max_bytes and len(self._segs) > 1:
+                self._drop_oldest()
+        return True
+
+    def _roll(self):
+        # không fsync dưới lock (append chạy trên probe thread): giữ 1 fd, sync() fsync sau
+        self._w.flush()
+        self._unsynced.append(os.dup(self._w.fileno()))
+        self._w.close()
+        self._open_writer(self._w_seq + 1)
+
+    def _drop_oldest(self):
+        # segment cũ nhất luôn chứa cursor (segment đã gửi hết bị xoá ngay ở ack)
+        seq = next(iter(self._segs))
+        lost = self._segs[seq][1] - (self._cur[2] if self._cur[0] == seq else 0)
+        self._unlink(seq)
+        self.discarded += lost
+        self.pending -= lost
+        self._cur = [next(iter(self._segs)), 0, 0]
+        self._save_cursor()
+
+    def sync(self):
+        """fsync segment đang ghi + các segment đã roll (gọi định kỳ ngoài probe thread)."""
+        with self._lock:
+            fds, self._unsynced = self._unsynced, []
+            if self._dirty and self._w is not None:
+                self._dirty = False
+                fds.append(os.dup(self._w.fileno()))    # roll() có thể đóng file trong lúc fsync
+        try:
+            for fd in fds:
+                os.fsync(fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    # -------------------- đọc --------------------
+    def peek(self):
+        """-> (msg, token) của event kế tiếp, hoặc None. Chưa xoá khỏi spool cho tới ack(token)."""
+        with self._lock:
+            while self.pending > 0:
+                seq, off, _ = self._cur
+                size = self._segs[seq][0]
+                if off >= size:
+                    if seq == self._w_seq:
+                        return None
+                    self._unlink(seq)
+                    self._cur = [next(iter(self._segs)), 0, 0]
+                    continue
+                if self._rf is None or self._rf[0] != seq:
+                    if self._rf is not None:
+                        self._rf[1].close()
+                    self._rf = (seq, open(self._seg_path(seq), "rb"))
+                f = self._rf[1]
+                f.seek(off)
+                length, crc, kind = _REC.unpack(f.read(_REC.size))
+                data = f.read(length)
+                token = (seq, off + _REC.size + length)
+                if len(data) != length or zlib.crc32(data) != crc:
+                    self.corrupt += 1           # bỏ bản ghi hỏng, đi tiếp
+                    self._advance(token)
+                    continue
+                return (data if kind == KIND_BINARY else data.decode("utf-8")), token
+            return None
+
+    def ack(self, token):
+        with self._lock:
+            if token[0] != self._cur[0] or token[1] <= self._cur[1]:
+                return                          # segment đã bị xoá vì vượt max_bytes
+            self._advance(token)
+            self.sent += 1
+            if time.monotonic() - self._cursor_saved >= self.cursor_interval_s or self.pending == 0:
+                self._save_cursor()
+
+    def _advance(self, token):
+        seq, off = token
+        self._cur = [seq, off, self._cur[2] + 1]
+        self.pending -= 1
+        if off >= self._segs[seq][0] and seq != self._w_seq:
+            self._unlink(seq)
+            self._cur = [next(iter(self._segs)), 0, 0]
+
+    def _save_cursor(self):
+        tmp = self.root / (CURSOR_NAME + ".tmp")
+        try:
+            tmp.write_text(f"{self._cur[0]} {self._cur[1]}\n")
+            os.replace(tmp, self.root / CURSOR_NAME)
+        except OSError as e:
+            print("[WARN] spool cursor save failed:", e)
+        self._cursor_saved = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": self.pending, "bytes": self.total_bytes, "segments": len(self._segs),
+                    "appended": self.appended, "sent": self.sent, "discarded": self.discarded,
+                    "corrupt": self.corrupt}
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._save_cursor()
+            if self._w is not None:
+                self._w.flush()
+                os.fsync(self._w.fileno())
+                self._w.close()
+                self._w = None
+            if self._rf is not None:
+                self._rf[1].close()
+                self._rf = None
+        self._lockf.close()
+
+
+class SpoolForwarder:
+    """
+    publish(payload) thay cho send_json_threadsafe (gọi từ thread bất kỳ); start(loop) chạy task phát lại
+    trên event loop của WebSocket. get_ws() -> websocket hiện tại hoặc None khi đang nối lại.
+    Đĩa (append/peek/ack/fsync) từ phía loop chạy trên 1 worker riêng -> không chặn loop, giữ thứ tự ghi.
+    Dừng: await aclose() trên loop, hoặc close() từ thread khác.
+    """
+    def __init__(self, spool: EventSpool, get_ws, wire_format: str = WIRE_JSON, rate_kbps: float = 256.0,
+                 rate_msgs_s: float = 20.0, fsync_interval_s: float = 1.0, tag: str = "[SPOOL]"):
+        self.spool = spool
+        self.get_ws = get_ws
+        self.wire_format = check_wire_format(wire_format)
+        self.rate_bps = max(1.0, float(rate_kbps) * 1024.0)
+        self.min_gap_s = 1.0 / max(1e-3, float(rate_msgs_s))
+        self.fsync_interval_s = float(fsync_interval_s)
+        self.tag = tag
+        self.loop = None
+        self.live = 0
+        self.requeued = 0
+        self._wake = None
+        self._task = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-io")
+        self._closed = False
+        self._inflight = set()      # gửi thẳng chưa xong: close() đợi để requeue nếu lỗi
+
+    def start(self, loop):
+        self.loop = loop
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    def publish(self, payload: dict):
+        try:
+            # serialize ngay trên thread gọi (encoder worker), event loop chỉ việc gửi
+            msg = encode_message(payload, self.wire_format)
+        except Exception as e:
+            print(f"{self.tag} encode failed:", e)
+            return
+        ws, loop = self.get_ws(), self.loop
+        if ws is not None and loop is not None and self.spool.pending == 0:
+            fut = asyncio.run_coroutine_threadsafe(ws.send(msg), loop)
+            self._inflight.add(fut)
+            fut.add_done_callback(lambda f, m=msg: self._on_sent(f, m))
+            self.live += 1
+            return
+        self._spool(msg)
+
+    def _on_sent(self, fut, msg):
+        self._inflight.discard(fut)
+        if fut.cancelled() or fut.exception() is not None:
+            # WS rớt giữa chừng: đưa vào spool (có thể sau vài event đã spool -> lệch thứ tự nhẹ).
+            # Callback chạy trên event loop -> ghi đĩa ở worker io
+            self.requeued += 1
+            if not self._closed:
+                self.loop.run_in_executor(self._io, self._spool, msg)
+
+    def _spool(self, msg):
+        self.spool.append(msg)
+        if self.loop is not None and self._wake is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        last_sync = time.monotonic()
+        replayed = 0
+        while True:
+            if time.monotonic() - last_sync >= self.fsync_interval_s:
+                last_sync = time.monotonic()
+                try:
+                    await loop.run_in_executor(self._io, self.spool.sync)
+                except OSError as e:
+                    print(f"{self.tag} fsync failed:", e)
+            ws = self.get_ws()
+            item = await loop.run_in_executor(self._io, self.spool.peek) if ws is not None else None
+            if item is None:
+                if replayed:
+                    print(f"{self.tag} backlog replayed: {replayed} events")
+                    replayed = 0
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.fsync_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            msg, token = item
+            if not replayed:
+                print(f"{self.tag} replaying {self.spool.pending} spooled events")
+            try:
+                await ws.send(msg)
+            except Exception as e:
+                print(f"{self.tag} replay send failed, waiting for reconnect:", e)
+                await asyncio.sleep(1.0)
+                continue
+            await loop.run_in_executor(self._io, self.spool.ack, token)
+            replayed += 1
+            # chừa uplink cho video: nhịp theo KB/s và msg/s
+            await asyncio.sleep(max(len(msg) / self.rate_bps, self.min_gap_s))
+
+    def stats(self) -> dict:
+        return dict(self.spool.stats(), live=self.live, requeued=self.requeued)
+
+    async def aclose(self):
+        """Gọi trên event loop: huỷ task phát lại, đợi nó dừng rồi mới đóng spool."""
+        if self._inflight:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in list(self._inflight)),
+                                 return_exceptions=True)
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await asyncio.wrap_future(self._task)
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 1 worker: các append requeue đã xếp hàng chạy xong trước close
+        await asyncio.get_running_loop().run_in_executor(self._io, self.spool.close)
+        self._io.shutdown(wait=False)
+
+    def close(self, timeout: float = 5.0):
+        """Gọi từ thread khác event loop (loop phải còn chạy). Trên loop dùng await aclose()."""
+        if self.loop is None or not self.loop.is_running():
+            self._closed = True
+            self._io.shutdown(wait=True)
+            self.spool.close()
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.aclose(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"{self.tag} close failed:", e)
+
+
+def make_forwarder(root, get_ws, wire_format: str = WIRE_JSON, tag: str = "[SPOOL]") -> SpoolForwarder:
+    """EventSpool + SpoolForwarder với tham số SPOOL_* trong settings."""
+    from .settings import (SPOOL_MAX_MB, SPOOL_SEGMENT_MB, SPOOL_REPLAY_KBPS, SPOOL_REPLAY_MSGS_S,
+                           SPOOL_FSYNC_S)
+    spool = EventSpool(root, max_bytes=int(SPOOL_MAX_MB * 1024 * 1024),
+                       segment_bytes=int(SPOOL_SEGMENT_MB * 1024 * 1024), cursor_interval_s=SPOOL_FSYNC_S)
+    return SpoolForwarder(spool, get_ws, wire_format=wire_format, rate_kbps=SPOOL_REPLAY_KBPS,
+                          rate_msgs_s=SPOOL_REPLAY_MSGS_S, fsync_interval_s=SPOOL_FSYNC_S, tag=tag)
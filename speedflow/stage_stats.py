@@ -0,0 +1,109 @@
+# speedflow/stage_stats.py
+# Đo thời gian từng stage của đường nóng (probe + encoder) bằng histogram bucket cố định:
+# bucket i chứa mẫu có thời gian trong [2^(i-1), 2^i) µs -> add() chỉ tăng 1 ô đếm, không cấp phát.
+# Định kỳ (interval_s) chụp snapshot (count/mean/max/p50/p90/p99 theo stage) rồi gửi cho các sink
+# (log, publisher WebSocket). Tắt = không tạo StageStats (probe chỉ kiểm tra `if timer`).
+import threading, time
+
+STAGES = ("meta_walk", "homography", "tracks", "speed", "crop", "encode", "publish", "probe_total")
+(ST_META_WALK, ST_HOMOGRAPHY, ST_TRACKS, ST_SPEED,
+ ST_CROP, ST_ENCODE, ST_PUBLISH, ST_TOTAL) = range(len(STAGES))
+N_BUCKETS = 32      # tới ~2^31 µs (~36 phút)
+
+
+class StageStats:
+    def __init__(self, interval_s: float = 10.0, stages=STAGES):
+        self.stages = tuple(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        self.interval_s = float(interval_s)
+        self.sinks = []
+        self._lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        n = len(self.stages)
+        self.counts = [[0] * N_BUCKETS for _ in range(n)]
+        self.total_us = [0.0] * n
+        self.max_us = [0.0] * n
+        self.frames = 0
+        self.t_start = now
+
+    def add_sink(self, fn):
+        """fn(snapshot: dict) -> None, gọi mỗi interval_s."""
+        self.sinks.append(fn)
+
+    def add(self, stage: int, dt_s: float):
+        """stage: index trong self.stages (dùng self.index[name] khi khởi tạo), dt_s: giây."""
+        us = dt_s * 1e6
+        b = int(us).bit_length()
+        if b >= N_BUCKETS:
+            b = N_BUCKETS - 1
+        with self._lock:
+            self.counts[stage][b] += 1
+            self.total_us[stage] += us
+            if us > self.max_us[stage]:
+                self.max_us[stage] = us
+
+    def frame_done(self, n_frames: int = 1):
+        """Gọi cuối mỗi batch: đếm frame, tới hạn thì chụp snapshot + gửi sink."""
+        self.frames += n_frames
+        now = time.monotonic()
+        if now - self.t_start < self.interval_s:
+            return
+        snap = self.snapshot(reset=True, now=now)
+        for fn in self.sinks:
+            try:
+                fn(snap)
+            except Exception as e:
+                print("[WARN] stage stats sink failed:", e)
+
+    @staticmethod
+    def _percentile_us(counts, n, q):
+        # cận trên của bucket chứa mẫu thứ q*n (sai số <= 2x, đủ để thấy stage nào chiếm thời gian)
+        target = q * n
+        acc = 0
+        for b, c in enumerate(counts):
+            acc += c
+            if acc >= target:
+                return float(1 << b)
+        return float(1 << (len(counts) - 1))
+
+    def snapshot(self, reset: bool = False, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            counts = [list(c) for c in self.counts]
+            total_us = list(self.total_us)
+            max_us = list(self.max_us)
+            frames, t_start = self.frames, self.t_start
+            if reset:
+                self._reset(now)
+        window = max(now - t_start, 1e-9)
+        stages = {}
+        for i, name in enumerate(self.stages):
+            n = sum(counts[i])
+            if not n:
+                continue
+            stages[name] = {
+                "count": n,
+                "mean_us": round(total_us[i] / n, 1),
+                "max_us": round(max_us[i], 1),
+                "p50_us": self._percentile_us(counts[i], n, 0.50),
+                "p90_us": self._percentile_us(counts[i], n, 0.90),
+                "p99_us": self._percentile_us(counts[i], n, 0.99),
+                "busy_pct": round(100.0 * total_us[i] / (window * 1e6), 2),
+            }
+        return {
+            "type": "probe_stats",
+            "ts": round(time.time(), 3),
+            "window_s": round(window, 2),
+            "frames": frames,
+            "fps": round(frames / window, 2),
+            "stages": stages,
+        }
+
+
+def format_snapshot(snap: dict) -> str:
+    parts = [f"[STATS] {snap['fps']:.1f} fps/{snap['window_s']:.0f}s"]
+    for name, st in snap["stages"].items():
+        parts.append(f"{name}={st['mean_us']:.0f}us(p99<{st['p99_us']:.0f})")
+    return " ".join(parts)
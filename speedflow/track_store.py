@@ -0,0 +1,200 @@
+# speedflow/track_store.py
+# Bộ nhớ trạng thái track dạng cột (mảng NumPy cấp phát sẵn), thay cho các dict/defaultdict
+# trong SpeedProbe. Mỗi track_id được gán 1 slot; slot không thấy quá ttl_frames sẽ được thu hồi.
+# Ngoài trạng thái tính tốc độ, slot còn giữ thống kê chuyến đi (trip) của xe cho tới khi track kết thúc.
+import numpy as np
+
+
+class TrackStore:
+    """
+    - track_id -> slot (0..max_tracks-1), mọi trạng thái là 1 cột mảng theo slot
+    - Lịch sử y_world và tốc độ là ring buffer cố định theo slot
+    - evict_stale(frame_no) thu hồi slot không thấy > ttl_frames
+    - Khi đầy: thu hồi slot lâu không thấy nhất -> bộ nhớ không vượt max_tracks
+    - on_release(slot) được gọi TRƯỚC khi slot bị thu hồi (để xuất trip record)
+    """
+    def __init__(self, max_tracks: int = 512, hist_len: int = 25, speed_len: int = 5,
+                 ttl_frames: int = 50, trip_len: int = 64, on_release=None):
+        self.max_tracks = int(max_tracks)
+        self.hist_len   = max(2, int(hist_len))
+        self.speed_len  = max(1, int(speed_len))
+        self.ttl_frames = max(1, int(ttl_frames))
+        self.trip_len   = max(1, int(trip_len))
+        self.on_release = on_release
+
+        cap = self.max_tracks
+        self.slot_of   = {}                                   # track_id -> slot
+        self.track_ids = np.full(cap, -1, dtype=np.int64)     # slot -> track_id (-1 = trống)
+        self._free     = list(range(cap - 1, -1, -1))         # stack slot trống
+
+        # ring buffer vị trí y_world (cửa sổ ~1s) + frame_num và PTS (giây, NaN = không có) của từng mẫu
+        self.hist       = np.zeros((cap, self.hist_len), dtype=np.float32)
+        self.hist_frame = np.zeros((cap, self.hist_len), dtype=np.int64)
+        self.hist_t     = np.zeros((cap, self.hist_len), dtype=np.float64)
+        self.hist_head  = np.zeros(cap, dtype=np.int32)       # vị trí ghi tiếp theo
+        self.hist_count = np.zeros(cap, dtype=np.int32)
+
+        # ring buffer tốc độ cho median smoothing
+        self.speeds       = np.zeros((cap, self.speed_len), dtype=np.float32)
+        self.speed_head   = np.zeros(cap, dtype=np.int32)
+        self.speed_count  = np.zeros(cap, dtype=np.int32)
+
+        self.birth_frame       = np.zeros(cap, dtype=np.int64)
+        self.last_seen_frame   = np.zeros(cap, dtype=np.int64)
+        self.last_update_frame = np.zeros(cap, dtype=np.int64)
+        self.last_alert_ts     = np.zeros(cap, dtype=np.float64)
+        self.snap_count        = np.zeros(cap, dtype=np.int32)
+        self.last_area         = np.zeros(cap, dtype=np.float32)  # 0 = chưa có
+        self.speed_text        = [""] * cap
+        self.snap_path         = [None] * cap    # ảnh bằng chứng đã lưu (nếu có)
+        self.evidence          = [None] * cap    # (ts, km/h, crop BGR) của lần đo hợp lệ đầu (probe ghi)
+
+        # thống kê trip: class, thời điểm + vị trí world lúc vào/ra, tốc độ
+        self.class_id    = np.zeros(cap, dtype=np.int32)
+        self.zone        = np.full(cap, -1, dtype=np.int16)   # zone ROI lúc vào (-1 = không có)
+        self.first_ts    = np.zeros(cap, dtype=np.float64)
+        self.last_ts     = np.zeros(cap, dtype=np.float64)
+        self.entry_xy    = np.zeros((cap, 2), dtype=np.float32)
+        self.exit_xy     = np.zeros((cap, 2), dtype=np.float32)
+        self.speed_sum   = np.zeros(cap, dtype=np.float64)
+        self.speed_max   = np.zeros(cap, dtype=np.float32)
+        self.speed_n     = np.zeros(cap, dtype=np.int32)
+        self.last_speed  = np.zeros(cap, dtype=np.float32)  # tốc độ (đã làm mượt) của phép đo hợp lệ cuối
+        self.trip_speeds = np.zeros((cap, self.trip_len), dtype=np.float32)  # ring cho median
+
+        self.evicted_total = 0
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    # -------------------- slot --------------------
+    def slot(self, track_id, frame_no: int) -> int:
+        """Trả slot của track_id (cấp phát nếu mới) và đánh dấu last_seen."""
+        s = self.slot_of.get(track_id)
+        if s is None:
+            s = self._alloc(track_id, frame_no)
+        self.last_seen_frame[s] = frame_no
+        return s
+
+    def _alloc(self, track_id, frame_no: int) -> int:
+        if not self._free:
+            # đầy: thu hồi slot lâu không thấy nhất
+            live = self.track_ids >= 0
+            oldest = int(np.argmin(np.where(live, self.last_seen_frame, np.iinfo(np.int64).max)))
+            self.release(oldest)
+        s = self._free.pop()
+        self.slot_of[track_id] = s
+        self.track_ids[s] = track_id
+        self.hist_head[s] = 0
+        self.hist_count[s] = 0
+        self.speed_head[s] = 0
+        self.speed_count[s] = 0
+        self.birth_frame[s] = frame_no
+        self.last_seen_frame[s] = frame_no
+        # giống defaultdict cũ: lần cập nhật đầu tiên được phép ngay
+        self.last_update_frame[s] = frame_no - self.hist_len
+        self.last_alert_ts[s] = 0.0
+        self.snap_count[s] = 0
+        self.last_area[s] = 0.0
+        self.speed_text[s] = ""
+        self.snap_path[s] = None
+        self.evidence[s] = None
+        self.first_ts[s] = 0.0
+        self.last_ts[s] = 0.0
+        self.zone[s] = -1
+        self.speed_sum[s] = 0.0
+        self.speed_max[s] = 0.0
+        self.speed_n[s] = 0
+        self.last_speed[s] = 0.0
+        return s
+
+    def release(self, s: int):
+        tid = int(self.track_ids[s])
+        if tid < 0:
+            return
+        if self.on_release is not None:
+            try:
+                self.on_release(s)
+            except Exception as e:
+                print("[WARN] track on_release failed:", e)
+        self.slot_of.pop(tid, None)
+        self.track_ids[s] = -1
+        self.evidence[s] = None          # không giữ crop của slot trống
+        self._free.append(s)
+        self.evicted_total += 1
+
+    def evict_stale(self, frame_no: int):
+        """Thu hồi các slot không thấy > ttl_frames. Trả về list slot vừa thu hồi."""
+        stale = np.flatnonzero((self.track_ids >= 0) &
+                               (frame_no - self.last_seen_frame > self.ttl_frames))
+        for s in stale:
+            self.release(int(s))
+        return stale
+
+    # -------------------- lịch sử vị trí --------------------
+    def push_position(self, s: int, y_world: float, frame_no: int = 0, t: float = np.nan):
+        h = self.hist_head[s]
+        self.hist[s, h] = y_world
+        self.hist_frame[s, h] = frame_no
+        self.hist_t[s, h] = t
+        self.hist_head[s] = (h + 1) % self.hist_len
+        if self.hist_count[s] < self.hist_len:
+            self.hist_count[s] += 1
+
+    def hist_ends(self, s: int):
+        """(cũ nhất, mới nhất) trong ring buffer vị trí."""
+        n = int(self.hist_count[s])
+        head = int(self.hist_head[s])
+        first = (head - n) % self.hist_len
+        last = (head - 1) % self.hist_len
+        return float(self.hist[s, first]), float(self.hist[s, last])
+
+    def hist_span_frames(self, s: int) -> int:
+        """Số frame giữa mẫu cũ nhất và mới nhất trong ring buffer vị trí."""
+        n = int(self.hist_count[s])
+        head = int(self.hist_head[s])
+        return int(self.hist_frame[s, (head - 1) % self.hist_len] - self.hist_frame[s, (head - n) % self.hist_len])
+
+    def hist_span_s(self, s: int) -> float:
+        """Thời gian (PTS) giữa mẫu cũ nhất và mới nhất; NaN nếu 1 trong 2 mẫu không có PTS."""
+        n = int(self.hist_count[s])
+        head = int(self.hist_head[s])
+        return float(self.hist_t[s, (head - 1) % self.hist_len] - self.hist_t[s, (head - n) % self.hist_len])
+
+    # -------------------- tốc độ --------------------
+    def push_speed(self, s: int, speed_kmh: float):
+        h = self.speed_head[s]
+        self.speeds[s, h] = speed_kmh
+        self.speed_head[s] = (h + 1) % self.speed_len
+        if self.speed_count[s] < self.speed_len:
+            self.speed_count[s] += 1
+
+    def speed_median(self, s: int) -> float:
+        n = int(self.speed_count[s])
+        return float(np.median(self.speeds[s, :n]))
+
+    # -------------------- trip --------------------
+    def observe(self, s: int, ts: float, x_world: float, y_world: float, class_id: int, zone: int = -1):
+        """Cập nhật thời điểm/vị trí vào-ra của trip (gọi mỗi frame thấy xe)."""
+        if self.first_ts[s] == 0.0:
+            self.first_ts[s] = ts
+            self.entry_xy[s] = (x_world, y_world)
+            self.class_id[s] = class_id
+            self.zone[s] = zone
+        self.last_ts[s] = ts
+        self.exit_xy[s] = (x_world, y_world)
+
+    def push_trip_speed(self, s: int, speed_kmh: float):
+        n = int(self.speed_n[s])
+        self.trip_speeds[s, n % self.trip_len] = speed_kmh
+        self.speed_n[s] = n + 1
+        self.last_speed[s] = speed_kmh
+        self.speed_sum[s] += speed_kmh
+        if speed_kmh > self.speed_max[s]:
+            self.speed_max[s] = speed_kmh
+
+    def trip_speed_median(self, s: int):
+        n = min(int(self.speed_n[s]), self.trip_len)
+        if n == 0:
+            return None
+        return float(np.median(self.trip_speeds[s, :n]))
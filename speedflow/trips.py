@@ -0,0 +1,51 @@
+# speedflow/trips.py
+# Trip record: 1 bản ghi gọn cho mỗi xe khi track kết thúc (thay cho log từng frame).
+from dataclasses import dataclass, asdict
+from typing import Optional, Tuple
+
+
+@dataclass
+class TripRecord:
+    track_id: int
+    class_id: int
+    first_ts: float                  # epoch giây
+    last_ts: float
+    entry_xy: Tuple[float, float]    # vị trí world (m) lúc vào vùng homography
+    exit_xy: Tuple[float, float]     # vị trí world (m) lúc ra
+    mean_kmh: Optional[float]
+    max_kmh: Optional[float]
+    median_kmh: Optional[float]
+    samples: int                     # số phép đo tốc độ hợp lệ
+    camera_id: str = ""
+    exit_kmh: Optional[float] = None # tốc độ ở phép đo hợp lệ cuối (Kalman / median) lúc rời vùng, cho handoff
+    snapshot: Optional[str] = None   # path ảnh overspeed đã lưu của track (nếu có)
+    evidence: Optional[str] = None   # path ảnh bằng chứng của trip (TRIP_EVIDENCE, = snapshot nếu đã có)
+    zone: Optional[str] = None       # zone ROI lúc vào (zones.py)
+
+    def to_payload(self) -> dict:
+        d = {"type": "trip", **asdict(self)}
+        d["entry_xy"] = [round(v, 2) for v in self.entry_xy]
+        d["exit_xy"] = [round(v, 2) for v in self.exit_xy]
+        return d
+
+
+def trip_from_slot(tracks, s: int, camera_id: str = "", zone_names=None) -> TripRecord:
+    """Đọc thống kê trip của slot s trong TrackStore (zone_names: tên zone theo chỉ số)."""
+    n = int(tracks.speed_n[s])
+    z = int(tracks.zone[s])
+    return TripRecord(
+        track_id=int(tracks.track_ids[s]),
+        class_id=int(tracks.class_id[s]),
+        first_ts=round(float(tracks.first_ts[s]), 3),
+        last_ts=round(float(tracks.last_ts[s]), 3),
+        entry_xy=(float(tracks.entry_xy[s, 0]), float(tracks.entry_xy[s, 1])),
+        exit_xy=(float(tracks.exit_xy[s, 0]), float(tracks.exit_xy[s, 1])),
+        mean_kmh=round(float(tracks.speed_sum[s]) / n, 1) if n else None,
+        max_kmh=round(float(tracks.speed_max[s]), 1) if n else None,
+        median_kmh=round(tracks.trip_speed_median(s), 1) if n else None,
+        samples=n,
+        camera_id=camera_id,
+        exit_kmh=round(float(tracks.last_speed[s]), 1) if n else None,
+        snapshot=tracks.snap_path[s],
+        zone=zone_names[z] if zone_names and 0 <= z < len(zone_names) else None,
+    )
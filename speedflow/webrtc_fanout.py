@@ -0,0 +1,172 @@
+# speedflow/webrtc_fanout.py
+# Nhiều browser xem cùng 1 camera với 1 lần encode:
+#   ... -> encoder -> rtph264pay -> tee (<name>-rtp_tee) -> [queue leaky -> webrtcbin] x N viewer
+# Viewer được thêm/bớt lúc pipeline đang chạy theo signaling riêng từng viewer (peer id do signaling
+# server cấp: viewer_join / viewer_leave, offer/ice gửi kèm "to", answer/ice nhận kèm "from").
+# Viewer mới kết nối xong -> yêu cầu encoder ra keyframe (GstForceKeyUnit) thay vì chờ iframeinterval.
+import itertools, threading
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+from gi.repository import Gst, GLib, GstWebRTC, GstSdp
+
+import speedflow.settings as S
+
+_NAMES = itertools.count(1)
+
+
+class _Viewer:
+    __slots__ = ("peer_id", "queue", "webrtc", "teepad")
+
+    def __init__(self, peer_id, queue, webrtc, teepad):
+        self.peer_id = peer_id
+        self.queue = queue
+        self.webrtc = webrtc
+        self.teepad = teepad
+
+
+class WebRTCFanout:
+    """
+    send(msg: dict) gửi signaling tới viewer msg["to"] (thread-safe, gọi từ thread GStreamer).
+    add_viewer / remove_viewer / handle(peer_id, msg) gọi từ thread bất kỳ (event loop WS).
+    """
+    def __init__(self, pipeline, rtp_tee, send, max_viewers: int = S.WEBRTC_MAX_VIEWERS,
+                 stun_server: str = S.WEBRTC_STUN, queue_ms: float = S.WEBRTC_VIEWER_QUEUE_MS):
+        if rtp_tee is None:
+            raise ValueError("Pipeline has no WebRTC RTP tee (OutputSpec(OUT_WEBRTC, fanout=True))")
+        self.pipeline = pipeline
+        self.tee = rtp_tee
+        self.send = send
+        self.max_viewers = max(1, int(max_viewers))
+        self.stun_server = stun_server
+        self.queue_ns = int(float(queue_ms) * 1e6)
+        self.viewers = {}
+        self._lock = threading.Lock()
+        self.joined = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.viewers)
+
+    def add_viewer(self, peer_id) -> bool:
+        peer_id = int(peer_id)
+        self.remove_viewer(peer_id)                  # browser nối lại với cùng id
+        with self._lock:
+            if len(self.viewers) >= self.max_viewers:
+                self.rejected += 1
+                print(f"[WEBRTC] viewer {peer_id} rejected: {len(self.viewers)}/{self.max_viewers} viewers")
+                return False
+            tag = f"viewer{peer_id}_{next(_NAMES)}"
+            q = Gst.ElementFactory.make("queue", f"{tag}-queue")
+            wb = Gst.ElementFactory.make("webrtcbin", tag)
+            if not q or not wb:
+                raise RuntimeError("Failed to create queue/webrtcbin for viewer")
+            # viewer chậm/mạng kém: bỏ gói RTP cũ của riêng nó, không chặn tee (viewer khác, encoder)
+            q.set_property("leaky", 2)
+            q.set_property("max-size-buffers", 0)
+            q.set_property("max-size-bytes", 0)
+            q.set_property("max-size-time", self.queue_ns)
+            wb.set_property("stun-server", self.stun_server)
+            wb.set_property("bundle-policy", GstWebRTC.WebRTCBundlePolicy.MAX_BUNDLE)
+            wb.connect("on-negotiation-needed", self._on_negotiation_needed, peer_id)
+            wb.connect("on-ice-candidate", self._on_ice_candidate, peer_id)
+            wb.connect("notify::connection-state", self._on_connection_state, peer_id)
+            self.pipeline.add(q)
+            self.pipeline.add(wb)
+            sinkpad = wb.get_request_pad("sink_%u")
+            if not sinkpad or q.get_static_pad("src").link(sinkpad) != Gst.PadLinkReturn.OK:
+                raise RuntimeError("Failed to link viewer queue -> webrtcbin")
+            wb.sync_state_with_parent()
+            q.sync_state_with_parent()
+            teepad = self.tee.get_request_pad("src_%u")
+            if teepad.link(q.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+                raise RuntimeError("Failed to link RTP tee -> viewer queue")
+            self.viewers[peer_id] = _Viewer(peer_id, q, wb, teepad)
+            self.joined += 1
+            print(f"[WEBRTC] viewer {peer_id} joined ({len(self.viewers)} viewers)")
+        return True
+
+    def remove_viewer(self, peer_id):
+        with self._lock:
+            v = self.viewers.pop(int(peer_id), None)
+        if v is None:
+            return
+        # tháo khỏi tee khi pad rảnh (không có buffer đang đi qua), dọn element trên main loop
+        v.teepad.add_probe(Gst.PadProbeType.IDLE, self._unlink, v)
+        print(f"[WEBRTC] viewer {v.peer_id} left ({len(self.viewers)} viewers)")
+
+    def remove_all(self):
+        for peer_id in list(self.viewers):
+            self.remove_viewer(peer_id)
+
+    def _unlink(self, teepad, info, v):
+        teepad.unlink(v.queue.get_static_pad("sink"))
+        self.tee.release_request_pad(teepad)
+        GLib.idle_add(self._dispose, v)
+        return Gst.PadProbeReturn.REMOVE
+
+    def _dispose(self, v):
+        for e in (v.queue, v.webrtc):
+            e.set_state(Gst.State.NULL)
+            self.pipeline.remove(e)
+        return False
+
+    # -------------------- signaling --------------------
+    def handle(self, peer_id, msg: dict):
+        """answer / ice từ viewer peer_id."""
+        v = self.viewers.get(int(peer_id))
+        if v is None:
+            return
+        t = msg.get("type")
+        if t == "answer":
+            res, sdpmsg = GstSdp.SDPMessage.new_from_text(msg["sdp"])
+            if res != GstSdp.SDPResult.OK:
+                print(f"[WEBRTC] viewer {peer_id}: SDP parse failed")
+                return
+            answer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.ANSWER, sdpmsg)
+            v.webrtc.emit("set-remote-description", answer, None)
+        elif t == "ice":
+            cand = msg.get("candidate") or {}
+            if cand.get("candidate"):
+                v.webrtc.emit("add-ice-candidate", int(cand.get("sdpMLineIndex") or 0), cand["candidate"])
+
+    def _on_negotiation_needed(self, wb, peer_id):
+        p = Gst.Promise.new_with_change_func(self._on_offer_created, wb, peer_id)
+        wb.emit("create-offer", None, p)
+
+    def _on_offer_created(self, promise, wb, peer_id):
+        offer = promise.get_reply().get_value("offer")
+        wb.emit("set-local-description", offer, None)
+        # "to": server chỉ gửi cho viewer này
+        self.send({"type": "offer", "to": peer_id, "sdp": offer.sdp.as_text()})
+
+    def _on_ice_candidate(self, wb, mline, candidate, peer_id):
+        self.send({"type": "ice", "to": peer_id,
+                   "candidate": {"candidate": candidate, "sdpMLineIndex": int(mline)}})
+
+    def _on_connection_state(self, wb, pspec, peer_id):
+        state = wb.get_property("connection-state")
+        if state == GstWebRTC.WebRTCPeerConnectionState.CONNECTED:
+            self._force_key_unit(peer_id, wb)
+        elif state == GstWebRTC.WebRTCPeerConnectionState.FAILED:
+            GLib.idle_add(self._remove_idle, peer_id, wb)
+
+    def _remove_idle(self, peer_id, wb):
+        v = self.viewers.get(peer_id)
+        if v is not None and v.webrtc is wb:       # không gỡ nhầm viewer mới cùng id
+            self.remove_viewer(peer_id)
+        return False
+
+    def _force_key_unit(self, peer_id, wb):
+        v = self.viewers.get(peer_id)
+        if v is None or v.webrtc is not wb:
+            return
+        s = Gst.Structure.new_empty("GstForceKeyUnit")
+        s.set_value("all-headers", True)
+        # upstream event: queue sink -> tee -> payloader -> encoder
+        v.queue.get_static_pad("sink").push_event(Gst.Event.new_custom(Gst.EventType.CUSTOM_UPSTREAM, s))
+
+    def stats(self) -> dict:
+        return {"viewers": sorted(self.viewers), "joined": self.joined, "rejected": self.rejected,
+                "max_viewers": self.max_viewers}
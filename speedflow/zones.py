@@ -0,0 +1,75 @@
+# speedflow/zones.py
+# Lọc ROI ngay trong probe thay cho nvdsanalytics: kiểm tra point-in-polygon (ray casting) cho MỌI
+# footpoint của batch với MỌI cạnh của MỌI zone trong 1 phép tính numpy (N điểm x E cạnh).
+# Zone = polygon pixel (toạ độ mux, cùng hệ với SOURCE của homography). Mặc định 1 zone "roi" = SOURCE;
+# nhiều zone đặt tên: khoá ZONES trong HOMO_YML, vd
+#   ZONES:
+#     lane_in:  [[417, 262], [590, 265], [650, 433], [181, 434]]
+#     lane_out: [[590, 265], [767, 269], [1118, 433], [650, 433]]
+import numpy as np
+import yaml
+
+DEFAULT_ZONE = "roi"
+
+
+class ZoneSet:
+    """
+    zones: tên -> polygon (K, 2) pixel, K >= 3 (thứ tự khai báo = ưu tiên khi các zone chồng nhau).
+    zone_index(points) -> (N,) chỉ số zone đầu tiên chứa điểm, -1 = ngoài mọi zone.
+    """
+    def __init__(self, zones: dict):
+        if not zones:
+            raise ValueError("ZoneSet needs at least one zone")
+        self.names = []
+        x1, y1, x2, y2, starts = [], [], [], [], []
+        n_edges = 0
+        for name, poly in zones.items():
+            p = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+            if len(p) < 3:
+                raise ValueError(f"Zone {name!r} needs >= 3 points, got {len(p)}")
+            q = np.roll(p, -1, axis=0)          # cạnh i: p[i] -> p[i+1] (khép kín)
+            x1.append(p[:, 0]); y1.append(p[:, 1]); x2.append(q[:, 0]); y2.append(q[:, 1])
+            starts.append(n_edges)
+            n_edges += len(p)
+            self.names.append(str(name))
+        self.x1, self.y1 = np.concatenate(x1), np.concatenate(y1)
+        y2 = np.concatenate(y2)
+        dy = y2 - self.y1
+        # x tại giao điểm = x1 + (y - y1) * slope; cạnh nằm ngang không bao giờ được tính (điều kiện y)
+        self.slope = np.where(dy != 0, (np.concatenate(x2) - self.x1) / np.where(dy != 0, dy, 1.0), 0.0)
+        self.y2 = y2
+        self.starts = np.asarray(starts, dtype=np.intp)   # cạnh của mỗi zone liền nhau -> reduceat
+        self._zone_ids = np.arange(len(self.names), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def inside(self, points) -> np.ndarray:
+        """(N, 2) pixel -> (N, Z) bool."""
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(pts) == 0:
+            return np.zeros((0, len(self.names)), dtype=bool)
+        x, y = pts[:, 0:1], pts[:, 1:2]
+        # tia ngang sang phải từ điểm cắt cạnh nào (N, E)
+        cross = ((self.y1 > y) != (self.y2 > y)) & (x < self.x1 + (y - self.y1) * self.slope)
+        # số lần cắt của từng zone: lẻ = trong
+        return (np.add.reduceat(cross, self.starts, axis=1) & 1).astype(bool)
+
+    def zone_index(self, points) -> np.ndarray:
+        ins = self.inside(points)
+        if ins.shape[1] == 1:
+            return np.where(ins[:, 0], 0, -1).astype(np.int32)
+        return np.where(ins.any(axis=1), ins.argmax(axis=1), -1).astype(np.int32)
+
+    def name(self, index: int):
+        return self.names[index] if 0 <= index < len(self.names) else None
+
+
+def load_zones(yml_path: str, roi_points=None) -> ZoneSet:
+    """ZONES trong HOMO_YML (nếu có), không thì 1 zone "roi" = roi_points (mặc định SOURCE)."""
+    with open(yml_path, "r") as f:
+        d = yaml.safe_load(f)
+    zones = d.get("ZONES")
+    if zones:
+        return ZoneSet(zones)
+    return ZoneSet({DEFAULT_ZONE: d["SOURCE"] if roi_points is None else roi_points})
@@ -0,0 +1,42 @@
+# tests/test_event_index.py
+# Event đến trễ (trip, phát lại từ spool) phải được index đúng ts, không bị kẹp về ts mới nhất.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "webrtc"))
+
+from event_index import CameraRing, EventIndex
+
+
+def _ts(ring):
+    return [float(x) for a, b in ring._segments() for x in ring.ts[a:b]]
+
+
+def test_late_event_is_inserted_in_order():
+    r = CameraRing(8)
+    for ts in (10.0, 11.0, 12.0, 13.0):
+        r.append(ts, 50.0, 0, {"ts": ts})
+    r.append(11.5, 50.0, 1, {"ts": 11.5})
+    assert _ts(r) == [10.0, 11.0, 11.5, 12.0, 13.0]
+    assert [e["ts"] for _, e in r.query(11.2, 11.8)] == [11.5]
+    assert r.late == 1
+
+
+def test_late_event_when_ring_is_full_and_wrapped():
+    r = CameraRing(4)
+    for ts in (1.0, 2.0, 3.0, 4.0, 5.0, 6.0):     # đã quay vòng
+        r.append(ts, 0.0, 0, {"ts": ts})
+    r.append(4.5, 0.0, 0, {"ts": 4.5})          # bỏ event cũ nhất (3.0)
+    assert _ts(r) == [4.0, 4.5, 5.0, 6.0]
+    r.append(0.5, 0.0, 0, {"ts": 0.5})          # cũ hơn mọi event đang giữ
+    assert _ts(r) == [4.0, 4.5, 5.0, 6.0]
+
+
+def test_trip_query_uses_its_own_time():
+    idx = EventIndex(capacity_per_camera=16)
+    idx.ingest("cam1", {"type": "overspeed", "epoch": 1000.0, "speed_kmh": 90})
+    idx.ingest("cam1", {"type": "overspeed", "epoch": 1003.0, "speed_kmh": 95})
+    # trip của xe rời vùng lúc 1001.5, xuất sau overspeed 1003.0
+    idx.ingest("cam1", {"type": "trip", "first_ts": 998.0, "last_ts": 1001.5, "max_kmh": 70})
+    rows = idx.query(["cam1"], 1001.0, 1002.0)
+    assert [r["type"] for r in rows] == ["trip"]
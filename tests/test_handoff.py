@@ -0,0 +1,70 @@
+# tests/test_handoff.py
+# HandoffMatcher trên stream tổng hợp: ghép A -> B trong cửa sổ, lọc class, hết hạn bucket (min-heap).
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "webrtc"))
+
+from handoff import HandoffMatcher, Link
+
+# A -> B 300 m, ra ở A lúc 100 s với 72 km/h (20 m/s): t_pred = 115, cửa sổ [~109.1, ~125.1]
+LINK = Link("A", "B", 300.0, tolerance=0.35, slack_s=2.0)
+
+
+def _trip(track_id, first_ts, last_ts, class_id=2, kmh=72.0):
+    return {"track_id": track_id, "class_id": class_id, "first_ts": first_ts, "last_ts": last_ts,
+            "median_kmh": kmh, "exit_kmh": kmh}
+
+
+def _matcher():
+    m = HandoffMatcher([LINK], bucket_s=2.0, lateness_s=120.0)
+    gid, match = m.ingest_trip("A", _trip(1, 95.0, 100.0))
+    assert match is None
+    return m, gid
+
+
+def test_match_inside_window():
+    m, gid = _matcher()
+    (p,) = m.buckets["B"][m._bucket(115.0)]
+    assert p.t_lo < 115.0 < p.t_hi and abs(p.t_pred - 115.0) < 1e-9
+    gid_b, match = m.ingest_trip("B", _trip(77, 116.0, 120.0))
+    assert match is not None and gid_b == gid
+    assert (match.from_cam, match.from_track, match.to_cam, match.to_track) == ("A", 1, "B", 77)
+    assert abs(match.travel_s - 16.0) < 1e-9 and abs(match.link_kmh - 300.0 / 16.0 * 3.6) < 1e-9
+    assert m.stats()["matched"] == 1 and m.stats()["pending"] == 0
+    # exit đã ghép không được dùng lại
+    assert m.match_entry("B", _trip(78, 116.5, 121.0)) is None
+
+
+def test_class_mismatch_is_rejected():
+    m, _ = _matcher()
+    assert m.match_entry("B", _trip(77, 115.0, 120.0, class_id=7)) is None
+    loose = HandoffMatcher([LINK], strict_class=False)
+    loose.add_exit("A", _trip(1, 95.0, 100.0))
+    assert loose.match_entry("B", _trip(77, 115.0, 120.0, class_id=7)) is not None
+
+
+def test_no_match_outside_window():
+    m, _ = _matcher()
+    (p,) = m.buckets["B"][m._bucket(115.0)]
+    for t in (p.t_lo - 0.5, p.t_hi + 0.5, 104.0, 140.0):
+        assert m.match_entry("B", _trip(77, t, t + 3.0)) is None
+    assert m.stats()["pending"] == 1 and m.stats()["matched"] == 0
+
+
+def test_expiry_counts_multi_bucket_exit_once():
+    m, _ = _matcher()
+    (p,) = m.buckets["B"][m._bucket(115.0)]
+    first, last = m._bucket(p.t_lo), m._bucket(p.t_hi)
+    assert last - first >= 3                             # exit nằm ở nhiều bucket
+    # watermark làm hết hạn 1 phần bucket của exit: chưa tính expired
+    m.add_exit("A", _trip(2, 200.0, (first + 2) * m.bucket_s + m.lateness_s))
+    assert m.stats()["expired"] == 0 and m.stats()["pending"] == 2
+    assert min(m.buckets["B"]) == first + 2
+    # qua bucket cuối: expired đúng 1 lần
+    m.add_exit("A", _trip(3, 400.0, (last + 1) * m.bucket_s + m.lateness_s))
+    assert m.stats()["expired"] == 1 and m.stats()["pending"] == 2
+    assert all(b > last for b in m.buckets["B"])
+    m.add_exit("A", _trip(4, 900.0, 1000.0))              # 2 exit sau cũng hết hạn, không đếm lại exit đầu
+    assert m.stats()["expired"] == 3 and m.stats()["pending"] == 1
+    assert len(m._expiry) == len(m.buckets["B"])
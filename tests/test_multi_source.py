@@ -0,0 +1,58 @@
+# tests/test_multi_source.py
+# MultiSourceSpeed không cần DeepStream: 2 nguồn, meta giả (SimpleNamespace), cùng track_id ở cả 2 nguồn
+# -> homography, ROI và trạng thái track phải tách riêng theo source_id.
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from speedflow.homography import ViewTransformer
+from speedflow.speed_core import MultiSourceSpeed, SourceConfig
+from speedflow.zones import ZoneSet
+
+FPS = 25.0
+PX = np.array([[0, 0], [1000, 0], [1000, 1000], [0, 1000]], dtype=np.float32)
+
+
+def _source(source_id, metres, zone):
+    # 1000 px = `metres` m theo cả 2 trục
+    vt = ViewTransformer(PX, PX * (metres / 1000.0))
+    return SourceConfig(source_id, f"cam{source_id}", vt, PX, fps=FPS, zones=ZoneSet({"roi": zone}))
+
+
+def _obj(track_id, cx, bottom):
+    return SimpleNamespace(object_id=track_id, class_id=2, confidence=0.9,
+                           rect_params=SimpleNamespace(left=cx - 20.0, top=bottom - 40.0, width=40.0, height=40.0))
+
+
+def test_two_sources_keep_separate_state():
+    measured, trips = {}, []
+    core = MultiSourceSpeed(
+        [_source(0, 50.0, [[0, 0], [500, 0], [500, 1000], [0, 1000]]),     # 0.05 m/px, ROI nửa trái
+         _source(1, 100.0, PX)],                                            # 0.1 m/px, ROI cả ảnh
+        estimator="window", timebase="frame",
+        on_measure=lambda src, slot, tid, kmh, *a: measured.setdefault((src.camera_id, tid), []).append(kmh),
+        on_trip=lambda rec, src, slot: trips.append(rec))
+    for f in range(80):
+        y = 100.0 + 10.0 * f                  # 10 px/frame = 250 px/s ở cả 2 nguồn
+        texts = core.process([
+            (0, f, f / FPS, "", [_obj(7, 250.0, y), _obj(8, 750.0, y)], None, None),   # #8 ngoài ROI cam0
+            (1, f, f / FPS, "", [_obj(7, 750.0, y)], None, None),
+        ])
+        assert texts[0][1] is None and texts[1][0] is not None
+    assert core.outside_roi == 80
+    # cùng track_id 7, mỗi nguồn 1 slot trong TrackStore riêng
+    for sid in (0, 1):
+        assert list(core[sid].tracks.slot_of) == [7]
+    assert 8 not in core[0].tracks.slot_of
+    # homography riêng: 250 px/s = 12.5 m/s (45 km/h) ở cam0, 25 m/s (90 km/h) ở cam1
+    assert set(measured) == {("cam0", 7), ("cam1", 7)}
+    assert np.allclose(measured[("cam0", 7)], 45.0, rtol=0.02)
+    assert np.allclose(measured[("cam1", 7)], 90.0, rtol=0.02)
+    core.flush()
+    by_cam = {r.camera_id: r for r in trips}
+    assert set(by_cam) == {"cam0", "cam1"} and all(r.track_id == 7 for r in trips)
+    assert abs(by_cam["cam1"].median_kmh - 2 * by_cam["cam0"].median_kmh) < 1.0
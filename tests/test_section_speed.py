@@ -0,0 +1,60 @@
+# tests/test_section_speed.py
+# SectionSpeedMonitor với trip tổng hợp: entry pending -> exit cùng gid -> section_overspeed.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "webrtc"))
+
+from section_speed import Section, SectionSpeedMonitor
+
+# 1 km giữa A và B, giới hạn 60 km/h -> đi hết < 60 s là vi phạm
+SEC = Section("A-B", "A", "B", distance_m=1000.0, limit_kmh=60.0, max_travel_s=300.0)
+
+
+def _trip(track_id, first_ts, last_ts, **kw):
+    return dict(track_id=track_id, class_id=2, first_ts=first_ts, last_ts=last_ts, **kw)
+
+
+def test_section_overspeed_for_same_gid():
+    mon = SectionSpeedMonitor([SEC])
+    assert mon.on_trip("A", 5, _trip(1, 90.0, 100.0, evidence="a_trip.jpg")) == []
+    assert mon.stats()["pending"] == 1
+    # gid khác: không đóng pending của gid 5
+    assert mon.on_trip("B", 6, _trip(2, 130.0, 135.0)) == []
+    (ev,) = mon.on_trip("B", 5, _trip(3, 140.0, 145.0, snapshot="b.jpg"))
+    assert ev["type"] == "section_overspeed" and ev["gid"] == 5
+    assert ev["avg_kmh"] == 90.0 and ev["travel_s"] == 40.0
+    assert (ev["entry_track"], ev["exit_track"]) == (1, 3)
+    assert (ev["entry_snapshot"], ev["exit_snapshot"]) == ("a_trip.jpg", "b.jpg")
+    assert mon.stats() == {"pending": 0, "passed": 1, "violations": 1, "expired": 0}
+
+
+def test_under_limit_passes_without_event():
+    mon = SectionSpeedMonitor([SEC])
+    mon.on_trip("A", 5, _trip(1, 90.0, 100.0))
+    assert mon.on_trip("B", 5, _trip(2, 200.0, 205.0)) == []          # 36 km/h
+    assert mon.stats()["passed"] == 1 and mon.stats()["violations"] == 0
+
+
+def test_rejects_non_positive_and_too_long_travel():
+    mon = SectionSpeedMonitor([SEC])
+    mon.on_trip("A", 5, _trip(1, 90.0, 100.0))
+    assert mon.on_trip("B", 5, _trip(2, 99.0, 104.0)) == []           # dt <= 0
+    mon.on_trip("A", 6, _trip(3, 90.0, 100.0))
+    assert mon.on_trip("B", 6, _trip(4, 100.0, 101.0)) == []          # dt == 0
+    mon.on_trip("A", 7, _trip(5, 190.0, 200.0))
+    assert mon.on_trip("B", 7, _trip(6, 501.0, 505.0)) == []          # dt > max_travel_s
+    assert mon.stats()["passed"] == 0 and mon.stats()["violations"] == 0
+
+
+def test_expire_drops_old_pending_in_order():
+    mon = SectionSpeedMonitor([SEC])
+    for gid, t in ((1, 100.0), (2, 200.0), (3, 300.0)):
+        mon.on_trip("A", gid, _trip(gid, t - 5.0, t))
+    mon.on_trip("A", 4, _trip(4, 445.0, 450.0))                        # 450 - 100 > 300
+    assert mon.stats()["expired"] == 1 and list(mon.pending) == [(0, 2), (0, 3), (0, 4)]
+    assert mon.on_trip("B", 1, _trip(9, 120.0, 125.0)) == []          # gid 1 đã bị xoá
+    capped = SectionSpeedMonitor([SEC], max_pending=2)
+    for gid in range(5):
+        capped.on_trip("A", gid, _trip(gid, 95.0, 100.0 + gid))
+    assert list(capped.pending) == [(0, 3), (0, 4)] and capped.stats()["expired"] == 3
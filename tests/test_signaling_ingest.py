@@ -0,0 +1,68 @@
+# tests/test_signaling_ingest.py
+# Trip thật (TripRecord.to_payload) gửi qua ws_handler phải vào EVENTS của hub.
+import asyncio, json, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "webrtc"))
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import signaling_server as srv
+from event_index import EventIndex
+from speedflow.event_proto import encode_message, WIRE_JSON, WIRE_BINARY
+from speedflow.trips import TripRecord
+
+
+def _trip(track_id=1000042):
+    return TripRecord(track_id=track_id, class_id=2, first_ts=1760680000.0, last_ts=1760680004.5,
+                      entry_xy=(1.234, 2.345), exit_xy=(3.456, 48.9), mean_kmh=71.2, max_kmh=84.6,
+                      median_kmh=72.0, samples=97, camera_id="cam2", exit_kmh=70.4,
+                      snapshot="logs/snapshots/cam2_1000042.jpg", zone="lane1")
+
+
+async def _send_as_pub(messages):
+    srv.EVENTS = EventIndex()
+    async with TestClient(TestServer(srv.make_app())) as client:
+        ws = await client.ws_connect("/ws?room=cam2&role=pub")
+        for m in messages:
+            await (ws.send_bytes(m) if isinstance(m, bytes) else ws.send_str(m))
+        await ws.close()
+        for _ in range(50):
+            if srv.EVENTS.ingested >= len(messages):
+                break
+            await asyncio.sleep(0.01)
+    return srv.EVENTS
+
+
+def test_trip_json_is_ingested():
+    events = asyncio.run(_send_as_pub([encode_message(_trip().to_payload(), WIRE_JSON)]))
+    rows = events.query(["cam2"], kind="trip")
+    assert len(rows) == 1
+    assert rows[0]["track_id"] == 1000042
+    assert rows[0]["max_kmh"] == 84.6
+
+
+def test_trip_binary_is_ingested():
+    events = asyncio.run(_send_as_pub([encode_message(_trip(7).to_payload(), WIRE_BINARY)]))
+    assert [r["track_id"] for r in events.query(["cam2"], kind="trip")] == [7]
+
+
+def test_type_position_does_not_matter():
+    # "type" nằm cuối payload dài (edge đổi thứ tự field) vẫn phải được ingest
+    payload = _trip(9).to_payload()
+    payload.pop("type")
+    payload["pad"] = "x" * 500
+    payload["type"] = "trip"
+    events = asyncio.run(_send_as_pub([json.dumps(payload)]))
+    assert [r["track_id"] for r in events.query(["cam2"], kind="trip")] == [9]
+
+
+def test_trip_is_low_priority_signaling_is_high():
+    trip = encode_message(_trip().to_payload(), WIRE_JSON)
+    assert srv.is_low_priority(trip)
+    assert srv.is_low_priority(encode_message(_trip().to_payload(), WIRE_BINARY))
+    assert srv.is_low_priority('{"type": "probe_stats"}') and srv.is_low_priority("not json")
+    for t in ("offer", "answer", "ice", "viewer_join"):
+        assert not srv.is_low_priority(json.dumps({"pad": "x" * 200, "type": t}))
@@ -0,0 +1,61 @@
+# tests/test_spool_forwarder.py
+# close()/aclose() phải huỷ task phát lại trước khi đóng spool; event requeue không mất.
+import asyncio, sys, threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from speedflow.spool import EventSpool, SpoolForwarder
+
+
+class _FailingWS:
+    async def send(self, msg):
+        raise ConnectionError("uplink down")
+
+
+def test_requeue_then_close_from_other_thread(tmp_path):
+    loop = asyncio.new_event_loop()
+    t = threading.Thread(target=loop.run_forever, daemon=True)
+    t.start()
+    ws = _FailingWS()
+    fwd = SpoolForwarder(EventSpool(tmp_path / "spool"), lambda: ws, fsync_interval_s=0.05)
+    fwd.start(loop)
+    for i in range(5):
+        fwd.publish({"type": "overspeed", "i": i})
+    task = fwd._task
+    fwd.close()
+    assert task.done()
+    loop.call_soon_threadsafe(loop.stop)
+    t.join(2.0)
+    spool = EventSpool(tmp_path / "spool")
+    # gửi thẳng lỗi -> requeue, close() đợi các lần gửi đang bay: cả 5 event đều nằm trong spool
+    assert spool.pending == 5
+    assert fwd.requeued == fwd.live
+    spool.close()
+
+
+def test_aclose_on_loop(tmp_path):
+    async def run():
+        fwd = SpoolForwarder(EventSpool(tmp_path / "spool"), lambda: None, fsync_interval_s=0.05)
+        fwd.start(asyncio.get_running_loop())
+        fwd.publish({"type": "trip", "track_id": 1})
+        await asyncio.sleep(0.1)
+        task = fwd._task
+        await fwd.aclose()
+        return task
+    assert asyncio.run(run()).cancelled()
+    spool = EventSpool(tmp_path / "spool")
+    assert spool.pending == 1
+    spool.close()
+
+
+def test_roll_does_not_fsync_under_lock(tmp_path, monkeypatch):
+    spool = EventSpool(tmp_path / "spool", max_bytes=1 << 20, segment_bytes=4096)
+    calls = []
+    monkeypatch.setattr("speedflow.spool.os.fsync", lambda fd: calls.append(fd))
+    for i in range(200):                    # ~ vài segment -> nhiều lần roll
+        spool.append("x" * 100)
+    assert len(spool._segs) > 2 and calls == []
+    spool.sync()                            # segment đã roll + segment đang ghi
+    assert len(calls) == len(spool._segs)
+    spool.close()
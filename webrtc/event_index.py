@@ -0,0 +1,206 @@
+# event_index.py
+# Kho event trong RAM cho hub: mỗi camera 1 ring buffer sắp theo thời gian (ts, speed, loại event).
+# Query "camera X,Y trong [t0, t1] tốc độ >= N" = searchsorted trên ring + mask NumPy, không quét hết.
+import time
+import numpy as np
+
+KIND_OVERSPEED = 0
+KIND_TRIP = 1
+KIND_HANDOFF = 2
+KIND_SECTION = 3
+KINDS = {"overspeed": KIND_OVERSPEED, "trip": KIND_TRIP, "handoff": KIND_HANDOFF,
+         "section_overspeed": KIND_SECTION}
+
+
+def event_time(payload: dict) -> float:
+    """Thời điểm event (epoch giây) theo payload của edge."""
+    t = payload.get("type")
+    if t == "trip":
+        return float(payload.get("last_ts") or time.time())
+    if t in ("handoff", "section_overspeed"):
+        return float(payload.get("ts") or time.time())
+    return float(payload.get("epoch") or time.time())
+
+
+def event_speed(payload: dict) -> float:
+    t = payload.get("type")
+    if t == "trip":
+        return float(payload.get("max_kmh") or 0.0)
+    if t == "handoff":
+        return float(payload.get("link_kmh") or 0.0)
+    if t == "section_overspeed":
+        return float(payload.get("avg_kmh") or 0.0)
+    return float(payload.get("speed_kmh") or 0.0)
+
+
+class CameraRing:
+    """
+    Ring buffer cố định cho 1 camera, sắp theo ts. Event đến trễ (trip xuất sau khi track kết thúc,
+    event phát lại từ spool sau khi mất uplink) được chèn đúng chỗ: bisect trên phần đuôi rồi dời
+    các event mới hơn 1 ô (thường chỉ vài event). Đầy thì bỏ event cũ nhất.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = int(capacity)
+        self.ts = np.zeros(self.capacity, dtype=np.float64)
+        self.speed = np.zeros(self.capacity, dtype=np.float32)
+        self.kind = np.zeros(self.capacity, dtype=np.int8)
+        self.events = [None] * self.capacity
+        self.head = 0     # vị trí ghi tiếp theo
+        self.count = 0
+        self.late = 0     # số event đến trễ (chèn giữa)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts: float, speed: float, kind: int, event: dict):
+        if self.count and ts < self.ts[(self.head - 1) % self.capacity]:
+            self._insert(ts, speed, kind, event)
+            return
+        h = self.head
+        self.ts[h] = ts
+        self.speed[h] = speed
+        self.kind[h] = kind
+        self.events[h] = event
+        self.head = (h + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _insert(self, ts, speed, kind, event):
+        cap = self.capacity
+        start = (self.head - self.count) % cap
+        # vị trí logic p (số event có ts <= ts mới), tìm từ đoạn mới nhất về trước
+        segs = self._segments()
+        off = self.count
+        for i in range(len(segs) - 1, -1, -1):
+            a, b = segs[i]
+            off -= b - a
+            j = int(np.searchsorted(self.ts[a:b], ts, side="right"))
+            if j > 0 or i == 0:
+                p = off + j
+                break
+        self.late += 1
+        if self.count < cap:
+            # dời [p, count) sang phải 1 ô
+            src = (start + np.arange(p, self.count)) % cap
+            self._move(src, (src + 1) % cap)
+            dst = (start + p) % cap
+            self.head = (self.head + 1) % cap
+            self.count += 1
+        else:
+            if p == 0:
+                return      # cũ hơn mọi event đang giữ: đằng nào cũng bị bỏ
+            # đầy: bỏ event cũ nhất, dời [1, p) sang trái 1 ô
+            src = (start + np.arange(1, p)) % cap
+            self._move(src, (src - 1) % cap)
+            dst = (start + p - 1) % cap
+        self.ts[dst] = ts
+        self.speed[dst] = speed
+        self.kind[dst] = kind
+        self.events[dst] = event
+
+    def _move(self, src, dst):
+        # fancy index trả bản copy -> đoạn chồng nhau vẫn đúng
+        self.ts[dst] = self.ts[src]
+        self.speed[dst] = self.speed[src]
+        self.kind[dst] = self.kind[src]
+        moved = [self.events[i] for i in src]
+        for i, e in zip(dst.tolist(), moved):
+            self.events[i] = e
+
+    def _segments(self):
+        # phần logic [cũ -> mới] của ring = tối đa 2 đoạn liên tục, mỗi đoạn đã sắp xếp
+        start = (self.head - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return [(start, start + self.count)]
+        return [(start, self.capacity), (0, self.head)]
+
+    def evict_before(self, cutoff: float) -> int:
+        n = 0
+        for a, b in self._segments():
+            k = int(np.searchsorted(self.ts[a:b], cutoff, side="left"))
+            for i in range(a, a + k):
+                self.events[i] = None
+            n += k
+            if a + k < b:
+                break
+        self.count -= n
+        return n
+
+    def query(self, t0: float, t1: float, min_speed: float = 0.0, kind=None):
+        out = []
+        for a, b in self._segments():
+            ts = self.ts[a:b]
+            lo = int(np.searchsorted(ts, t0, side="left"))
+            hi = int(np.searchsorted(ts, t1, side="right"))
+            if lo >= hi:
+                continue
+            mask = self.speed[a + lo:a + hi] >= min_speed
+            if kind is not None:
+                mask &= self.kind[a + lo:a + hi] == kind
+            for i in np.flatnonzero(mask):
+                j = a + lo + int(i)
+                out.append((float(self.ts[j]), self.events[j]))
+        return out
+
+
+class EventIndex:
+    """
+    Kho event đa camera:
+    - ingest(camera_id, payload): bỏ ảnh (chỉ giữ path snapshot), ghi vào ring của camera
+    - bộ nhớ giới hạn: capacity_per_camera event/camera, tối đa max_cameras camera
+    - evict(): bỏ event cũ hơn max_age_s
+    - query(cameras, t0, t1, min_speed, kind, limit)
+    """
+    def __init__(self, capacity_per_camera: int = 50_000, max_age_s: float = 6 * 3600,
+                 max_cameras: int = 256):
+        self.capacity_per_camera = int(capacity_per_camera)
+        self.max_age_s = float(max_age_s)
+        self.max_cameras = int(max_cameras)
+        self.rings = {}
+        self.ingested = 0
+        self.rejected = 0
+
+    def ingest(self, camera_id: str, payload: dict) -> bool:
+        kind = KINDS.get(payload.get("type"))
+        if kind is None:
+            return False
+        ring = self.rings.get(camera_id)
+        if ring is None:
+            if len(self.rings) >= self.max_cameras:
+                self.rejected += 1
+                return False
+            ring = self.rings[camera_id] = CameraRing(self.capacity_per_camera)
+        event = {k: v for k, v in payload.items() if k not in ("image_jpeg", "image_b64")}
+        event["camera_id"] = camera_id
+        ring.append(event_time(payload), event_speed(payload), kind, event)
+        self.ingested += 1
+        return True
+
+    def evict(self, now: float = None) -> int:
+        cutoff = (now if now is not None else time.time()) - self.max_age_s
+        n = 0
+        for cam in list(self.rings):
+            ring = self.rings[cam]
+            n += ring.evict_before(cutoff)
+            if not ring.count:
+                del self.rings[cam]
+        return n
+
+    def query(self, cameras=None, t0: float = 0.0, t1: float = float("inf"),
+              min_speed: float = 0.0, kind: str = None, limit: int = 1000):
+        k = KINDS.get(kind) if kind else None
+        cams = self.rings if not cameras else [c for c in cameras if c in self.rings]
+        hits = []
+        for cam in cams:
+            hits.extend(self.rings[cam].query(t0, t1, min_speed, k))
+        if len(cameras or self.rings) > 1:
+            hits.sort(key=lambda x: x[0])
+        return [e for _, e in hits[:max(0, int(limit))]]
+
+    def stats(self) -> dict:
+        return {
+            "cameras": {cam: len(r) for cam, r in self.rings.items()},
+            "ingested": self.ingested,
+            "rejected": self.rejected,
+            "late": sum(r.late for r in self.rings.values()),
+        }
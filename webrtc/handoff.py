@@ -0,0 +1,223 @@
+# handoff.py
+# Ghép track giữa 2 camera liền kề (A -> B) ở tầng điều phối.
+# Exit ở A (thời điểm, vận tốc ra, class) + khoảng cách A->B -> cửa sổ thời gian xe tới B.
+# Exit chờ ghép được đặt vào các bucket thời gian của camera B mà cửa sổ phủ tới; entry mới ở B
+# chỉ xét đúng 1 bucket (không so sánh tất cả các cặp).
+import heapq, itertools, math
+from dataclasses import dataclass, field
+from typing import Optional
+
+import yaml
+
+
+@dataclass
+class Link:
+    from_cam: str
+    to_cam: str
+    distance_m: float
+    tolerance: float = 0.35        # sai số vận tốc tương đối cho phép trên đoạn A->B
+    slack_s: float = 2.0           # nới thêm 2 đầu cửa sổ
+    default_kmh: float = 50.0      # khi exit không có tốc độ hợp lệ
+
+
+@dataclass
+class PendingExit:
+    gid: int
+    camera_id: str
+    track_id: int
+    class_id: int
+    t_exit: float
+    t_pred: float
+    t_lo: float
+    t_hi: float
+    v_kmh: Optional[float]
+    link: Link
+    trip: dict = field(repr=False, default=None)
+    matched: bool = False
+
+
+@dataclass
+class HandoffMatch:
+    gid: int                       # id toàn cục của xe trên hành lang
+    from_cam: str
+    from_track: int
+    to_cam: str
+    to_track: int
+    t_exit: float
+    t_entry: float
+    distance_m: float
+    exit_trip: dict = field(repr=False, default=None)
+    entry_trip: dict = field(repr=False, default=None)
+
+    @property
+    def travel_s(self) -> float:
+        return self.t_entry - self.t_exit
+
+    @property
+    def link_kmh(self) -> Optional[float]:
+        if self.travel_s <= 0:
+            return None
+        return self.distance_m / self.travel_s * 3.6
+
+    def to_payload(self) -> dict:
+        return {
+            "type": "handoff",
+            "ts": round(self.t_entry, 3),
+            "gid": self.gid,
+            "from_cam": self.from_cam, "from_track": self.from_track,
+            "to_cam": self.to_cam, "to_track": self.to_track,
+            "t_exit": round(self.t_exit, 3), "t_entry": round(self.t_entry, 3),
+            "travel_s": round(self.travel_s, 3),
+            "link_kmh": None if self.link_kmh is None else round(self.link_kmh, 1),
+        }
+
+
+def _first_speed(trip: dict, keys) -> Optional[float]:
+    for k in keys:
+        v = trip.get(k)
+        if v:
+            return float(v)
+    return None
+
+
+def exit_speed_kmh(trip: dict) -> Optional[float]:
+    return _first_speed(trip, ("exit_kmh", "median_kmh", "mean_kmh"))
+
+
+def entry_speed_kmh(trip: dict) -> Optional[float]:
+    return _first_speed(trip, ("median_kmh", "mean_kmh", "exit_kmh"))
+
+
+def load_links(yml_path: str):
+    """configs/corridor.yml -> list[Link]."""
+    with open(yml_path, "r") as f:
+        d = yaml.safe_load(f) or {}
+    links = []
+    for it in d.get("LINKS", []):
+        links.append(Link(
+            from_cam=str(it["FROM"]), to_cam=str(it["TO"]), distance_m=float(it["DISTANCE_M"]),
+            tolerance=float(it.get("TOLERANCE", 0.35)), slack_s=float(it.get("SLACK_S", 2.0)),
+            default_kmh=float(it.get("DEFAULT_KMH", 50.0)),
+        ))
+    return links
+
+
+class HandoffMatcher:
+    """
+    - add_exit(cam, trip): đăng ký exit chờ ghép ở mọi camera hạ lưu của cam
+    - match_entry(cam, trip): tìm exit chờ phù hợp nhất trong bucket của first_ts -> HandoffMatch
+      (điểm = sai lệch thời gian tới tương đối + sai lệch tốc độ ra/vào tương đối, class phải khớp)
+    - ingest_trip(cam, trip): cả 2 bước (trip ở B vừa là entry của B vừa là exit tới C)
+    - Thời gian là thời gian event (không phải wall clock) -> chạy được với stream tổng hợp
+    - Bucket cũ hơn watermark - lateness_s bị xoá -> bộ nhớ giới hạn
+    """
+    def __init__(self, links, bucket_s: float = 2.0, lateness_s: float = 120.0,
+                 strict_class: bool = True):
+        self.bucket_s = float(bucket_s)
+        self.lateness_s = float(lateness_s)
+        self.strict_class = bool(strict_class)
+        self.downstream = {}                # from_cam -> [Link]
+        for ln in links:
+            self.downstream.setdefault(ln.from_cam, []).append(ln)
+        self.buckets = {}                   # to_cam -> {bucket: [PendingExit]}
+        self._expiry = []                   # min-heap (bucket, to_cam) theo thứ tự tạo bucket
+        self.watermark = 0.0
+        self._gids = itertools.count(1)
+        self.pending = 0
+        self.matched = 0
+        self.expired = 0
+
+    def _bucket(self, t: float) -> int:
+        return int(math.floor(t / self.bucket_s))
+
+    def add_exit(self, camera_id: str, trip: dict, gid: int = None):
+        links = self.downstream.get(camera_id)
+        if not links:
+            return None
+        t_exit = float(trip["last_ts"])
+        self._advance(t_exit)
+        v_kmh = exit_speed_kmh(trip)
+        if gid is None:
+            gid = next(self._gids)
+        out = []
+        for ln in links:
+            v = (v_kmh or ln.default_kmh) / 3.6
+            tol = ln.tolerance
+            p = PendingExit(
+                gid=gid, camera_id=camera_id, track_id=int(trip["track_id"]),
+                class_id=int(trip.get("class_id", -1)), t_exit=t_exit,
+                t_pred=t_exit + ln.distance_m / v,
+                t_lo=t_exit + ln.distance_m / (v * (1.0 + tol)) - ln.slack_s,
+                t_hi=t_exit + ln.distance_m / (v * max(1.0 - tol, 0.1)) + ln.slack_s,
+                v_kmh=v_kmh, link=ln, trip=trip,
+            )
+            idx = self.buckets.setdefault(ln.to_cam, {})
+            for b in range(self._bucket(p.t_lo), self._bucket(p.t_hi) + 1):
+                lst = idx.get(b)
+                if lst is None:
+                    lst = idx[b] = []
+                    heapq.heappush(self._expiry, (b, ln.to_cam))
+                lst.append(p)
+            self.pending += 1
+            out.append(p)
+        return out
+
+    def match_entry(self, camera_id: str, trip: dict) -> Optional[HandoffMatch]:
+        idx = self.buckets.get(camera_id)
+        if not idx:
+            return None
+        t = float(trip["first_ts"])
+        cls = int(trip.get("class_id", -1))
+        v_in = entry_speed_kmh(trip)
+        best, best_score = None, None
+        for p in idx.get(self._bucket(t), ()):
+            if p.matched or not (p.t_lo <= t <= p.t_hi):
+                continue
+            # sai lệch tương đối so với thời gian đi dự đoán (~ sai số vận tốc)
+            score = abs(t - p.t_pred) / max(p.t_pred - p.t_exit, 1e-3)
+            # + sai lệch giữa tốc độ ra ở A và tốc độ vào ở B (nếu cả 2 đều đo được)
+            if v_in and p.v_kmh:
+                score += abs(v_in - p.v_kmh) / p.v_kmh
+            if p.class_id != cls:
+                if self.strict_class:
+                    continue
+                score += 0.5
+            if best_score is None or score < best_score:
+                best, best_score = p, score
+        if best is None:
+            return None
+        best.matched = True
+        self.matched += 1
+        self.pending -= 1
+        return HandoffMatch(
+            gid=best.gid, from_cam=best.camera_id, from_track=best.track_id,
+            to_cam=camera_id, to_track=int(trip["track_id"]),
+            t_exit=best.t_exit, t_entry=t, distance_m=best.link.distance_m,
+            exit_trip=best.trip, entry_trip=trip,
+        )
+
+    def ingest_trip(self, camera_id: str, trip: dict):
+        """-> (gid, HandoffMatch | None). gid mới nếu trip không ghép được với exit nào."""
+        m = self.match_entry(camera_id, trip)
+        gid = m.gid if m else next(self._gids)
+        self.add_exit(camera_id, trip, gid=gid)
+        return gid, m
+
+    def _advance(self, t: float):
+        if t <= self.watermark:
+            return
+        self.watermark = t
+        cutoff = self._bucket(t - self.lateness_s)
+        # chỉ lấy các bucket đã hết hạn từ đỉnh heap, không quét mọi key
+        while self._expiry and self._expiry[0][0] < cutoff:
+            b, cam = heapq.heappop(self._expiry)
+            for p in self.buckets[cam].pop(b, ()):
+                # exit nằm ở nhiều bucket: chỉ đếm 1 lần ở bucket cuối của nó
+                if not p.matched and self._bucket(p.t_hi) == b:
+                    p.matched = True
+                    self.expired += 1
+                    self.pending -= 1
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "matched": self.matched, "expired": self.expired,
+                "buckets": sum(len(v) for v in self.buckets.values())}
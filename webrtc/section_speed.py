@@ -0,0 +1,122 @@
+# section_speed.py
+# Tốc độ trung bình trên đoạn (section) giữa 2 camera: quãng đường khảo sát / thời gian đi.
+# Dựa trên gid từ HandoffMatcher: trip ở camera ENTRY -> lưu pending; trip cùng gid ở camera EXIT
+# -> tính tốc độ trung bình, vượt LIMIT_KMH thì sinh event "section_overspeed".
+# Mọi thao tác O(1) mỗi event; pending quá MAX_TRAVEL_S bị xoá theo thứ tự chèn.
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import yaml
+
+
+@dataclass
+class Section:
+    name: str
+    entry_cam: str
+    exit_cam: str
+    distance_m: float            # quãng đường khảo sát: từ lúc rời vùng ENTRY tới lúc vào vùng EXIT
+    limit_kmh: float
+    max_travel_s: float = 600.0  # pending lâu hơn -> bỏ (xe rẽ/dừng/không ghép được)
+
+
+@dataclass
+class PendingEntry:
+    t_entry: float
+    track_id: int
+    snapshot: Optional[str]
+
+
+def trip_image(trip: dict):
+    """Ảnh bằng chứng của trip (mọi xe, TRIP_EVIDENCE); edge cũ chỉ có ảnh overspeed."""
+    return trip.get("evidence") or trip.get("snapshot")
+
+
+def load_sections(yml_path: str):
+    """configs/corridor.yml (SECTIONS) -> list[Section]."""
+    with open(yml_path, "r") as f:
+        d = yaml.safe_load(f) or {}
+    out = []
+    for it in d.get("SECTIONS", []):
+        out.append(Section(
+            name=str(it.get("NAME", f"{it['ENTRY']}-{it['EXIT']}")),
+            entry_cam=str(it["ENTRY"]), exit_cam=str(it["EXIT"]),
+            distance_m=float(it["DISTANCE_M"]), limit_kmh=float(it["LIMIT_KMH"]),
+            max_travel_s=float(it.get("MAX_TRAVEL_S", 600.0)),
+        ))
+    return out
+
+
+class SectionSpeedMonitor:
+    """
+    on_trip(cam, gid, trip) -> list[dict] event section_overspeed
+    - pending: OrderedDict (section_idx, gid) -> PendingEntry, chèn theo thời gian
+    - expire: bỏ pending cũ từ đầu OrderedDict (amortized O(1)), tổng số pending <= max_pending
+    """
+    def __init__(self, sections, max_pending: int = 100_000):
+        self.sections = list(sections)
+        self.max_pending = int(max_pending)
+        self.by_entry = {}
+        self.by_exit = {}
+        for i, sec in enumerate(self.sections):
+            self.by_entry.setdefault(sec.entry_cam, []).append(i)
+            self.by_exit.setdefault(sec.exit_cam, []).append(i)
+        self.pending = OrderedDict()
+        self.passed = 0
+        self.violations = 0
+        self.expired = 0
+
+    def on_trip(self, camera_id: str, gid: int, trip: dict):
+        events = []
+        # 1) camera là EXIT của section: tìm entry cùng gid
+        for i in self.by_exit.get(camera_id, ()):
+            pe = self.pending.pop((i, gid), None)
+            if pe is None:
+                continue
+            ev = self._close(self.sections[i], gid, pe, camera_id, trip)
+            if ev is not None:
+                events.append(ev)
+        # 2) camera là ENTRY của section: đăng ký pending (thời điểm rời vùng ENTRY)
+        t_last = float(trip["last_ts"])
+        for i in self.by_entry.get(camera_id, ()):
+            self.pending[(i, gid)] = PendingEntry(t_last, int(trip["track_id"]), trip_image(trip))
+        self._expire(t_last)
+        return events
+
+    def _close(self, sec: Section, gid: int, pe: PendingEntry, camera_id: str, trip: dict):
+        t_exit = float(trip["first_ts"])
+        dt = t_exit - pe.t_entry
+        if dt <= 0 or dt > sec.max_travel_s:
+            return None
+        self.passed += 1
+        avg_kmh = sec.distance_m / dt * 3.6
+        if avg_kmh < sec.limit_kmh:
+            return None
+        self.violations += 1
+        return {
+            "type": "section_overspeed",
+            "ts": round(t_exit, 3),
+            "section": sec.name,
+            "gid": gid,
+            "avg_kmh": round(avg_kmh, 1),
+            "limit_kmh": sec.limit_kmh,
+            "distance_m": sec.distance_m,
+            "travel_s": round(dt, 3),
+            "entry_cam": sec.entry_cam, "entry_track": pe.track_id,
+            "entry_ts": round(pe.t_entry, 3), "entry_snapshot": pe.snapshot,
+            "exit_cam": camera_id, "exit_track": int(trip["track_id"]),
+            "exit_ts": round(t_exit, 3), "exit_snapshot": trip_image(trip),
+        }
+
+    def _expire(self, now: float):
+        while self.pending:
+            key, pe = next(iter(self.pending.items()))
+            if len(self.pending) <= self.max_pending and \
+                    now - pe.t_entry <= self.sections[key[0]].max_travel_s:
+                break
+            self.pending.popitem(last=False)
+            self.expired += 1
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "passed": self.passed,
+                "violations": self.violations, "expired": self.expired}
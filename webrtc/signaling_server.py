@@ -1,40 +1,318 @@
 # signaling_server.py
-import asyncio, json
+import asyncio, json, argparse, itertools, sys, time
+from collections import deque
+from pathlib import Path
 from aiohttp import web, WSMsgType
 
-# Lưu kết nối WS theo room
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from speedflow.event_proto import decode_binary
+from event_index import EventIndex, KINDS
+from handoff import HandoffMatcher, load_links
+from section_speed import SectionSpeedMonitor, load_sections
+
+# Mỗi peer có hàng đợi gửi riêng + task gửi riêng -> 1 browser chậm không làm chậm cả room
+PEER_QUEUE_MAX  = 64
+OVERFLOW_POLICY = "drop"          # "drop": bỏ message ưu tiên thấp | "disconnect": ngắt peer chậm
+# chỉ signaling được ưu tiên; mọi thứ khác (overspeed, trip, stats, binary, JSON lạ) là event, bị drop trước
+SIGNAL_TYPES = {"offer", "answer", "ice", "viewer_join", "viewer_leave"}
+
+# Nhiều viewer / 1 encode (run_webrtc.py --max-viewers): pub nhận viewer_join/viewer_leave, gửi offer/ice
+# kèm "to": <peer id>; answer/ice của sub được thêm "from": <peer id> và chỉ gửi cho pub.
+SUB_SIGNAL_TYPES = {"answer", "ice"}
+_PEER_IDS = itertools.count(1)
+
+
+def is_low_priority(data, payload=None) -> bool:
+    """Mọi message trừ signaling (SIGNAL_TYPES); phân loại theo type đã parse, không theo vị trí trong chuỗi."""
+    if isinstance(data, (bytes, bytearray)):
+        return True
+    if payload is None:
+        payload = parse_message(data)
+    return payload is None or payload.get("type") not in SIGNAL_TYPES
+
+
+class Peer:
+    """
+    - high: signaling, low: event; sender task luôn gửi high trước
+    - đầy (high + low >= max_queue):
+        drop       -> bỏ message low mới (high mới thì đẩy low cũ nhất ra)
+        disconnect -> đóng kết nối của peer chậm
+    """
+    def __init__(self, ws, room, role, max_queue=PEER_QUEUE_MAX, policy=OVERFLOW_POLICY):
+        self.id = next(_PEER_IDS)
+        self.ws = ws
+        self.room = room
+        self.role = role
+        self.max_queue = max(1, int(max_queue))
+        self.policy = policy
+        self.high = deque()
+        self.low = deque()
+        self._wake = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.closing = False
+        self.task = asyncio.create_task(self._sender())
+
+    def depth(self) -> int:
+        return len(self.high) + len(self.low)
+
+    def enqueue(self, data, low=None) -> bool:
+        if self.closing:
+            return False
+        if low is None:
+            low = is_low_priority(data)
+        if self.depth() >= self.max_queue:
+            if self.policy == "disconnect":
+                self.dropped += 1
+                self.close("send queue overflow")
+                return False
+            if low or not self.low:
+                # low mới bị bỏ; high mà không còn low để nhường chỗ thì peer đã chết -> bỏ
+                self.dropped += 1
+                return False
+            self.low.popleft()
+            self.dropped += 1
+        (self.low if low else self.high).append(data)
+        self._wake.set()
+        return True
+
+    def close(self, reason=""):
+        if self.closing:
+            return
+        self.closing = True
+        print(f"[SRV] closing peer {self.id} room={self.room}: {reason}")
+        self._wake.set()
+        asyncio.create_task(self.ws.close())
+
+    def stop(self):
+        # gọi khi WS đã đóng: huỷ sender task, bỏ các message còn chờ
+        self.closing = True
+        self.high.clear()
+        self.low.clear()
+        self.task.cancel()
+
+    def stats(self) -> dict:
+        return {"id": self.id, "role": self.role, "depth": self.depth(),
+                "high": len(self.high), "low": len(self.low),
+                "sent": self.sent, "dropped": self.dropped}
+
+    async def _sender(self):
+        try:
+            while not self.closing:
+                if not self.high and not self.low:
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                data = self.high.popleft() if self.high else self.low.popleft()
+                if isinstance(data, (bytes, bytearray)):
+                    await self.ws.send_bytes(data)
+                else:
+                    await self.ws.send_str(data)
+                self.sent += 1
+        except (ConnectionResetError, RuntimeError) as e:
+            print(f"[SRV] peer {self.id} send failed:", e)
+            self.closing = True
+
+
+# Lưu peer theo room
 ROOMS = {}
+# Hub: event overspeed/trip của mọi edge (pub) trong mọi room
+EVENTS = EventIndex()
+EVICT_INTERVAL_S = 5.0
+# Ghép xe giữa các camera liền kề (bật bằng --corridor configs/corridor.yml)
+HANDOFF = None
+# Tốc độ trung bình theo đoạn (SECTIONS trong cùng file corridor)
+SECTIONS = None
+
+
+def parse_message(data):
+    """-> payload dict của message (JSON hoặc header msgpack của frame binary), None nếu không đọc được."""
+    try:
+        if isinstance(data, (bytes, bytearray)):
+            payload, _ = decode_binary(data)
+        else:
+            payload = json.loads(data)
+    except Exception:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def ingest_event(room, payload):
+    """Ghi event từ publisher vào EVENTS (camera = camera_id trong payload, mặc định = room)."""
+    cam = str(payload.get("camera_id") or room)
+    EVENTS.ingest(cam, payload)
+    if HANDOFF is not None and payload.get("type") == "trip":
+        gid, m = HANDOFF.ingest_trip(cam, payload)
+        if m is not None:
+            EVENTS.ingest(m.to_cam, m.to_payload())
+        if SECTIONS is not None:
+            for ev in SECTIONS.on_trip(cam, gid, payload):
+                EVENTS.ingest(ev["exit_cam"], ev)
+                print(f"[SRV] section overspeed {ev['section']}: {ev['avg_kmh']} km/h (gid={gid})")
+
+
+def fanout(peers, sender, data, low=None):
+    # không await: chỉ đẩy vào hàng đợi từng peer (phân loại 1 lần cho cả room)
+    if low is None:
+        low = is_low_priority(data)
+    for p in list(peers):
+        if p is not sender:
+            p.enqueue(data, low)
+
+
+def send_to(peers, peer_id, data, low=False):
+    for p in peers:
+        if p.id == peer_id:
+            p.enqueue(data, low)
+            return
+
+
+def notify_pubs(peers, t, sub_id):
+    data = json.dumps({"type": t, "peer": sub_id})
+    for p in list(peers):
+        if p.role == "pub":
+            p.enqueue(data, False)
+
+
+def route_text(peers, peer, data, payload):
+    """Signaling có đích (to/from) đi riêng 1 peer; còn lại broadcast trong room như cũ."""
+    low = is_low_priority(data, payload)
+    if not low:
+        if peer.role == "pub":
+            to = payload.get("to")
+            if isinstance(to, int):
+                send_to(peers, to, data)
+                return
+        elif payload.get("type") in SUB_SIGNAL_TYPES:
+            data = json.dumps({**payload, "from": peer.id})
+            for p in list(peers):
+                if p.role == "pub":
+                    p.enqueue(data, False)
+            return
+    fanout(peers, peer, data, low)
+
+
 async def ws_handler(request):
     ws = web.WebSocketResponse()
     await ws.prepare(request)
     room = request.query.get("room", "demo")
+    role = request.query.get("role", "sub")
+    cfg = request.app["peer_cfg"]
+    peer = Peer(ws, room, role, **cfg)
     peers = ROOMS.setdefault(room, set())
-    peers.add(ws)
+    if role == "pub":
+        for p in peers:
+            if p.role != "pub":
+                peer.enqueue(json.dumps({"type": "viewer_join", "peer": p.id}), False)
+    else:
+        notify_pubs(peers, "viewer_join", peer.id)
+    peers.add(peer)
     try:
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
-                # Broadcast cho các peer khác cùng room
-                data = msg.data
-                for p in list(peers):
-                    if p is not ws:
-                        await p.send_str(data)
-            elif msg.type == WSMsgType.ERROR:
-                print("ws error:", ws.exception())
+                # parse 1 lần: dùng cho ưu tiên, định tuyến to/from và ingest
+                payload = parse_message(msg.data)
+                route_text(peers, peer, msg.data, payload)
+            elif msg.type == WSMsgType.BINARY:
+                # event binary (header msgpack + JPEG): relay nguyên vẹn, chỉ hub decode header
+                fanout(peers, peer, msg.data, True)
+                payload = parse_message(msg.data) if role == "pub" else None
+            else:
+                if msg.type == WSMsgType.ERROR:
+                    print("ws error:", ws.exception())
+                continue
+            if role == "pub":
+                # phân loại theo payload đã parse, không phụ thuộc thứ tự field trong JSON
+                if payload is None:
+                    print("[SRV] bad event from", room)
+                elif payload.get("type") in KINDS:
+                    ingest_event(room, payload)
     finally:
-        peers.discard(ws)
+        peer.stop()
+        peers.discard(peer)
+        if role != "pub":
+            notify_pubs(peers, "viewer_leave", peer.id)
         if not peers:
             ROOMS.pop(room, None)
     return ws
 
+async def stats(request):
+    """Độ sâu hàng đợi + số message bị drop của từng peer."""
+    return web.json_response({room: [p.stats() for p in peers] for room, peers in ROOMS.items()})
+
+async def events(request):
+    """
+    GET /events?cameras=a,b&t0=<epoch>&t1=<epoch>&min_speed=80&type=overspeed|trip&limit=1000
+    """
+    q = request.query
+    try:
+        cams = [c for c in q.get("cameras", "").split(",") if c]
+        t0 = float(q.get("t0", 0.0))
+        t1 = float(q.get("t1", "inf"))
+        min_speed = float(q.get("min_speed", 0.0))
+        limit = int(q.get("limit", 1000))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    t = time.perf_counter()
+    rows = EVENTS.query(cams, t0, t1, min_speed, q.get("type"), limit)
+    return web.json_response({"events": rows, "query_ms": round((time.perf_counter() - t) * 1e3, 3)})
+
+async def events_stats(request):
+    st = EVENTS.stats()
+    if HANDOFF is not None:
+        st["handoff"] = HANDOFF.stats()
+    if SECTIONS is not None:
+        st["sections"] = SECTIONS.stats()
+    return web.json_response(st)
+
+async def _evict_loop(app):
+    while True:
+        await asyncio.sleep(EVICT_INTERVAL_S)
+        EVENTS.evict()
+
+async def _start_background(app):
+    app["evict_task"] = asyncio.create_task(_evict_loop(app))
+
+async def _stop_background(app):
+    app["evict_task"].cancel()
+
 async def index(request):
     return web.FileResponse('./index.html')
 
-app = web.Application()
-app.router.add_get('/', index)
-app.router.add_get('/ws', ws_handler)
+def make_app(max_queue=PEER_QUEUE_MAX, policy=OVERFLOW_POLICY):
+    app = web.Application()
+    app["peer_cfg"] = {"max_queue": max_queue, "policy": policy}
+    app.router.add_get('/', index)
+    app.router.add_get('/ws', ws_handler)
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/events', events)
+    app.router.add_get('/events/stats', events_stats)
+    app.on_startup.append(_start_background)
+    app.on_cleanup.append(_stop_background)
+    return app
+
+app = make_app()
 
 if __name__ == "__main__":
-    web.run_app(app, host="0.0.0.0", port=8080)
+    parser = argparse.ArgumentParser(description="WebSocket signaling/relay server")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--queue-max", type=int, default=PEER_QUEUE_MAX, help="số message chờ gửi tối đa mỗi peer")
+    parser.add_argument("--overflow", default=OVERFLOW_POLICY, choices=["drop", "disconnect"],
+                        help="xử lý peer chậm khi hàng đợi đầy")
+    parser.add_argument("--events-per-camera", type=int, default=EVENTS.capacity_per_camera,
+                        help="số event giữ trong RAM cho mỗi camera")
+    parser.add_argument("--events-max-age", type=float, default=EVENTS.max_age_s,
+                        help="bỏ event cũ hơn N giây")
+    parser.add_argument("--corridor", default=None,
+                        help="YAML LINKS (ghép xe giữa camera) + SECTIONS (tốc độ trung bình theo đoạn)")
+    args = parser.parse_args()
+    EVENTS = EventIndex(capacity_per_camera=args.events_per_camera, max_age_s=args.events_max_age)
+    if args.corridor:
+        HANDOFF = HandoffMatcher(load_links(args.corridor))
+        sections = load_sections(args.corridor)
+        if sections:
+            SECTIONS = SectionSpeedMonitor(sections)
+    web.run_app(make_app(args.queue_max, args.overflow), host="0.0.0.0", port=args.port)
 
 
 # signaling_server.py